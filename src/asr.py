@@ -3,14 +3,22 @@ import io
 import json
 import logging
 import os
+import subprocess
 import sys
-from typing import Union
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Deque, Dict, Iterable, Iterator, Optional, Set, Tuple, Union
 
 import pydub
 
+import metrics
+from asr_cache import ASRCache
+from dispatch import TokenBucket, dispatch
 from log import LOGGING_FMT
-from speech.google import transcribe_google
-from speech.yandex import transcribe_yandex
+from manifest import ManifestWriter, open_store
+from speech.google import GoogleRecognizer
+from speech.ogg import OPUS_PROBE_SIZE, OPUS_SAMPLERATE, opus_head, opus_samplerate
+from speech.yandex import YANDEX_STT_URL, YandexRecognizer
 
 logger = logging.getLogger("asr")
 logger.setLevel(logging.INFO)
@@ -22,14 +30,47 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
-SUPPORTED_EXT = [".wav", ".aiff", ".ogg", ".mp3", ".m4a", ".wma"]
+SUPPORTED_EXT = [".wav", ".flac", ".aiff", ".ogg", ".opus", ".mp3", ".m4a", ".wma"]
+TRANSCODE_WORKERS = os.cpu_count() or 1
+# sample rate declared for audio which is not Ogg/Opus
+SAMPLE_RATE = 48000
+
+
+def is_compatible(filename: str) -> bool:
+    """
+        .. py:function:: is_compatible(filename)
+
+        Check if file could be sent to ASR engines as is: mono Ogg/Opus, like chunks written by split.py.
+        Only identification header is read, file is not decoded.
+
+        :param str filename: File name
+
+        :return: True if file is mono Ogg/Opus
+        :rtype: bool
+    """
+    with open(filename, "rb") as f:
+        head = opus_head(f.read(OPUS_PROBE_SIZE))
+    return head is not None and head[0] == 1
+
+
+def _transcode(filename: str) -> bytes:
+    # bitexact output has fixed stream serial and encoder tag, input tags are dropped,
+    # so the same audio always gives the same bytes and ASR cache key
+    command = [
+        pydub.AudioSegment.converter, "-nostdin", "-v", "error", "-i", filename, "-vn", "-map_metadata", "-1",
+        "-ac", "1", "-ar", str(OPUS_SAMPLERATE), "-acodec", "opus", "-strict", "-2",
+        "-fflags", "+bitexact", "-flags:a", "+bitexact", "-f", "ogg", "pipe:1",
+    ]
+    return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
 
 
 def prepare_file(filename: str, to: str = "ogg") -> Union[io.BytesIO, None]:
     """
         .. py:function:: prepare_file(filename, to)
 
-        Convert audio fragment to compatible format for sending to ASR engines
+        Convert audio fragment to compatible format for sending to ASR engines.
+        Compatible Ogg/Opus files are passed through, others are transcoded to mono Ogg/Opus
+        by a single ffmpeg process.
 
         :param str filename: File name
         :param str to: Output format (default="ogg")
@@ -41,17 +82,294 @@ def prepare_file(filename: str, to: str = "ogg") -> Union[io.BytesIO, None]:
     if ext not in SUPPORTED_EXT:
         return None
 
+    if to == "ogg":
+        if is_compatible(filename):
+            with open(filename, "rb") as f:
+                return io.BytesIO(f.read())
+        with metrics.timer("asr.transcode"):
+            return io.BytesIO(_transcode(filename))
+
     buf = io.BytesIO()
     audio = pydub.AudioSegment.from_file(filename)
-
-    if to == "ogg":
-        return audio.export(buf, "ogg", "opus", parameters=["-strict", "-2"])
     return audio.export(buf, ext.replace(".", ""))
 
 
-def process(input_dir: str, iam_token: str, folder_id: str, jsonfile: str, language: str, limit: int = None) -> None:
+def _read_prepared(filename: str) -> Optional[bytes]:
+    try:
+        file = prepare_file(filename)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error while transcoding chunk {filename}: {e.stderr.decode(errors='replace').strip()}")
+        return None
+    if not file:
+        return None
+    with file as f:
+        return f.read()
+
+
+def prepare_files(filenames: Iterable[str], workers: int = TRANSCODE_WORKERS) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """
+        .. py:function:: prepare_files(filenames, workers)
+
+        Prepare audio fragments in a thread pool. Transcoding is done by ffmpeg processes,
+        so threads run them in parallel. Files are read lazily, no more than two per thread are in flight.
+        Prepared fragments are returned as soon as they and all previous ones are ready,
+        so slowly produced file names are not held back until the pool is full.
+
+        :param Iterable filenames: File names
+        :param int workers: Number of concurrent transcodings, 1 for serial
+
+        :return: Iterator over file name and prepared audio in original order, audio is None for unsupported files
+        :rtype: Iterator[tuple]
+    """
+    if workers <= 1:
+        for filename in filenames:
+            yield filename, _read_prepared(filename)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: Deque = deque()
+        for filename in filenames:
+            pending.append((filename, executor.submit(_read_prepared, filename)))
+            while pending and (len(pending) >= workers * 2 or pending[0][1].done()):
+                filename, future = pending.popleft()
+                yield filename, future.result()
+
+        while pending:
+            filename, future = pending.popleft()
+            yield filename, future.result()
+
+
+def load_journal(journal_path: str) -> Dict[str, Optional[str]]:
+    """
+        .. py:function:: load_journal(journal_path)
+
+        Read ASR results journal. Broken lines, e.g. partially written on crash, are skipped.
+
+        :param str journal_path: Path to JSONL journal
+
+        :return: ASR result for each chunk file name
+        :rtype: dict
+    """
+    results = {}  # type: Dict[str, Optional[str]]
+    if not os.path.exists(journal_path):
+        return results
+
+    with open(journal_path, "r", encoding="utf-8") as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            results[entry["filename"]] = entry["asr"]
+    return results
+
+
+def merge_journal(jsonfile: str, journal_path: str) -> None:
+    """
+        .. py:function:: merge_journal(jsonfile, journal_path)
+
+        Merge ASR results journal into JSON File. JSON File is replaced atomically.
+
+        :param str jsonfile: Path to JSON File
+        :param str journal_path: Path to JSONL journal
+
+        :return: None
+        :rtype: None
+    """
+    with open(jsonfile, "r") as json_f:
+        data = json.load(json_f)
+    for (fname, asr_string) in load_journal(journal_path).items():
+        data[fname]["asr"] = asr_string
+
+    with open(jsonfile + ".tmp", "w") as json_f:
+        json.dump(data, json_f, ensure_ascii=False)
+        json_f.flush()
+        os.fsync(json_f.fileno())
+    os.replace(jsonfile + ".tmp", jsonfile)
+
+
+def make_recognizer(
+    language: str, iam_token: Optional[str], folder_id: Optional[str], endpoint: str = YANDEX_STT_URL
+) -> Tuple[str, Union[YandexRecognizer, GoogleRecognizer]]:
+    """
+        .. py:function:: make_recognizer(language, iam_token, folder_id, endpoint)
+
+        Choose ASR engine by language: Yandex SpeechKit for ru-RU, Google Speech To Text otherwise
+
+        :param str language: Language Code, e.g. ru-RU, en-US
+        :param str [iam_token]: (Optional) IAM Token for Yandex Cloud
+        :param str [folder_id]: (Optional) Folder id for Yandex Cloud
+        :param str endpoint: Yandex SpeechKit recognition endpoint URL
+
+        :return: Engine name and recognizer
+        :rtype: tuple
+    """
+    if language == "ru-RU":
+        return "yandex", YandexRecognizer(iam_token, folder_id, language, endpoint)
+    return "google", GoogleRecognizer(language, sample_rate=SAMPLE_RATE)
+
+
+def _requests(
+    paths: Iterable[str],
+    cache: Optional[ASRCache],
+    engine: str,
+    language: str,
+    transcode_workers: int,
+    ready: Dict[str, Tuple[Optional[str], Optional[Exception]]],
+    cache_keys: Dict[str, Tuple[str, int]],
+) -> Iterator[Tuple[str, Optional[Tuple[bytes]]]]:
+    """
+        .. py:function:: _requests(paths, cache, engine, language, transcode_workers, ready, cache_keys)
+
+        Prepare audio fragments for ASR requests. Fragments which could not be prepared and cache hits
+        are not requested: their results are put to ready dict and they are returned without arguments,
+        so dispatch passes them through as soon as they are looked up.
+
+        :param Iterable paths: Audio fragment paths
+        :param ASRCache [cache]: (Optional) ASR results cache
+        :param str engine: Engine name
+        :param str language: Language Code
+        :param int transcode_workers: Number of concurrent transcodings of incompatible chunks
+        :param dict ready: Result and error of every fragment not requested
+        :param dict cache_keys: Cache key and sample rate of every requested fragment, filled for cache misses
+
+        :return: Iterator over file name and request arguments
+        :rtype: Iterator[tuple]
+    """
+    for path, audio_data in prepare_files(paths, transcode_workers):
+        filename = os.path.basename(path)
+        if audio_data is None:
+            metrics.count("asr.errors")
+            ready[filename] = None, ValueError("Unsupported or broken audio")
+            yield filename, None
+            continue
+
+        if cache:
+            audio_rate = opus_samplerate(audio_data) or SAMPLE_RATE
+            key = cache.key(audio_data, engine, language, audio_rate)
+            found, result = cache.get(key)
+            if found:
+                metrics.count("asr.cache_hits")
+                ready[filename] = result, None
+                yield filename, None
+                continue
+            cache_keys[filename] = key, audio_rate
+        yield filename, (audio_data,)
+
+
+def transcribe(
+    paths: Iterable[str],
+    recognizer: Union[YandexRecognizer, GoogleRecognizer],
+    engine: str,
+    language: str,
+    concurrency: int = 4,
+    bucket: Optional[TokenBucket] = None,
+    retries: int = 3,
+    cache: Optional[ASRCache] = None,
+    transcode_workers: int = TRANSCODE_WORKERS,
+) -> Iterator[Tuple[str, Optional[str], Optional[Exception]]]:
+    """
+        .. py:function:: transcribe(
+            paths, recognizer, engine, language, concurrency, bucket, retries, cache, transcode_workers)
+
+        Transcribe audio fragments. Paths are consumed lazily, so they could be produced
+        while transcription goes on.
+
+        :param Iterable paths: Audio fragment paths
+        :param recognizer: Recognizer of engine
+        :param str engine: Engine name
+        :param str language: Language Code
+        :param int concurrency: Number of concurrent ASR requests
+        :param TokenBucket [bucket]: (Optional) Rate limiter
+        :param int retries: Max number of retries on transient errors
+        :param ASRCache [cache]: (Optional) ASR results cache
+        :param int transcode_workers: Number of concurrent transcodings of incompatible chunks
+
+        :return: Iterator over file name, result and error of each fragment in order of completion,
+            fragments which could not be prepared have error too
+        :rtype: Iterator[tuple]
+    """
+    ready = {}  # type: Dict[str, Tuple[Optional[str], Optional[Exception]]]
+    cache_keys = {}  # type: Dict[str, Tuple[str, int]]
+
+    def recognize(audio_data):
+        metrics.count("asr.requests")
+        metrics.count("asr.bytes_sent", len(audio_data))
+        with metrics.timer("asr.request"):
+            return recognizer.recognize(audio_data)
+
+    tasks = _requests(paths, cache, engine, language, transcode_workers, ready, cache_keys)
+    for filename, result, error in dispatch(tasks, recognize, concurrency, bucket, retries):
+        if filename in ready:
+            yield (filename,) + ready.pop(filename)
+            continue
+        metrics.count("asr.errors" if error else "asr.chunks")
+        if cache and not error:
+            key, audio_rate = cache_keys.pop(filename)
+            cache.put(key, result, engine, language, audio_rate)
+        yield filename, result, error
+
+
+def _resumed(jsonfile: str, journal_path: str) -> Set[str]:
+    """
+        .. py:function:: _resumed(jsonfile, journal_path)
+
+        Chunks transcribed by previous run: found in journal or having ASR result in JSON File
+
+        :param str jsonfile: Path to JSON File
+        :param str journal_path: Path to JSONL journal
+
+        :return: Chunk file names
+        :rtype: set[str]
+    """
+    done = set(load_journal(journal_path))
+    with open(jsonfile, "r") as json_f:
+        done.update(fname for fname, item in json.load(json_f).items() if item.get("asr"))
+    logger.info(f"Resuming, {len(done)} chunks already transcribed")
+    return done
+
+
+def _record(filename: str, result: Optional[str], writer: Optional[ManifestWriter], journal: Optional[IO]) -> None:
     """
-        .. py:function:: process(input_dir, iam_token, folder_id, jsonfile, language, limit)
+        .. py:function:: _record(filename, result, writer, journal)
+
+        Store ASR result of a chunk as soon as it is received: in manifest by batches if set, otherwise in journal
+
+        :param str filename: Chunk file name
+        :param str [result]: ASR result
+        :param ManifestWriter [writer]: (Optional) Buffer of manifest updates
+        :param file [journal]: (Optional) JSONL journal opened for append
+    """
+    if writer:
+        writer.set_asr(filename, result)
+        return
+    journal.write(json.dumps({"filename": filename, "asr": result}, ensure_ascii=False) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def process(
+    input_dir: str,
+    iam_token: str,
+    folder_id: str,
+    jsonfile: str,
+    language: str,
+    limit: int = None,
+    concurrency: int = 4,
+    rate: Optional[float] = None,
+    retries: int = 3,
+    endpoint: str = YANDEX_STT_URL,
+    cache_path: Optional[str] = None,
+    cache_max_entries: Optional[int] = None,
+    cache_max_age: Optional[float] = None,
+    resume: bool = False,
+    transcode_workers: int = TRANSCODE_WORKERS,
+    manifest_db: Optional[str] = None,
+) -> None:
+    """
+        .. py:function:: process(
+            input_dir, iam_token, folder_id, jsonfile, language, limit, concurrency, rate, retries, endpoint,
+            cache_path, cache_max_entries, cache_max_age, resume, transcode_workers, manifest_db)
 
         Processing input audio fragments through ASR engine and resulting into JSON File
 
@@ -61,48 +379,78 @@ def process(input_dir: str, iam_token: str, folder_id: str, jsonfile: str, langu
         :param str jsonfile: Path to JSON File
         :param str language: Language Code, e.g. ru-RU, en-US
         :param int limit: Limit of processing files.
+        :param int concurrency: Number of concurrent ASR requests
+        :param float [rate]: (Optional) Max ASR requests per second
+        :param int retries: Max number of retries on transient errors
+        :param str endpoint: Yandex SpeechKit recognition endpoint URL
+        :param str [cache_path]: (Optional) Path to SQLite ASR results cache
+        :param int [cache_max_entries]: (Optional) Max entries in ASR results cache
+        :param float [cache_max_age]: (Optional) Max age of ASR results cache entries in days
+        :param bool resume: Skip chunks transcribed by previous run
+        :param int transcode_workers: Number of concurrent transcodings of incompatible chunks
+        :param str [manifest_db]: (Optional) SQLite manifest path, json file is exported from it if set
 
 
         :return: None
         :rtype: None
     """
     logger.info("Preparing for transcribation")
-    work_dir = os.listdir(input_dir)
-    work_dir.sort()
+    store = open_store(manifest_db, jsonfile) if manifest_db else None
+    if store:
+        # manifest keeps status of every chunk, so only chunks not transcribed yet are listed
+        work_dir = store.needing_asr(limit)
+        limit = None
+    else:
+        work_dir = os.listdir(input_dir)
+        work_dir.sort()
+
+    if len(work_dir) < 1 and not store:
+        raise Exception("No files in input dir. Exit")
 
-    result_data = {}
+    journal_path = f"{jsonfile}.journal"
+    done = _resumed(jsonfile, journal_path) if resume and not store else set()
 
-    if len(work_dir) < 1:
-        raise Exception("No files in input dir. Exit")
+    engine, recognizer = make_recognizer(language, iam_token, folder_id, endpoint)
+    cache = ASRCache(cache_path, cache_max_entries, cache_max_age) if cache_path else None
 
-    total = len(work_dir[:limit])
-    for idx, filename in enumerate(work_dir[:limit]):
-        logger.info(f"Transcribing file {idx} of {total}")
-        file = prepare_file(os.path.join(input_dir, filename))
-        if not file:
-            continue
+    journal = None if store else open(journal_path, "a" if resume else "w", encoding="utf-8")
+    writer = ManifestWriter(store) if store else None
 
-        with file as f:
-            audio_data = f.read()
-
-        try:
-            if language == "ru-RU":
-                result = transcribe_yandex(audio_data, iam_token, folder_id, language)
-            else:
-                result = transcribe_google(audio_data, language, sample_rate=48000)
-            result_data[filename] = result
-        except Exception as e:
-            logger.error(f"Error while transcribing chunk {filename}", e)
-            continue
+    paths = (
+        os.path.join(input_dir, filename)
+        for filename in work_dir[:limit]
+        if filename not in done and os.path.splitext(filename)[1] in SUPPORTED_EXT
+    )
+    bucket = TokenBucket(rate) if rate else None
+    total = len(work_dir[:limit])
+    try:
+        results = transcribe(
+            paths, recognizer, engine, language, concurrency, bucket, retries, cache, transcode_workers
+        )
+        for idx, (filename, result, error) in enumerate(results):
+            logger.info(f"Transcribed file {idx + 1} of {total - len(done)}")
+            if error:
+                logger.error(f"Error while transcribing chunk {filename}: {error}")
+                continue
+            _record(filename, result, writer, journal)
+    finally:
+        recognizer.close()
+        if journal:
+            journal.close()
+        if writer:
+            writer.flush()
+        if cache:
+            cache.close()
 
     logger.info("Transcribing finished. Saving result to json file")
 
-    with open(jsonfile, "r+") as file:  # type: ignore
-        data = json.load(file)  # type: ignore
-        for (fname, asr_string) in result_data.items():
-            data[fname]["asr"] = asr_string
-        file.seek(0)  # type: ignore
-        json.dump(data, file, ensure_ascii=False)  # type: ignore
+    if store:
+        if jsonfile:
+            store.export_json(jsonfile)
+        store.close()
+        return
+
+    merge_journal(jsonfile, journal_path)
 
 
 def main():
@@ -117,6 +465,38 @@ def main():
 
             For Google Speech To Text use environmental variables and config as described here —
             https://cloud.google.com/speech-to-text/docs/libraries#linux-or-macos
+
+            ** THROUGHPUT **
+
+            Up to CONCURRENCY requests are sent at once, no more than RATE requests per second.
+            Throttled, timed out and failed with server error requests are retried with backoff.
+
+            With `--cache` results are stored in SQLite database keyed by hash of prepared audio,
+            engine, language and sample rate. Unchanged chunks are not sent again.
+
+            ** TRANSCODING **
+
+            Mono Ogg/Opus chunks, as written by split.py, are sent as is. Other chunks are
+            transcoded to Ogg/Opus by up to TRANSCODE_WORKERS concurrent ffmpeg processes.
+
+            ** RESUME **
+
+            Every result is appended to <jsonfile>.journal as soon as it is received and
+            merged into JSON file at the end. With `--resume` chunks found in journal
+            or already transcribed in JSON file are skipped.
+
+            ** MANIFEST **
+
+            With `--manifest-db` results are stored in SQLite manifest written by split.py
+            (or imported from JSON file if manifest is empty) as soon as they are received.
+            Only chunks not transcribed yet are processed, JSON file is exported at the end.
+
+            ** METRICS **
+
+            With `--metrics` transcoding and ASR round-trip timers, counters of chunks, requests,
+            errors, cache hits and bytes sent are written to json file with p50/p95 latencies
+            and rates per wall second. `--profile` writes cProfile stats, or stacks of all threads
+            sampled every few milliseconds with `--profile-sampling`.
     """,
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
@@ -127,6 +507,23 @@ def main():
     parser.add_argument("-j", "--jsonfile", type=str, help="Path to resulting jsonfile")
     parser.add_argument("--iam", type=str, help="YC IAM Token")
     parser.add_argument("--folder-id", type=str, help="YC Folder ID")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Number of concurrent ASR requests")
+    parser.add_argument("-r", "--rate", type=float, default=None, help="Max ASR requests per second")
+    parser.add_argument("--retries", type=int, default=3, help="Max retries on transient errors")
+    parser.add_argument("--endpoint", type=str, default=YANDEX_STT_URL, help="Yandex SpeechKit recognition URL")
+    parser.add_argument("--cache", type=str, default=None, help="Path to SQLite ASR results cache")
+    parser.add_argument("--cache-max-entries", type=int, default=None, help="Max entries in ASR results cache")
+    parser.add_argument("--cache-max-age", type=float, default=None, help="Max age of ASR cache entries in days")
+    parser.add_argument("--resume", action="store_true", help="Skip chunks transcribed by previous run")
+    parser.add_argument("-db", "--manifest-db", type=str, default=None, help="SQLite manifest path")
+    parser.add_argument(
+        "-tw",
+        "--transcode-workers",
+        type=int,
+        default=TRANSCODE_WORKERS,
+        help="Number of concurrent transcodings of chunks which are not mono Ogg/Opus",
+    )
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -156,6 +553,16 @@ def main():
         "language": args.language,
         "limit": args.limit,
         "jsonfile": args.jsonfile,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "retries": args.retries,
+        "endpoint": args.endpoint,
+        "cache_path": args.cache,
+        "cache_max_entries": args.cache_max_entries,
+        "cache_max_age": args.cache_max_age,
+        "resume": args.resume,
+        "transcode_workers": args.transcode_workers,
+        "manifest_db": args.manifest_db,
     }
 
     logger.info("settings loaded:")
@@ -165,7 +572,8 @@ def main():
         else:
             logger.info(f"{k}: {v}")
 
-    process(**kwargs)
+    with metrics.session(args.metrics, args.profile, args.profile_sampling):
+        process(**kwargs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import sqlite3
+import sys
+import time
+from typing import Optional, Tuple
+
+from log import LOGGING_FMT
+
+logger = logging.getLogger("asr cache")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+class ASRCache:
+    """
+        .. py:class:: ASRCache(path, max_entries, max_age)
+
+        Persistent SQLite cache of ASR results keyed by hash of audio bytes, engine, language and sample rate.
+        Empty results are cached too, they are paid for as well.
+
+        :param str path: SQLite database path
+        :param int [max_entries]: (Optional) Max number of entries, least recently used are evicted
+        :param float [max_age]: (Optional) Max age of entries in days
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = None, max_age: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, engine TEXT, language TEXT, sample_rate INTEGER, "
+                "result TEXT, created REAL, accessed REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+
+    @staticmethod
+    def key(audio_data: bytes, engine: str, language: str, sample_rate: Optional[int]) -> str:
+        """
+            .. py:method:: key(audio_data, engine, language, sample_rate)
+
+            Count cache key of prepared audio
+
+            :param bytes audio_data: Audio fragment as sent to ASR engine
+            :param str engine: Engine name
+            :param str language: Language Code
+            :param int [sample_rate]: (Optional) Sample rate sent to ASR engine
+
+            :return: Hex digest
+            :rtype: str
+        """
+        digest = hashlib.sha256(audio_data)
+        digest.update(f"|{engine}|{language}|{sample_rate}".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Tuple[bool, Optional[str]]:
+        """
+            .. py:method:: get(key)
+
+            Look up cached result
+
+            :param str key: Cache key
+
+            :return: True and result if found, False and None otherwise
+            :rtype: tuple
+        """
+        row = self.connection.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        with self.connection:
+            self.connection.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+        return True, row[0]
+
+    def put(self, key: str, result: Optional[str], engine: str, language: str, sample_rate: Optional[int]) -> None:
+        """
+            .. py:method:: put(key, result, engine, language, sample_rate)
+
+            Store ASR result
+
+            :param str key: Cache key
+            :param str [result]: ASR result
+            :param str engine: Engine name
+            :param str language: Language Code
+            :param int [sample_rate]: (Optional) Sample rate sent to ASR engine
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, engine, language, sample_rate, result, now, now),
+            )
+
+    def evict(self) -> int:
+        """
+            .. py:method:: evict()
+
+            Remove entries older than max age and least recently used entries over max entries
+
+            :return: Number of removed entries
+            :rtype: int
+        """
+        removed = 0
+        with self.connection:
+            if self.max_age:
+                cursor = self.connection.execute(
+                    "DELETE FROM results WHERE created < ?", (time.time() - self.max_age * 86400,)
+                )
+                removed += cursor.rowcount
+            if self.max_entries:
+                cursor = self.connection.execute(
+                    "DELETE FROM results WHERE key IN "
+                    "(SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                removed += cursor.rowcount
+        return removed
+
+    def close(self) -> None:
+        removed = self.evict()
+        logger.info(f"ASR cache hits: {self.hits}, misses: {self.misses}, evicted: {removed}")
+        self.connection.close()
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+from typing import Optional, Tuple
+
+import librosa
+import numpy as np
+
+from log import LOGGING_FMT
+
+logger = logging.getLogger("audio cache")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+CACHE_SIZE = 10 * 1024  # megabytes
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(filename: str) -> str:
+    """
+        .. py:function:: file_hash(filename)
+
+        Count hash of file content
+
+        :param str filename: File name
+
+        :return: Hex digest of file content
+        :rtype: str
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _atomic_write(path: str, write) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def evict(cache_dir: str, max_size: int) -> None:
+    """
+        .. py:function:: evict(cache_dir, max_size)
+
+        Remove least recently used entries until cache fits into max size
+
+        :param str cache_dir: Cache directory
+        :param int max_size: Max cache size in megabytes
+
+        :return:
+        :rtype: None
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".npy"):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name[:-len(".npy")]))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries):
+        if total <= max_size * 1024 * 1024:
+            break
+        logger.info(f"Evicting cached audio {key}")
+        for ext in (".json", ".npy"):
+            try:
+                os.unlink(os.path.join(cache_dir, key + ext))
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+def load(
+    input_file: str, samplerate: Optional[int], limit: Optional[int], cache_dir: str, max_size: int = CACHE_SIZE
+) -> Tuple[np.ndarray, int]:
+    """
+        .. py:function:: load(input_file, samplerate, limit, cache_dir, max_size)
+
+        Load decoded and resampled audio through on-disk cache.
+        Cached audio is returned as read-only memory-mapped array, so pages are shared between processes.
+
+        :param str input_file: Input file path
+        :param int [samplerate]: (Optional) Samplerate of output audio, native if not set
+        :param int [limit]: Input audio track length limit
+        :param str cache_dir: Cache directory
+        :param int max_size: Max cache size in megabytes
+
+        :return: Audio and its samplerate
+        :rtype: tuple
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = "{}_{}_{}".format(file_hash(input_file), samplerate or "native", limit or "full")
+    audio_path = os.path.join(cache_dir, key + ".npy")
+    meta_path = os.path.join(cache_dir, key + ".json")
+
+    try:
+        with open(meta_path, "r") as meta_f:
+            frame_rate = json.load(meta_f)["frame_rate"]
+        audio_src = np.load(audio_path, mmap_mode="r")
+        os.utime(audio_path)
+        logger.info(f"Cache hit for {input_file}")
+        return audio_src, frame_rate
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    logger.info(f"Cache miss for {input_file}. Decoding")
+    audio_src, frame_rate = librosa.load(input_file, sr=samplerate, duration=limit)
+
+    _atomic_write(audio_path, lambda f: np.save(f, audio_src))
+    _atomic_write(meta_path, lambda f: f.write(json.dumps({"frame_rate": frame_rate}).encode()))
+    evict(cache_dir, max_size)
+
+    return audio_src, frame_rate
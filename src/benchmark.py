@@ -0,0 +1,366 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from fake_stt import FakeSTTServer
+from log import LOGGING_FMT
+
+logger = logging.getLogger("benchmark")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+STAGES = ("segment", "split", "prepare", "asr", "eval")
+DURATIONS = (60, 300)
+SAMPLERATES = (16000, 44100)
+REPEATS = 3
+# relative slowdown or memory growth over baseline failing the run
+TOLERANCE = 0.2
+SEED = 0
+
+# seconds
+BURST_LENGTH = (0.5, 4.0)
+SILENCE_LENGTH = (0.6, 1.5)
+# mains hum keeps silence not quite silent, broadband noise would look like speech by Zero-Crossing rate
+HUM_LEVEL = 1e-3
+HUM_FREQUENCY = 50
+SYLLABLES = ("ba", "ve", "go", "da", "ke", "li", "mo", "ne", "po", "ru", "sa", "ti", "zu", "sha", "cho", "in", "ot")
+# fraction of characters replaced in fake ASR results
+ASR_ERROR_RATE = 0.05
+
+
+def synth_audio(duration: int, samplerate: int, seed: int = SEED) -> np.ndarray:
+    """
+        .. py:function:: synth_audio(duration, samplerate, seed)
+
+        Generate speech-like audio: harmonic tone bursts of varying pitch, length and loudness
+        separated by silence over a quiet hum. The same seed gives the same audio.
+
+        :param int duration: Duration in seconds
+        :param int samplerate: Sample rate
+        :param int seed: Random seed
+
+        :return: Mono audio
+        :rtype: np.array
+    """
+    rng = np.random.default_rng(seed)
+    total = duration * samplerate
+    parts = []
+    length = 0
+    while length < total:
+        n = int(rng.uniform(*BURST_LENGTH) * samplerate)
+        t = np.arange(n) / samplerate
+        pitch = rng.uniform(100, 250) * (1 + 0.05 * np.sin(2 * np.pi * rng.uniform(3, 6) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / samplerate
+        burst = sum(np.sin(k * phase) / k for k in range(1, 6))
+        # syllables are amplitude modulation inside smooth burst envelope
+        envelope = (1 - np.cos(2 * np.pi * t / t[-1])) / 2 * (0.4 + 0.6 * np.sin(np.pi * rng.uniform(3, 6) * t) ** 2)
+        parts.append(rng.uniform(0.2, 0.5) * burst * envelope / np.abs(burst).max())
+        parts.append(np.zeros(int(rng.uniform(*SILENCE_LENGTH) * samplerate)))
+        length += len(parts[-2]) + len(parts[-1])
+
+    hum = HUM_LEVEL * np.sin(2 * np.pi * HUM_FREQUENCY * np.arange(total) / samplerate)
+    return (np.concatenate(parts)[:total] + hum).astype(np.float32)
+
+
+def synth_text(sentences: int, seed: int = SEED) -> Tuple[str, List[str]]:
+    """
+        .. py:function:: synth_text(sentences, seed)
+
+        Generate text of pseudo-words with punctuation and numbers, and fake ASR results:
+        lower cased sentences of text with some characters replaced.
+
+        :param int sentences: Number of sentences
+        :param int seed: Random seed
+
+        :return: Text and ASR results
+        :rtype: tuple
+    """
+    rng = np.random.default_rng(seed)
+    letters = sorted(set("".join(SYLLABLES)))
+    lines = []
+    results = []
+    for _ in range(sentences):
+        words = [
+            "".join(rng.choice(SYLLABLES, rng.integers(1, 5))) for _ in range(rng.integers(5, 13))
+        ]
+        if rng.random() < 0.2:
+            words.insert(rng.integers(len(words)), str(rng.integers(1, 1000)))
+        line = " ".join(words).capitalize() + rng.choice([".", "!", "?", "..."])
+        lines.append(line)
+
+        result = [
+            rng.choice(letters) if char.isalpha() and rng.random() < ASR_ERROR_RATE else char
+            for char in " ".join(word for word in words if not word.isdigit())
+        ]
+        results.append("".join(result))
+    return "\n".join(" ".join(lines[i:i + 5]) for i in range(0, len(lines), 5)), results
+
+
+def _run_stage(stage: str, case: Dict) -> Dict:
+    """
+        .. py:function:: _run_stage(stage, case)
+
+        Run stage over case files in a fresh process, so peak RSS belongs to this stage only.
+        Imports are done before the timer starts.
+
+        :param str stage: Stage name
+        :param dict case: Case files and options
+
+        :return: Wall time in seconds, number of processed items and peak RSS in megabytes
+        :rtype: dict
+    """
+    import asr
+    import split
+    import text_eval
+
+    chunks_dir = case["chunks_dir"]
+    jsonfile = os.path.join(chunks_dir, split.RESULT_FILE)
+    started = time.perf_counter()
+
+    if stage == "segment":
+        audio_src, frame_rate = sf.read(case["audio"], dtype="float32")
+        started = time.perf_counter()
+        segmentation = split.SEGMENTATION_METHODS["rms"](
+            case["audio"], audio_src, frame_rate, frame_length=1000, frame_shift=50, q_factor=0.7
+        )
+        items = len(list(segmentation))
+    elif stage == "split":
+        split.process(case["audio"], chunks_dir, None, "file", "rms", 1000, 50, 0.7, None)
+        with open(jsonfile, "r") as json_f:
+            items = len(json.load(json_f))
+    elif stage == "prepare":
+        with open(jsonfile, "r") as json_f:
+            paths = [os.path.join(chunks_dir, filename) for filename in sorted(json.load(json_f))]
+        started = time.perf_counter()
+        items = sum(1 for _, audio_data in asr.prepare_files(paths) if audio_data)
+    elif stage == "asr":
+        asr.process(chunks_dir, "token", "folder", jsonfile, "ru-RU", endpoint=case["url"])
+        with open(jsonfile, "r") as json_f:
+            items = sum(1 for item in json.load(json_f).values() if item["asr"] is not None)
+    elif stage == "eval":
+        text_eval.process(case["text"], jsonfile, qmax=70)
+        with open(jsonfile, "r") as json_f:
+            items = sum(1 for item in json.load(json_f).values() if item["asr"])
+    else:
+        raise ValueError(f"Unknown stage `{stage}`")
+
+    seconds = time.perf_counter() - started
+    # kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"seconds": seconds, "items": items, "peak_rss_mb": peak_rss}
+
+
+def run(
+    work_dir: str,
+    stages: List[str],
+    durations: List[int],
+    samplerates: List[int],
+    repeats: int = REPEATS,
+    latency: float = 0.0,
+    seed: int = SEED,
+) -> Dict:
+    """
+        .. py:function:: run(work_dir, stages, durations, samplerates, repeats, latency, seed)
+
+        Run benchmark over every duration and sample rate of synthetic audio.
+        ASR is served by local fake endpoint. Stages are run in given order, every run in a new process,
+        later stages use chunks and json file written by earlier ones.
+
+        :param str work_dir: Directory for generated files
+        :param list[str] stages: Stages to run
+        :param list[int] durations: Audio durations in seconds
+        :param list[int] samplerates: Audio sample rates
+        :param int repeats: Runs of every stage, the fastest one is reported
+        :param float latency: Fake ASR response delay in seconds
+        :param int seed: Random seed of audio and text
+
+        :return: Run metadata and metrics of every stage and case
+        :rtype: dict
+    """
+    results = {}
+    spawn = multiprocessing.get_context("spawn")
+    for duration in durations:
+        # about one sentence per second of audio, fake ASR results are sentences of the text
+        text, sentences = synth_text(duration, seed)
+        text_path = os.path.join(work_dir, f"text_{duration}.txt")
+        with open(text_path, "w", encoding="utf-8") as text_f:
+            text_f.write(text)
+
+        with FakeSTTServer(sentences, latency) as server:
+            for samplerate in samplerates:
+                name = f"{duration}s/{samplerate}Hz"
+                audio_path = os.path.join(work_dir, f"audio_{duration}_{samplerate}.wav")
+                sf.write(audio_path, synth_audio(duration, samplerate, seed), samplerate)
+                case = {
+                    "audio": audio_path,
+                    "text": text_path,
+                    "chunks_dir": os.path.join(work_dir, f"chunks_{duration}_{samplerate}"),
+                    "url": server.url,
+                }
+
+                for stage in stages:
+                    runs = []
+                    for _ in range(repeats):
+                        logger.info(f"Running {stage} on {name}")
+                        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                            runs.append(executor.submit(_run_stage, stage, case).result())
+
+                    seconds = min(r["seconds"] for r in runs)
+                    items = runs[0]["items"]
+                    results[f"{stage}/{name}"] = {
+                        "seconds": round(seconds, 4),
+                        "items": items,
+                        "items_per_s": round(items / seconds, 2) if seconds else 0.0,
+                        "rtf": round(seconds / duration, 5),
+                        "peak_rss_mb": round(max(r["peak_rss_mb"] for r in runs), 1),
+                    }
+
+    meta = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeats": repeats,
+        "latency": latency,
+        "seed": seed,
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = TOLERANCE) -> List[str]:
+    """
+        .. py:function:: compare(results, baseline, tolerance)
+
+        Compare wall time and peak RSS of every stage and case found in both results
+
+        :param dict results: Current benchmark results
+        :param dict baseline: Stored benchmark results
+        :param float tolerance: Allowed relative growth
+
+        :return: Description of every regression
+        :rtype: list[str]
+    """
+    regressions = []
+    for key, metrics in results["results"].items():
+        base = baseline["results"].get(key)
+        if not base:
+            continue
+        for metric in ("seconds", "peak_rss_mb"):
+            if base[metric] and metrics[metric] > base[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{key} {metric}: {metrics[metric]} vs {base[metric]} "
+                    f"(+{100 * (metrics[metric] / base[metric] - 1):.0f}%)"
+                )
+    return regressions
+
+
+def print_results(results: Dict, baseline: Dict = None) -> None:
+    """
+        .. py:function:: print_results(results, baseline)
+
+        Print benchmark results as table, with relative change of wall time if baseline is set
+
+        :param dict results: Benchmark results
+        :param dict [baseline]: (Optional) Stored benchmark results
+
+        :return:
+        :rtype: None
+    """
+    print("{:<24} {:>9} {:>7} {:>9} {:>8} {:>8} {:>8}".format(
+        "stage/case", "time,s", "items", "items/s", "rtf", "rss,MB", "change"
+    ))
+    for key, row in results["results"].items():
+        base = (baseline or {}).get("results", {}).get(key)
+        change = f"{100 * (row['seconds'] / base['seconds'] - 1):+.0f}%" if base and base["seconds"] else ""
+        print("{key:<24} {seconds:>9.3f} {items:>7} {items_per_s:>9.1f} {rtf:>8.4f} {peak_rss_mb:>8.1f} "
+              "{change:>8}".format(key=key, change=change, **row))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+            Benchmark splitting, ASR and text evaluation on synthetic data.
+
+            Audio is speech-like tone bursts separated by silence, text is pseudo-words with
+            punctuation and numbers. Both are generated from SEED, so every run gets the same input.
+            ASR requests are served by local fake endpoint answering with sentences of the text.
+
+            Stages:
+              segment - RMS segmentation of loaded audio
+              split   - split.py: load, segmentation and chunks export
+              prepare - transcoding of chunks for ASR
+              asr     - asr.py against fake endpoint with LATENCY seconds delay
+              eval    - text_eval.py on fake ASR results
+
+            Every stage is run REPEATS times in a new process, the fastest run is reported
+            with throughput, real time factor (time per second of audio) and peak RSS.
+
+            Results are saved as json with `--output`. With `--baseline` results are compared
+            to stored ones and the run fails if time or peak RSS of any stage grows
+            over TOLERANCE. Compare results of the same host only.
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("-s", "--stages", type=str, nargs="+", default=list(STAGES), choices=STAGES,
+                        help="Stages to run, later stages need chunks of split")
+    parser.add_argument("-d", "--durations", type=int, nargs="+", default=list(DURATIONS),
+                        help="Audio durations in seconds")
+    parser.add_argument("-sr", "--samplerates", type=int, nargs="+", default=list(SAMPLERATES),
+                        help="Audio sample rates")
+    parser.add_argument("-r", "--repeats", type=int, default=REPEATS, help="Runs of every stage")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake ASR response delay in seconds")
+    parser.add_argument("--seed", type=int, default=SEED, help="Random seed of audio and text")
+    parser.add_argument("-wd", "--work-dir", type=str, default=None, help="Directory for generated files")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Path to save results json")
+    parser.add_argument("-b", "--baseline", type=str, default=None, help="Path to stored results json")
+    parser.add_argument("-t", "--tolerance", type=float, default=TOLERANCE,
+                        help="Allowed relative growth of time and peak RSS over baseline")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        results = run(work_dir, args.stages, args.durations, args.samplerates, args.repeats, args.latency, args.seed)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as baseline_f:
+            baseline = json.load(baseline_f)
+
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output + ".tmp", "w") as output_f:
+            json.dump(results, output_f, indent=2)
+        os.replace(args.output + ".tmp", args.output)
+        logger.info(f"Results saved to {os.path.abspath(args.output)}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            logger.error(f"REGRESSION {regression}")
+        if regressions:
+            exit(1)
+        logger.info("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
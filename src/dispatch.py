@@ -0,0 +1,171 @@
+import logging
+import random
+import socket
+import sys
+import threading
+import time
+import urllib.error
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from log import LOGGING_FMT
+
+logger = logging.getLogger("dispatch")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+TRANSIENT_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+        .. py:class:: TokenBucket(rate, capacity)
+
+        Thread-safe token bucket rate limiter
+
+        :param float rate: Tokens added per second
+        :param float [capacity]: (Optional) Max tokens in bucket, burst size. Default is one second of tokens
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+            .. py:method:: acquire()
+
+            Take one token, wait until it is available
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def is_transient(error: Exception) -> bool:
+    """
+        .. py:function:: is_transient(error)
+
+        Check if request failed by reason worth retrying: connection errors, timeouts,
+        throttling and server errors
+
+        :param Exception error: Request error
+
+        :return: True if request could be retried
+        :rtype: bool
+    """
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in TRANSIENT_CODES
+    return isinstance(error, (urllib.error.URLError, ConnectionError, TimeoutError, socket.timeout))
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None)
+    try:
+        return float(headers.get("Retry-After")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retries(
+    func: Callable, args: Tuple, bucket: Optional[TokenBucket] = None, retries: int = 3, backoff: float = 1.0
+) -> Any:
+    """
+        .. py:function:: call_with_retries(func, args, bucket, retries, backoff)
+
+        Call function, retry on transient errors with exponential backoff and jitter.
+        `Retry-After` header of throttled responses is respected.
+
+        :param callable func: Function to call
+        :param tuple args: Function arguments
+        :param TokenBucket [bucket]: (Optional) Rate limiter, one token is taken for each attempt
+        :param int retries: Max number of retries
+        :param float backoff: Delay before first retry in seconds, doubled for every next retry
+
+        :return: Function result
+        :rtype: Any
+    """
+    attempt = 0
+    while True:
+        if bucket:
+            bucket.acquire()
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt >= retries or not is_transient(e):
+                raise
+            delay = _retry_after(e) or backoff * 2 ** attempt * (0.5 + random.random() / 2)
+            logger.warning(f"Transient error: {e}. Retry {attempt + 1} of {retries} in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def dispatch(
+    tasks: Iterable[Tuple[str, Tuple]],
+    func: Callable,
+    concurrency: int = 4,
+    bucket: Optional[TokenBucket] = None,
+    retries: int = 3,
+    backoff: float = 1.0,
+) -> Iterator[Tuple[str, Any, Optional[Exception]]]:
+    """
+        .. py:function:: dispatch(tasks, func, concurrency, bucket, retries, backoff)
+
+        Call function for every task in a thread pool.
+        Tasks are consumed lazily, no more than two tasks per thread are in flight.
+        Finished tasks are returned before waiting for the next task, so slowly produced tasks
+        don't hold back results until the pool is full. Tasks with None arguments are not called,
+        they are returned at once with None result, so the caller could pass ready results through.
+
+        :param Iterable tasks: Key and function arguments of each task
+        :param callable func: Function to call
+        :param int concurrency: Number of concurrent calls
+        :param TokenBucket [bucket]: (Optional) Rate limiter shared by all calls
+        :param int retries: Max number of retries for transient errors
+        :param float backoff: Delay before first retry in seconds
+
+        :return: Iterator over key, result and error of each task in order of completion
+        :rtype: Iterator[tuple]
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+
+        def collect(futures):
+            for future in futures:
+                key = pending.pop(future)
+                error = future.exception()
+                yield key, None if error else future.result(), error
+
+        for key, args in tasks:
+            if args is None:
+                yield from collect(wait(pending, timeout=0)[0])
+                yield key, None, None
+                continue
+            future = executor.submit(call_with_retries, func, args, bucket, retries, backoff)
+            pending[future] = key
+            if len(pending) >= concurrency * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            else:
+                done, _ = wait(pending, timeout=0)
+            yield from collect(done)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from collect(done)
@@ -0,0 +1,314 @@
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Union
+
+from log import LOGGING_FMT
+
+logger = logging.getLogger("fake stt")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+FAKE_STT_PATH = "/speech/v1/stt:recognize"
+RETRY_AFTER = 1.0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, with Nagle's algorithm every keep-alive request
+    # after the first one would wait for delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        audio_data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        status, result, headers = self.server.respond(audio_data)
+
+        if status == 200:
+            body = json.dumps({"result": result}, ensure_ascii=False).encode("utf-8")
+        else:
+            body = json.dumps({"error_code": str(status), "error_message": result}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSTTServer(ThreadingHTTPServer):
+    """
+        .. py:class:: FakeSTTServer(
+            sentences, latency, jitter, host, port, latency_per_kb, sigma, error_rate, throttle_rate,
+            max_rps, max_concurrency, retry_after, seed)
+
+        Local stand-in of Yandex SpeechKit `stt:recognize` endpoint for benchmarks and load tests.
+        Every request is answered with one of given sentences chosen by hash of audio,
+        or with sha1 of audio if no sentences are given, so the same chunk is always recognized the same way.
+
+        Response delay is LATENCY plus LATENCY_PER_KB for every kilobyte of audio, multiplied by
+        log-normal noise with SIGMA spread, plus up to JITTER. Requests over MAX_RPS per second or
+        over MAX_CONCURRENCY in flight are throttled with 429 and `Retry-After`, other requests
+        fail at random with 429 or 500 at THROTTLE_RATE and ERROR_RATE.
+        Tests could script failures of particular audio with `fail`, they are answered without delay.
+
+        :param list[str] sentences: Recognition results
+        :param float latency: Response delay in seconds
+        :param float jitter: Max random addition to delay in seconds
+        :param str host: Host to listen on
+        :param int port: Port to listen on, any free port if 0
+        :param float latency_per_kb: Response delay per kilobyte of audio in seconds
+        :param float sigma: Log-normal spread of delay, 0 for constant delay
+        :param float error_rate: Fraction of requests failed with 500
+        :param float throttle_rate: Fraction of requests throttled with 429
+        :param float [max_rps]: (Optional) Max requests per second, over it requests are throttled
+        :param int [max_concurrency]: (Optional) Max requests in flight, over it requests are throttled
+        :param float retry_after: `Retry-After` of throttled responses in seconds
+        :param int [seed]: (Optional) Seed of random delays and failures
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        sentences: List[str],
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_per_kb: float = 0.0,
+        sigma: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        max_rps: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        retry_after: float = RETRY_AFTER,
+        seed: Optional[int] = None,
+    ):
+        super().__init__((host, port), _Handler)
+        self.sentences = sentences
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_per_kb = latency_per_kb
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.thread = None  # type: Optional[threading.Thread]
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests = 0
+            self.bytes_received = 0
+            self.responses = collections.Counter()  # type: collections.Counter
+            self.in_flight = 0
+            self.peak_in_flight = 0
+            self.tokens = self.max_rps or 0.0
+            self.updated = time.monotonic()
+            self.script = collections.defaultdict(collections.deque)  # type: Dict[str, collections.deque]
+            self.times = collections.defaultdict(list)  # type: Dict[str, List[float]]
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{FAKE_STT_PATH}"
+
+    def result(self, audio_data: bytes) -> str:
+        """
+            .. py:method:: result(audio_data)
+
+            Recognition result of successful request with audio fragment
+
+            :param bytes audio_data: Audio fragment
+
+            :return: Recognition result
+            :rtype: str
+        """
+        digest = hashlib.sha1(audio_data).hexdigest()
+        return self.sentences[int(digest, 16) % len(self.sentences)] if self.sentences else digest
+
+    def fail(self, audio_data: bytes, *responses: Union[int, Tuple[int, Dict[str, str]]]) -> None:
+        """
+            .. py:method:: fail(audio_data, *responses)
+
+            Answer next requests with audio fragment by given statuses, one response per request
+
+            :param bytes audio_data: Audio fragment
+            :param responses: HTTP status or status and response headers
+
+            :return:
+            :rtype: None
+        """
+        with self.lock:
+            for response in responses:
+                self.script[hashlib.sha1(audio_data).hexdigest()].append(
+                    response if isinstance(response, tuple) else (response, {})
+                )
+
+    def request_times(self, audio_data: bytes) -> List[float]:
+        """
+            .. py:method:: request_times(audio_data)
+
+            Monotonic arrival times of requests with audio fragment
+
+            :param bytes audio_data: Audio fragment
+
+            :return: Arrival time of each request
+            :rtype: list
+        """
+        with self.lock:
+            return list(self.times.get(hashlib.sha1(audio_data).hexdigest(), []))
+
+    def _admit(self) -> Tuple[int, str]:
+        if self.max_concurrency and self.in_flight > self.max_concurrency:
+            return 429, "Too many concurrent requests"
+        if self.max_rps:
+            now = time.monotonic()
+            self.tokens = min(self.max_rps, self.tokens + (now - self.updated) * self.max_rps)
+            self.updated = now
+            if self.tokens < 1:
+                return 429, "Too many requests"
+            self.tokens -= 1
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            return 429, "Too many requests"
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, "Internal error"
+        return 200, ""
+
+    def respond(self, audio_data: bytes) -> Tuple[int, str, Dict[str, str]]:
+        """
+            .. py:method:: respond(audio_data)
+
+            Simulate recognition of audio fragment
+
+            :param bytes audio_data: Audio fragment
+
+            :return: HTTP status, recognition result or error message and extra response headers
+            :rtype: tuple
+        """
+        digest = hashlib.sha1(audio_data).hexdigest()
+        headers = {}  # type: Dict[str, str]
+        with self.lock:
+            self.requests += 1
+            self.bytes_received += len(audio_data)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.times[digest].append(time.monotonic())
+            scripted = self.script.get(digest)
+            if scripted:
+                status, headers = scripted.popleft()
+                message = "Scripted error"
+            else:
+                status, message = self._admit()
+                if status == 429:
+                    headers = {"Retry-After": f"{self.retry_after:g}"}
+            noise = self.random.lognormvariate(0, self.sigma) if self.sigma else 1.0
+
+        try:
+            if status == 200:
+                delay = (self.latency + self.latency_per_kb * len(audio_data) / 1024) * noise
+                delay += random.Random(int(digest, 16)).uniform(0, self.jitter)
+                if delay:
+                    time.sleep(delay)
+                message = self.result(audio_data)
+            return status, message, headers
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.responses[status] += 1
+
+    def start(self) -> "FakeSTTServer":
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "FakeSTTServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+            Run local stand-in of Yandex SpeechKit recognition endpoint.
+
+            Every request is answered with a line of SENTENCES file chosen by hash of audio,
+            or with sha1 of audio without SENTENCES, after LATENCY plus up to JITTER seconds.
+            Pass printed URL to asr.py as `--endpoint`.
+
+            Delay grows by LATENCY_PER_KB for every kilobyte of audio and is multiplied by
+            log-normal noise with SIGMA spread. Requests over MAX_RPS per second or MAX_CONCURRENCY
+            in flight get 429 with `Retry-After: RETRY_AFTER`, others fail at random with 429
+            at THROTTLE_RATE and with 500 at ERROR_RATE.
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("-s", "--sentences", type=str, help="File with recognition results, one per line")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="Response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Max random addition to delay in seconds")
+    parser.add_argument("--latency-per-kb", type=float, default=0.0, help="Delay per kilobyte of audio in seconds")
+    parser.add_argument("--sigma", type=float, default=0.0, help="Log-normal spread of delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failed with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests throttled with 429")
+    parser.add_argument("--max-rps", type=float, default=None, help="Max requests per second")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Max requests in flight")
+    parser.add_argument("--retry-after", type=float, default=RETRY_AFTER, help="Retry-After of 429 in seconds")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of random delays and failures")
+
+    args = parser.parse_args()
+
+    sentences = []
+    if args.sentences:
+        with open(args.sentences, "r", encoding="utf-8") as sentences_f:
+            sentences = [line.strip() for line in sentences_f if line.strip()]
+
+    server = FakeSTTServer(
+        sentences, args.latency, args.jitter, args.host, args.port, args.latency_per_kb, args.sigma,
+        args.error_rate, args.throttle_rate, args.max_rps, args.max_concurrency, args.retry_after, args.seed,
+    )
+    logger.info(f"Listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(
+            f"Requests served: {server.requests}, bytes received: {server.bytes_received}, "
+            f"responses: {dict(server.responses)}, peak in flight: {server.peak_in_flight}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import logging
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+import librosa
+import numpy as np
+import soundfile as sf
+import tensorflow as tf
+from inaSpeechSegmenter import Segmenter
+from inaSpeechSegmenter.features import _wav2feats, media2feats
+from inaSpeechSegmenter.segmenter import _binidx2seglist, _energy_activity, _get_patches
+from inaSpeechSegmenter.viterbi_utils import diag_trans_exp
+from pyannote.algorithms.utils.viterbi import viterbi_decoding
+
+from log import LOGGING_FMT
+
+logger = logging.getLogger("ina")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+INA_SAMPLERATE = 16000
+INA_BATCH_SIZE = 256
+NON_SPEECH_LABELS = ("energy", "noEnergy", "noise", "music")
+
+Media = Union[str, Tuple[np.ndarray, int]]
+
+
+def _buffer2feats(audio: np.ndarray, samplerate: int, tmpdir: Optional[str] = None):
+    if samplerate != INA_SAMPLERATE:
+        audio = librosa.resample(audio, samplerate, INA_SAMPLERATE)
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmpdirname:
+        tmpwav = os.path.join(tmpdirname, "buffer.wav")
+        sf.write(tmpwav, audio, INA_SAMPLERATE, subtype="PCM_16")
+        return _wav2feats(tmpwav)
+
+
+def _batched_dnn(dnn, items: List[Tuple[np.ndarray, List, int]]) -> List[List]:
+    """
+        .. py:function:: _batched_dnn(dnn, items)
+
+        Same as `DnnSegmenter.__call__` for many inputs at once:
+        patches of all inputs go through the network in a single `predict` call.
+
+        :param DnnSegmenter dnn: INA DNN Segmenter
+        :param list items: Mel spectrogram, previous segmentation and length difference of each input
+
+        :return: Segmentation of each input
+        :rtype: list
+    """
+    patches = []
+    for mspec, lseg, difflen in items:
+        if dnn.nmel < 24:
+            mspec = mspec[:, :dnn.nmel].copy()
+        data, finite = _get_patches(mspec, 68, 2)
+        if difflen > 0:
+            data = data[:-int(difflen / 2), :, :]
+            finite = finite[:-int(difflen / 2)]
+        patches.append((data, finite))
+
+    batch = [
+        data[start:stop, :]
+        for (data, _), (_, lseg, _) in zip(patches, items)
+        for lab, start, stop in lseg
+        if lab == dnn.inlabel
+    ]
+    rawpred = dnn.nn.predict(np.concatenate(batch), batch_size=dnn.batch_size) if batch else None
+
+    result = []
+    for (_, finite), (_, lseg, _) in zip(patches, items):
+        ret = []
+        for lab, start, stop in lseg:
+            if lab != dnn.inlabel:
+                ret.append((lab, start, stop))
+                continue
+
+            pred, rawpred = rawpred[:stop - start], rawpred[stop - start:]
+            pred[finite[start:stop] == False, :] = 0.5  # noqa: E712
+            pred = viterbi_decoding(np.log(pred), diag_trans_exp(dnn.viterbi_arg, len(dnn.outlabels)))
+            for lab2, start2, stop2 in _binidx2seglist(pred):
+                ret.append((dnn.outlabels[int(lab2)], start2 + start, stop2 + start))
+        result.append(ret)
+    return result
+
+
+class SegmenterService:
+    """
+        .. py:class:: SegmenterService(
+            vad_engine, detect_gender, batch_size, intra_op_threads, inter_op_threads, feature_threads)
+
+        Long-lived INA Speech Segmenter.
+        Models are loaded once on first call, many files or audio buffers are segmented per call
+        with their feature windows batched through the network together.
+
+        :param str vad_engine: `sm` for speech/music or `smn` for speech/music/noise
+        :param bool detect_gender: Split speech into male and female segments
+        :param int batch_size: Network batch size
+        :param int [intra_op_threads]: (Optional) TensorFlow intra-op threads
+        :param int [inter_op_threads]: (Optional) TensorFlow inter-op threads
+        :param int feature_threads: Threads for decoding and feature extraction
+    """
+
+    def __init__(
+        self,
+        vad_engine: str = "smn",
+        detect_gender: bool = True,
+        batch_size: int = INA_BATCH_SIZE,
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None,
+        feature_threads: int = 2,
+    ):
+        self.vad_engine = vad_engine
+        self.detect_gender = detect_gender
+        self.batch_size = batch_size
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.feature_threads = feature_threads
+        self._segmenter = None  # type: Optional[Segmenter]
+        self._prefetched = {}  # type: Dict[str, List[Tuple[float, float]]]
+
+    @property
+    def segmenter(self) -> Segmenter:
+        if self._segmenter is None:
+            try:
+                if self.intra_op_threads:
+                    tf.config.threading.set_intra_op_parallelism_threads(self.intra_op_threads)
+                if self.inter_op_threads:
+                    tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+            except RuntimeError as e:
+                logger.warning(f"Cannot set TensorFlow threads, runtime is already initialized: {e}")
+
+            logger.info("Loading INA Speech Segmenter models")
+            self._segmenter = Segmenter(
+                vad_engine=self.vad_engine, detect_gender=self.detect_gender, batch_size=self.batch_size
+            )
+        return self._segmenter
+
+    def features(self, media: Media):
+        if isinstance(media, str):
+            return media2feats(media, None, None, None, self.segmenter.ffmpeg)
+        return _buffer2feats(*media)
+
+    def segment(self, inputs: List[Media]) -> List[List[Tuple[str, float, float]]]:
+        """
+            .. py:method:: segment(inputs)
+
+            Segment files or audio buffers
+
+            :param list inputs: File paths or tuples of audio and its samplerate
+
+            :return: List of (label, start, end) segments for each input
+            :rtype: list
+        """
+        segmenter = self.segmenter
+        with ThreadPoolExecutor(max_workers=self.feature_threads) as executor:
+            feats = list(executor.map(self.features, inputs))
+
+        items = []
+        for mspec, loge, difflen in feats:
+            lseg = [
+                ("energy" if lab else "noEnergy", start, stop)
+                for lab, start, stop in _binidx2seglist(_energy_activity(loge)[::2])
+            ]
+            items.append((mspec, lseg, difflen))
+
+        lsegs = _batched_dnn(segmenter.vad, items)
+        if self.detect_gender:
+            items = [(mspec, lseg, difflen) for (mspec, _, difflen), lseg in zip(items, lsegs)]
+            lsegs = _batched_dnn(segmenter.gender, items)
+
+        return [[(lab, start * .02, stop * .02) for lab, start, stop in lseg] for lseg in lsegs]
+
+    def speech(self, inputs: List[Media]) -> List[List[Tuple[float, float]]]:
+        """
+            .. py:method:: speech(inputs)
+
+            Segment files or audio buffers and keep speech segments only.
+            Prefetched files are not segmented again, their result is returned once.
+
+            :param list inputs: File paths or tuples of audio and its samplerate
+
+            :return: List of (start, end) speech segments for each input
+            :rtype: list
+        """
+        result = [
+            self._prefetched.pop(media, None) if isinstance(media, str) else None for media in inputs
+        ]  # type: List[Optional[List[Tuple[float, float]]]]
+        missing = [idx for idx, speech in enumerate(result) if speech is None]
+        if missing:
+            for idx, segmentation in zip(missing, self.segment([inputs[idx] for idx in missing])):
+                result[idx] = [(start, end) for lab, start, end in segmentation if lab not in NON_SPEECH_LABELS]
+        return result
+
+    def prefetch(self, files: List[str]) -> None:
+        """
+            .. py:method:: prefetch(files)
+
+            Segment many files in one call, so their feature windows share network batches,
+            and keep speech segments until each file is requested by `speech`.
+            If segmentation fails, files are left to be segmented one by one.
+
+            :param list files: File paths
+
+            :return:
+            :rtype: None
+        """
+        files = [filename for filename in files if filename not in self._prefetched]
+        if not files:
+            return
+        try:
+            self._prefetched.update(zip(files, self.speech(files)))
+        except Exception as e:
+            logger.warning(f"Cannot segment {len(files)} files together, segmenting one by one: {e}")
+
+
+_services = {}  # type: Dict[Tuple, SegmenterService]
+
+
+def get_service(**options) -> SegmenterService:
+    """
+        .. py:function:: get_service(**options)
+
+        Returns segmenter service of current process, created once for each set of options
+
+        :param options: Arguments of `SegmenterService`
+
+        :return: Segmenter service
+        :rtype: SegmenterService
+    """
+    key = tuple(sorted(options.items()))
+    if key not in _services:
+        _services[key] = SegmenterService(**options)
+    return _services[key]
+
+
+def preload(options: Dict) -> None:
+    """
+        .. py:function:: preload(options)
+
+        Load models of segmenter service in current process. Use as process pool initializer.
+
+        :param dict options: Arguments of `SegmenterService`
+
+        :return:
+        :rtype: None
+    """
+    get_service(**options).segmenter
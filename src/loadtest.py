@@ -0,0 +1,248 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import soundfile as sf
+
+import asr
+import dispatch
+import metrics
+from benchmark import synth_audio, synth_text
+from fake_stt import RETRY_AFTER, FakeSTTServer
+from log import LOGGING_FMT
+from split import RESULT_FILE
+
+logger = logging.getLogger("load test")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+CONCURRENCY_LEVELS = (1, 2, 4, 8, 16, 32)
+CHUNK_SECONDS = (5, 15, 30)
+CHUNKS = 100
+SAMPLERATE = 16000
+# throughput growth below this fraction of previous concurrency level means saturation
+SATURATION_GAIN = 0.1
+
+
+def make_chunks(chunks_dir: str, chunks: int, seconds: int, seed: int = 0) -> None:
+    """
+        .. py:function:: make_chunks(chunks_dir, chunks, seconds, seed)
+
+        Write synthetic mono Ogg/Opus chunks, as split.py does, with json file for asr.py.
+        Every chunk has its own audio, so cached or deduplicated results could not hide requests.
+
+        :param str chunks_dir: Directory for chunks
+        :param int chunks: Number of chunks
+        :param int seconds: Chunk duration in seconds
+        :param int seed: Random seed of audio
+    """
+    os.makedirs(chunks_dir, exist_ok=True)
+    json_data = {}
+    wav_path = os.path.join(chunks_dir, "chunk.wav")
+    for idx in range(chunks):
+        sf.write(wav_path, synth_audio(seconds, SAMPLERATE, seed + idx), SAMPLERATE)
+        filename = "file_{:05d}.ogg".format(idx)
+        with open(os.path.join(chunks_dir, filename), "wb") as chunk_f, asr.prepare_file(wav_path) as audio:
+            chunk_f.write(audio.read())
+        json_data[filename] = {
+            "start": idx * seconds, "end": (idx + 1) * seconds, "asr": None, "found": None, "shift": 0, "diff": 0,
+        }
+    os.remove(wav_path)
+
+    with open(os.path.join(chunks_dir, RESULT_FILE), "w") as json_f:
+        json.dump(json_data, json_f)
+
+
+def run(
+    server: FakeSTTServer,
+    work_dir: str,
+    concurrency_levels: List[int],
+    chunk_seconds: List[int],
+    chunks: int = CHUNKS,
+    retries: int = 3,
+    rate: Optional[float] = None,
+    seed: int = 0,
+) -> List[Dict]:
+    """
+        .. py:function:: run(server, work_dir, concurrency_levels, chunk_seconds, chunks, retries, rate, seed)
+
+        Drive `asr.process` against fake endpoint for every chunk duration and concurrency level
+
+        :param FakeSTTServer server: Running fake endpoint
+        :param str work_dir: Directory for generated chunks
+        :param list[int] concurrency_levels: Concurrent ASR requests to test
+        :param list[int] chunk_seconds: Chunk durations in seconds to test
+        :param int chunks: Chunks per run
+        :param int retries: Max retries of transient errors
+        :param float [rate]: (Optional) Client side limit of requests per second
+        :param int seed: Random seed of audio
+
+        :return: Throughput, latencies, retries and failures of every run
+        :rtype: list[dict]
+    """
+    metrics.enable()
+    rows = []
+    for seconds in chunk_seconds:
+        chunks_dir = os.path.join(work_dir, f"chunks_{seconds}s")
+        logger.info(f"Writing {chunks} chunks of {seconds} seconds")
+        make_chunks(chunks_dir, chunks, seconds, seed)
+        jsonfile = os.path.join(chunks_dir, RESULT_FILE)
+
+        for concurrency in concurrency_levels:
+            logger.info(f"Running {chunks} chunks of {seconds} seconds with concurrency {concurrency}")
+            metrics.reset()
+            server.reset()
+            started = time.perf_counter()
+            asr.process(
+                chunks_dir, "token", "folder", jsonfile, "ru-RU",
+                concurrency=concurrency, rate=rate, retries=retries, endpoint=server.url, transcode_workers=1,
+            )
+            wall = time.perf_counter() - started
+
+            stats = metrics.summary(wall)
+            request = stats["timers"].get("asr.request", {})
+            counters = stats["counters"]
+            done = counters.get("asr.chunks", 0)
+            rows.append({
+                "chunk_seconds": seconds,
+                "concurrency": concurrency,
+                "wall_seconds": round(wall, 3),
+                "chunks": done,
+                "failed": counters.get("asr.errors", 0),
+                "chunks_per_s": round(done / wall, 2),
+                "audio_seconds_per_s": round(done * seconds / wall, 1),
+                "requests": counters.get("asr.requests", 0),
+                "retries": counters.get("asr.requests", 0) - done - counters.get("asr.errors", 0),
+                "throttled": server.responses[429],
+                "server_errors": server.responses[500],
+                "peak_in_flight": server.peak_in_flight,
+                "p50": request.get("p50", 0.0),
+                "p95": request.get("p95", 0.0),
+            })
+    return rows
+
+
+def saturation(rows: List[Dict], gain: float = SATURATION_GAIN) -> Dict[int, Optional[int]]:
+    """
+        .. py:function:: saturation(rows, gain)
+
+        Find concurrency level where throughput stops growing for every chunk duration
+
+        :param list[dict] rows: Results of `run`
+        :param float gain: Min relative throughput growth of the next level
+
+        :return: Chunk duration mapped to the last level before one not faster by gain,
+            None if throughput grows up to the last level
+        :rtype: dict
+    """
+    levels = {}  # type: Dict[int, Optional[int]]
+    for seconds in dict.fromkeys(row["chunk_seconds"] for row in rows):
+        series = sorted((row["concurrency"], row["chunks_per_s"]) for row in rows if row["chunk_seconds"] == seconds)
+        levels[seconds] = next(
+            (level for (level, prev), (_, cur) in zip(series, series[1:]) if cur < prev * (1 + gain)), None
+        )
+    return levels
+
+
+def print_rows(rows: List[Dict]) -> None:
+    """
+        .. py:function:: print_rows(rows)
+
+        Print load test results as table
+
+        :param list[dict] rows: Results of `run`
+
+        :return:
+        :rtype: None
+    """
+    print("{:>7} {:>5} {:>8} {:>6} {:>6} {:>8} {:>8} {:>7} {:>7} {:>6} {:>6} {:>7} {:>7}".format(
+        "chunk,s", "conc", "time,s", "done", "failed", "chunks/s", "audio/s", "retries", "429", "500",
+        "flight", "p50,s", "p95,s"
+    ))
+    for row in rows:
+        print("{chunk_seconds:>7} {concurrency:>5} {wall_seconds:>8.2f} {chunks:>6} {failed:>6} {chunks_per_s:>8.2f} "
+              "{audio_seconds_per_s:>8.1f} {retries:>7} {throttled:>7} {server_errors:>6} {peak_in_flight:>6} "
+              "{p50:>7.3f} {p95:>7.3f}".format(**row))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+            Load test ASR stage against local stand-in of Yandex SpeechKit recognition endpoint.
+
+            CHUNKS synthetic Ogg/Opus chunks of every CHUNK_SECONDS duration are transcribed by asr.py
+            at every CONCURRENCY level. Fake endpoint delay, failures and throttling are set
+            the same way as for fake_stt.py.
+
+            For every run the table shows throughput in chunks and audio seconds per second,
+            retries, 429 and 500 responses, peak requests in flight on server side and
+            p50/p95 of request round-trip, retried attempts included. Throughput saturates at
+            the last concurrency level before one which is not faster by 10%.
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("-c", "--concurrency", type=int, nargs="+", default=list(CONCURRENCY_LEVELS),
+                        help="Concurrency levels")
+    parser.add_argument("-cs", "--chunk-seconds", type=int, nargs="+", default=list(CHUNK_SECONDS),
+                        help="Chunk durations in seconds")
+    parser.add_argument("-n", "--chunks", type=int, default=CHUNKS, help="Chunks per run")
+    parser.add_argument("--retries", type=int, default=3, help="Max retries on transient errors")
+    parser.add_argument("-r", "--rate", type=float, default=None, help="Client side max ASR requests per second")
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake endpoint delay in seconds")
+    parser.add_argument("--latency-per-kb", type=float, default=0.0, help="Delay per kilobyte of audio in seconds")
+    parser.add_argument("--sigma", type=float, default=0.3, help="Log-normal spread of delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failed with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests throttled with 429")
+    parser.add_argument("--max-rps", type=float, default=None, help="Fake endpoint max requests per second")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Fake endpoint max requests in flight")
+    parser.add_argument("--retry-after", type=float, default=RETRY_AFTER, help="Retry-After of 429 in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of audio, delays and failures")
+    parser.add_argument("-wd", "--work-dir", type=str, default=None, help="Directory for generated chunks")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Path to save results json")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every chunk and retry")
+
+    args = parser.parse_args()
+
+    if not args.verbose:
+        asr.logger.setLevel(logging.WARNING)
+        dispatch.logger.setLevel(logging.ERROR)
+
+    _, sentences = synth_text(args.chunks, args.seed)
+    server = FakeSTTServer(
+        sentences, args.latency, 0.0, latency_per_kb=args.latency_per_kb, sigma=args.sigma,
+        error_rate=args.error_rate, throttle_rate=args.throttle_rate, max_rps=args.max_rps,
+        max_concurrency=args.max_concurrency, retry_after=args.retry_after, seed=args.seed,
+    )
+    with server, tempfile.TemporaryDirectory() as tmp_dir:
+        rows = run(
+            server, args.work_dir or tmp_dir, args.concurrency, args.chunk_seconds, args.chunks,
+            args.retries, args.rate, args.seed,
+        )
+
+    print_rows(rows)
+    for seconds, level in saturation(rows).items():
+        if level is None:
+            logger.info(f"Chunks of {seconds}s: throughput grows up to concurrency {max(args.concurrency)}")
+        else:
+            logger.info(f"Chunks of {seconds}s: throughput saturates at concurrency {level}")
+
+    if args.output:
+        with open(args.output + ".tmp", "w") as output_f:
+            json.dump(rows, output_f, indent=2)
+        os.replace(args.output + ".tmp", args.output)
+        logger.info(f"Results saved to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from log import LOGGING_FMT
+
+logger = logging.getLogger("manifest")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+STATUS_SPLIT = "split"
+STATUS_ASR = "asr"
+STATUS_EVAL = "eval"
+# rows added or updated in one transaction
+BATCH_SIZE = 1000
+# max age of buffered updates of a running stage in seconds
+FLUSH_INTERVAL = 1.0
+
+
+class ManifestStore:
+    """
+        .. py:class:: ManifestStore(path)
+
+        SQLite manifest of chunks, one row per chunk with the same fields as json file.
+        Status of a row tells the last finished stage: `split`, `asr` or `eval`.
+        Rows are updated in place in transactions, so stages never rewrite the whole manifest
+        and could work on it at the same time.
+
+        :param str path: SQLite database path
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "filename TEXT PRIMARY KEY, start REAL, end REAL, asr TEXT, found TEXT, "
+                "shift INTEGER, diff INTEGER, status TEXT)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS chunks_status ON chunks (status, start)")
+
+    def add_chunks(self, chunks: Iterable[Tuple[str, float, float]], reset: bool = False) -> None:
+        """
+            .. py:method:: add_chunks(chunks, reset)
+
+            Add chunks written by splitter in a single transaction. Existing chunks are reset.
+            The first batch of a split is added with reset, so chunks of previous split don't stay in manifest.
+
+            :param Iterable chunks: File name, start and end of each chunk
+            :param bool reset: Remove all chunks in the same transaction first
+        """
+        with self.lock, self.connection:
+            if reset:
+                self.connection.execute("DELETE FROM chunks")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, NULL, NULL, 0, 0, ?)",
+                ((filename, start, end, STATUS_SPLIT) for filename, start, end in chunks),
+            )
+
+    def set_asr(self, results: Iterable[Tuple[str, Optional[str]]]) -> None:
+        """
+            .. py:method:: set_asr(results)
+
+            Store ASR results in a single transaction
+
+            :param Iterable results: File name and ASR result of each chunk
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE chunks SET asr = ?, status = ? WHERE filename = ?",
+                ((asr, STATUS_ASR, filename) for filename, asr in results),
+            )
+
+    def set_eval(self, results: Iterable[Tuple[str, str, int, int]]) -> None:
+        """
+            .. py:method:: set_eval(results)
+
+            Store text evaluation results in a single transaction
+
+            :param Iterable results: File name, found text, shift and distance of each chunk
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE chunks SET found = ?, shift = ?, diff = ?, status = ? WHERE filename = ?",
+                ((found, shift, diff, STATUS_EVAL, filename) for filename, found, shift, diff in results),
+            )
+
+    def needing_asr(self, limit: Optional[int] = None) -> List[str]:
+        """
+            .. py:method:: needing_asr(limit)
+
+            File names of chunks not transcribed yet
+
+            :param int [limit]: (Optional) Max number of chunks
+
+            :return: File names in chunk order
+            :rtype: list[str]
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT filename FROM chunks WHERE status = ? ORDER BY start, filename LIMIT ?",
+                (STATUS_SPLIT, -1 if limit is None else limit),
+            )
+            return [filename for (filename,) in rows]
+
+    def needing_eval(self) -> List[Tuple[str, float, str]]:
+        """
+            .. py:method:: needing_eval()
+
+            Transcribed chunks with non-empty ASR result not evaluated yet
+
+            :return: File name, start and ASR result of each chunk in chunk order
+            :rtype: list[tuple]
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT filename, start, asr FROM chunks WHERE status = ? AND asr IS NOT NULL AND asr != '' "
+                "ORDER BY start, filename",
+                (STATUS_ASR,),
+            ).fetchall()
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.connection.execute("SELECT status, COUNT(*) FROM chunks GROUP BY status"))
+
+    def export_json(self, jsonfile: str) -> None:
+        """
+            .. py:method:: export_json(jsonfile)
+
+            Write manifest as json file, compatible with stages run without manifest.
+            Rows are streamed into a temporary file which replaces json file atomically.
+
+            :param str jsonfile: JSON File path
+        """
+        with self.lock, open(jsonfile + ".tmp", "w") as json_f:
+            json_f.write("{")
+            rows = self.connection.execute(
+                "SELECT filename, start, end, asr, found, shift, diff FROM chunks ORDER BY start, filename"
+            )
+            for idx, (filename, start, end, asr, found, shift, diff) in enumerate(rows):
+                item = {"start": start, "end": end, "asr": asr, "found": found, "shift": shift, "diff": diff}
+                json_f.write(", " if idx else "")
+                json_f.write(f"{json.dumps(filename)}: {json.dumps(item, ensure_ascii=False)}")
+            json_f.write("}")
+        os.replace(jsonfile + ".tmp", jsonfile)
+        logger.info(f"Manifest exported to {os.path.abspath(jsonfile)}")
+
+    def import_json(self, jsonfile: str) -> None:
+        """
+            .. py:method:: import_json(jsonfile)
+
+            Load json file written by stages run without manifest
+
+            :param str jsonfile: JSON File path
+        """
+        with open(jsonfile, "r") as json_f:
+            data = json.load(json_f)
+
+        def status(item):
+            if item.get("found") is not None:
+                return STATUS_EVAL
+            return STATUS_ASR if item.get("asr") is not None else STATUS_SPLIT
+
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        filename, item.get("start"), item.get("end"), item.get("asr"), item.get("found"),
+                        item.get("shift"), item.get("diff"), status(item),
+                    )
+                    for filename, item in data.items()
+                ),
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class ManifestWriter:
+    """
+        .. py:class:: ManifestWriter(store, reset, size, interval)
+
+        Buffer of manifest updates made by running stages, one row at a time.
+        Buffered rows are written when there are SIZE of them or the oldest one is INTERVAL seconds old,
+        checked as rows are added. Chunks are written before ASR and evaluation results,
+        so a result never updates a chunk row which is still buffered.
+
+        :param ManifestStore store: Manifest
+        :param bool reset: The first written chunks replace chunks of previous split
+        :param int size: Max buffered rows
+        :param float interval: Max age of buffered rows in seconds
+    """
+
+    def __init__(
+        self, store: ManifestStore, reset: bool = False, size: int = BATCH_SIZE, interval: float = FLUSH_INTERVAL
+    ):
+        self.store = store
+        self.reset = reset
+        self.size = size
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.chunks = []  # type: List[Tuple[str, float, float]]
+        self.asr = []  # type: List[Tuple[str, Optional[str]]]
+        self.eval = []  # type: List[Tuple[str, str, int, int]]
+        self.oldest = None  # type: Optional[float]
+
+    def add_chunk(self, filename: str, start: float, end: float) -> None:
+        self._add(self.chunks, (filename, start, end))
+
+    def set_asr(self, filename: str, asr: Optional[str]) -> None:
+        self._add(self.asr, (filename, asr))
+
+    def set_eval(self, filename: str, found: str, shift: int, diff: int) -> None:
+        self._add(self.eval, (filename, found, shift, diff))
+
+    def _add(self, rows: List, row: Tuple) -> None:
+        with self.lock:
+            rows.append(row)
+            now = time.monotonic()
+            if self.oldest is None:
+                self.oldest = now
+            if len(self.chunks) + len(self.asr) + len(self.eval) >= self.size or now - self.oldest >= self.interval:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self.chunks:
+            self.store.add_chunks(self.chunks, self.reset)
+            self.reset = False
+        if self.asr:
+            self.store.set_asr(self.asr)
+        if self.eval:
+            self.store.set_eval(self.eval)
+        self.chunks, self.asr, self.eval = [], [], []
+        self.oldest = None
+
+    def flush(self) -> None:
+        """
+            .. py:method:: flush()
+
+            Write all buffered rows. Chunks of previous split are removed even if no chunk was added.
+        """
+        with self.lock:
+            self._flush()
+            if self.reset:
+                self.store.add_chunks([], reset=True)
+                self.reset = False
+
+
+def open_store(path: str, jsonfile: Optional[str] = None) -> ManifestStore:
+    """
+        .. py:function:: open_store(path, jsonfile)
+
+        Open manifest, empty manifest is filled from json file if it exists
+
+        :param str path: SQLite database path
+        :param str [jsonfile]: (Optional) JSON File path
+
+        :return: Manifest store
+        :rtype: ManifestStore
+    """
+    store = ManifestStore(path)
+    if jsonfile and os.path.exists(jsonfile) and not store.counts():
+        logger.info(f"Importing {jsonfile} into manifest")
+        store.import_json(jsonfile)
+    return store
@@ -0,0 +1,106 @@
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class Match(NamedTuple):
+    start: int
+    end: int
+    dist: int
+    matched: str
+
+
+def _peq(pattern: str) -> Dict[str, int]:
+    peq = {}  # type: Dict[str, int]
+    for i, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | 1 << i
+    return peq
+
+
+def edit_distances(pattern: str, text: str, anchored: bool = False) -> Iterator[int]:
+    """
+        .. py:function:: edit_distances(pattern, text, anchored)
+
+        Myers' bit-parallel approximate string matching. Pattern columns are bits of Python int,
+        so pattern length is not limited and every text character costs a few integer operations.
+
+        :param str pattern: Pattern
+        :param str text: Text
+        :param bool anchored: Substrings start at text beginning, otherwise they could start anywhere
+
+        :return: Iterator over min edit distance between pattern and substring ending after each text character
+        :rtype: Iterator[int]
+    """
+    m = len(pattern)
+    peq = _peq(pattern)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    carry = 1 if anchored else 0
+
+    for char in text:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = (ph << 1 | carry) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        yield score
+
+
+def _best_end(pattern: str, text: str, start: int, end: int) -> Tuple[int, int]:
+    best, best_end = len(pattern), start
+    for pos, score in enumerate(edit_distances(pattern, text[start:end]), start + 1):
+        if score < best:
+            best, best_end = score, pos
+            if not best:
+                break
+    return best, best_end
+
+
+def find_best_match(
+    pattern: str, text: str, max_dist: Optional[int] = None, windows: Optional[List[Tuple[int, int]]] = None
+) -> Optional[Match]:
+    """
+        .. py:function:: find_best_match(pattern, text, max_dist, windows)
+
+        Find substring of text with minimal edit distance to pattern in a single pass.
+        End of the best substring is found by forward pass over text, its start by anchored pass
+        over reversed pattern and text preceding the end. Earliest substring wins among equally good ones.
+
+        :param str pattern: Pattern
+        :param str text: Text
+        :param int [max_dist]: (Optional) Max edit distance, no match if the best one is worse
+        :param list [windows]: (Optional) Start and end of text regions to search in, whole text if not set
+
+        :return: Best match or None
+        :rtype: Match
+    """
+    if not pattern:
+        return None
+
+    best, best_end = len(pattern), 0
+    for start, end in windows or [(0, len(text))]:
+        dist, pos = _best_end(pattern, text, start, end)
+        if dist < best:
+            best, best_end = dist, pos
+            if not best:
+                break
+
+    if best >= len(pattern) or (max_dist is not None and best > max_dist):
+        return None
+
+    # substring is not longer than pattern plus insertions
+    lookback = min(len(pattern) + best, best_end)
+    prefix = text[best_end - lookback:best_end][::-1]
+    length = min(
+        (abs(length - len(pattern)), length)
+        for length, score in enumerate(edit_distances(pattern[::-1], prefix, anchored=True), 1)
+        if score == best
+    )[1]
+    return Match(best_end - length, best_end, best, text[best_end - length:best_end])
@@ -0,0 +1,266 @@
+import argparse
+import cProfile
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from array import array
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from log import LOGGING_FMT
+
+logger = logging.getLogger("metrics")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+# sampling profiler interval in seconds
+SAMPLE_INTERVAL = 0.005
+
+_enabled = False
+_lock = threading.Lock()
+_timings = {}  # type: Dict[str, array]
+_counters = collections.Counter()  # type: collections.Counter
+_null = contextlib.nullcontext()
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+
+
+def record(name: str, seconds: float) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        if name not in _timings:
+            _timings[name] = array("d")
+        _timings[name].append(seconds)
+
+
+def count(name: str, value: float = 1) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += value
+
+
+class _Timer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started)
+
+
+def timer(name: str):
+    """
+        .. py:function:: timer(name)
+
+        Context manager recording wall time of its block under given name.
+        Does nothing when metrics are disabled.
+
+        :param str name: Timer name, e.g. `split.encode`
+
+        :return: Context manager
+    """
+    return _Timer(name) if _enabled else _null
+
+
+def snapshot() -> Optional[Tuple[Dict[str, list], Dict[str, float]]]:
+    if not _enabled:
+        return None
+    with _lock:
+        return {name: values.tolist() for name, values in _timings.items()}, dict(_counters)
+
+
+def merge(data: Optional[Tuple[Dict[str, list], Dict[str, float]]]) -> None:
+    """
+        .. py:function:: merge(data)
+
+        Add metrics collected in another process
+
+        :param tuple [data]: Snapshot of other process, None if metrics were disabled there
+    """
+    if not data or not _enabled:
+        return
+    timings, counters = data
+    with _lock:
+        for name, values in timings.items():
+            _timings.setdefault(name, array("d")).extend(values)
+        _counters.update(counters)
+
+
+def collect(func: Callable, *args, **kwargs) -> Tuple[Any, Optional[Tuple]]:
+    """
+        .. py:function:: collect(func, *args, **kwargs)
+
+        Call function in a worker process and return its metrics along with result,
+        to be merged by parent with `merge`. Metrics inherited from parent by fork are dropped first.
+
+        :param callable func: Function to call
+
+        :return: Function result and metrics snapshot
+        :rtype: tuple
+    """
+    reset()
+    result = func(*args, **kwargs)
+    return result, snapshot()
+
+
+def _percentile(values: list, q: float) -> float:
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def summary(wall: float) -> Dict:
+    """
+        .. py:function:: summary(wall)
+
+        Summarize collected metrics. Every counter gets a rate per wall second,
+        `audio_seconds` counters give audio seconds processed per wall second.
+
+        :param float wall: Wall time of the run in seconds
+
+        :return: Timers latencies, counters and rates
+        :rtype: dict
+    """
+    with _lock:
+        timings = {name: sorted(values) for name, values in _timings.items()}
+        counters = dict(_counters)
+
+    timers = {
+        name: {
+            "count": len(values),
+            "total": round(sum(values), 6),
+            "mean": round(sum(values) / len(values), 6),
+            "p50": round(_percentile(values, 0.5), 6),
+            "p95": round(_percentile(values, 0.95), 6),
+            "max": round(values[-1], 6),
+        }
+        for name, values in timings.items() if values
+    }
+    rates = {f"{name}_per_s": round(value / wall, 3) if wall else 0.0 for name, value in counters.items()}
+    return {"wall_seconds": round(wall, 3), "timers": timers, "counters": counters, "rates": rates}
+
+
+class SamplingProfiler:
+    """
+        .. py:class:: SamplingProfiler(interval)
+
+        Profiler taking stacks of all threads every interval from a background thread.
+        Unlike cProfile it sees worker threads and costs the same for any number of calls.
+        Stacks are written in collapsed format of flame graph tools: `frame;frame;frame count`.
+
+        :param float interval: Sampling interval in seconds
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()  # type: collections.Counter
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="sampling profiler", daemon=True)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as profile_f:
+            for stack, samples in self.stacks.most_common():
+                profile_f.write(f"{stack} {samples}\n")
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--metrics", type=str, default=None, help="Path to write json summary of timers and counters")
+    parser.add_argument("--profile", type=str, default=None, help="Path to write profile of the run")
+    parser.add_argument(
+        "--profile-sampling", action="store_true",
+        help="Sample stacks of all threads instead of cProfile, profile is written as collapsed stacks"
+    )
+
+
+@contextlib.contextmanager
+def session(
+    metrics_path: Optional[str] = None, profile_path: Optional[str] = None, sampling: bool = False
+) -> Iterator[None]:
+    """
+        .. py:function:: session(metrics_path, profile_path, sampling)
+
+        Collect metrics and profile of the block. Metrics are enabled only if metrics path is set,
+        summary is written there at the end of the block, even if it failed.
+
+        :param str [metrics_path]: (Optional) Path to write json summary
+        :param str [profile_path]: (Optional) Path to write profile
+        :param bool sampling: Use sampling profiler instead of cProfile
+    """
+    if metrics_path:
+        enable()
+    profiler = None  # type: Any
+    if profile_path:
+        profiler = SamplingProfiler() if sampling else cProfile.Profile()
+        if sampling:
+            profiler.start()
+        else:
+            profiler.enable()
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - started
+        if profiler:
+            if sampling:
+                profiler.stop()
+                profiler.dump(profile_path)
+            else:
+                profiler.disable()
+                profiler.dump_stats(profile_path)
+            logger.info(f"Profile written to {os.path.abspath(profile_path)}")
+
+        if metrics_path:
+            with open(metrics_path + ".tmp", "w") as metrics_f:
+                json.dump(summary(wall), metrics_f, indent=2)
+            os.replace(metrics_path + ".tmp", metrics_path)
+            logger.info(f"Metrics written to {os.path.abspath(metrics_path)}")
@@ -0,0 +1,531 @@
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import audio_cache
+import metrics
+from asr import TRANSCODE_WORKERS, make_recognizer, transcribe
+from asr_cache import ASRCache
+from dispatch import TokenBucket
+from log import LOGGING_FMT
+from manifest import ManifestStore, ManifestWriter
+from speech.yandex import YANDEX_STT_URL
+from split import (
+    PACK_MAX_DURATION, PACK_MAX_GAP, RESULT_FILE, SEGMENTATION_METHODS, STREAM_BLOCK_LENGTH, split_chunks
+)
+from text_eval import load_text, match_sentence
+from text_index import KMER_SIZE
+
+logger = logging.getLogger("pipeline")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+# max chunks waiting between two stages
+QUEUE_SIZE = 64
+# chunks are passed to ASR once their ffmpeg batch is written, so batches are small
+EXPORT_BATCH_SIZE = 16
+# how often blocked stages check if pipeline is stopped, in seconds
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+def _put(channel: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            channel.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(channel: queue.Queue, stop: threading.Event) -> Iterator:
+    """
+        .. py:function:: _drain(channel, stop)
+
+        Take items from queue until the end marker is met or pipeline is stopped
+
+        :param queue.Queue channel: Queue between two stages
+        :param threading.Event stop: Set when a stage failed
+
+        :return: Iterator over queue items
+        :rtype: Iterator
+    """
+    while True:
+        try:
+            item = channel.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+def _stage(target, output: queue.Queue, stop: threading.Event, errors: List[Exception]) -> threading.Thread:
+    def run():
+        try:
+            target()
+        except Exception as e:
+            logger.exception("Pipeline stage failed")
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(output, _DONE, stop)
+
+    thread = threading.Thread(target=run, name=target.__name__)
+    thread.start()
+    return thread
+
+
+def _split_stage(
+    input_file: str,
+    output_dir: str,
+    options: Dict,
+    writer: Optional[ManifestWriter],
+    json_data: Dict,
+    order: Dict[str, int],
+    chunks_q: queue.Queue,
+    stop: threading.Event,
+) -> None:
+    for filename, start, end in split_chunks(input_file, output_dir, **options):
+        order[filename] = len(order)
+        json_data[filename] = {"start": start, "end": end, "asr": None, "found": None, "shift": 0, "diff": 0}
+        if writer:
+            writer.add_chunk(filename, start, end)
+        if not _put(chunks_q, os.path.join(output_dir, filename), stop):
+            return
+
+
+def _asr_stage(
+    chunks_q: queue.Queue,
+    results_q: queue.Queue,
+    stop: threading.Event,
+    recognizer,
+    engine: str,
+    language: str,
+    concurrency: int,
+    rate: Optional[float],
+    retries: int,
+    cache_path: Optional[str],
+    transcode_workers: int,
+) -> None:
+    # SQLite connection of cache is used only by the thread which opened it
+    cache = ASRCache(cache_path) if cache_path else None
+    bucket = TokenBucket(rate) if rate else None
+    try:
+        results = transcribe(
+            _drain(chunks_q, stop), recognizer, engine, language, concurrency, bucket, retries, cache,
+            transcode_workers,
+        )
+        for result in results:
+            if not _put(results_q, result, stop):
+                return
+    finally:
+        if cache:
+            cache.close()
+
+
+def _record_asr(
+    results: Iterable[Tuple[str, Optional[str], Optional[Exception]]],
+    json_data: Dict,
+    writer: Optional[ManifestWriter],
+    stats: collections.Counter,
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+        .. py:function:: _record_asr(results, json_data, writer, stats)
+
+        Store ASR results in json data and manifest as they come
+
+        :param Iterable results: File name, result and error of each chunk
+        :param dict json_data: Json file data
+        :param ManifestWriter [writer]: (Optional) Buffer of manifest updates
+        :param collections.Counter stats: Counter of transcribed chunks
+
+        :return: Iterator over file name and sentence of each chunk, sentence is None on error
+        :rtype: Iterator[tuple]
+    """
+    for filename, result, error in results:
+        if error:
+            logger.error(f"Error while transcribing chunk {filename}: {error}")
+            yield filename, None
+            continue
+        stats["transcribed"] += 1
+        json_data[filename]["asr"] = result
+        if writer:
+            writer.set_asr(filename, result)
+        yield filename, result
+
+
+def _in_order(sentences: Iterable[Tuple[str, Optional[str]]], order: Dict[str, int]) -> Iterator[Tuple]:
+    """
+        .. py:function:: _in_order(sentences, order)
+
+        Reorder sentences coming in order of completion into recording order.
+        A sentence is held back until sentences of all previous chunks have come.
+
+        :param Iterable sentences: File name and sentence of each chunk
+        :param dict order: Index of every chunk in recording, filled while chunks are split
+
+        :return: Iterator over file name and sentence of each chunk in recording order
+        :rtype: Iterator[tuple]
+    """
+    pending = {}  # type: Dict[int, tuple]
+    next_idx = 0
+    for filename, sentence in sentences:
+        pending[order[filename]] = filename, sentence
+        while next_idx in pending:
+            yield pending.pop(next_idx)
+            next_idx += 1
+
+
+def _evaluate(
+    sentences: Iterable[Tuple[str, Optional[str]]],
+    text: str,
+    offsets,
+    text_index,
+    qmax: int,
+    monotonic: bool,
+    json_data: Dict,
+    writer: Optional[ManifestWriter],
+    stats: collections.Counter,
+) -> None:
+    """
+        .. py:function:: _evaluate(sentences, text, offsets, text_index, qmax, monotonic, json_data, writer, stats)
+
+        Find sentences in text as they come, store matches in json data and manifest.
+        In monotonic mode every sentence is searched right after the previous match first.
+
+        :param Iterable sentences: File name and sentence of each chunk, sentence is None on error
+        :param str text: Normalized text
+        :param offsets: Source text position of every normalized text position
+        :param text_index: (Optional) Text index
+        :param int qmax: Max Value of Levenshtein distance
+        :param bool monotonic: Search every sentence right after the previous one first
+        :param dict json_data: Json file data
+        :param ManifestWriter [writer]: (Optional) Buffer of manifest updates
+        :param collections.Counter stats: Counter of matched chunks
+    """
+    cursor = 0 if monotonic else None
+    for filename, sentence in sentences:
+        if not sentence:
+            continue
+        logger.info(f"Evaluating sentence of chunk {filename}")
+        with metrics.timer("eval.match"):
+            best = match_sentence(sentence, text, qmax, text_index, cursor)
+        metrics.count("eval.sentences")
+        if not best:
+            continue
+        metrics.count("eval.found")
+        stats["matched"] += 1
+        if monotonic:
+            cursor = best.end
+        item = json_data[filename]
+        item.update(found=best.matched, shift=offsets[best.start], diff=best.dist)
+        if writer:
+            writer.set_eval(filename, item["found"], item["shift"], item["diff"])
+
+
+def process(
+    input_file: str,
+    output_dir: str,
+    text_input: str,
+    language: str,
+    iam_token: Optional[str] = None,
+    folder_id: Optional[str] = None,
+    split_options: Optional[Dict] = None,
+    concurrency: int = 4,
+    rate: Optional[float] = None,
+    retries: int = 3,
+    endpoint: str = YANDEX_STT_URL,
+    cache_path: Optional[str] = None,
+    transcode_workers: int = TRANSCODE_WORKERS,
+    qmax: int = 70,
+    index: bool = True,
+    save_index: bool = False,
+    kmer_size: int = KMER_SIZE,
+    monotonic: bool = False,
+    queue_size: int = QUEUE_SIZE,
+    manifest_db: Optional[str] = None,
+) -> None:
+    """
+        .. py:function:: process(
+            input_file, output_dir, text_input, language, iam_token, folder_id, split_options, concurrency, rate,
+            retries, endpoint, cache_path, transcode_workers, qmax, index, save_index, kmer_size, monotonic,
+            queue_size, manifest_db)
+
+        Split audio, transcribe chunks and find them in source text at the same time.
+        Splitter and ASR run in threads joined by bounded queues with evaluation in the calling thread:
+        every chunk goes to ASR as soon as it is written and to evaluation as soon as it is transcribed.
+        A stage blocks while its output queue is full, so a slow stage holds back the previous ones.
+        Results are written to json file in output dir, same as after running every stage separately.
+
+        :param str input_file: Input audio file path
+        :param str output_dir: Path for output chunks and json file directory
+        :param str text_input: Path to source text
+        :param str language: Language Code, e.g. ru-RU, en-US
+        :param str [iam_token]: (Optional) IAM Token for Yandex Cloud
+        :param str [folder_id]: (Optional) Folder id for Yandex Cloud
+        :param dict [split_options]: (Optional) Arguments of `split.split_chunks` except input file and output dir
+        :param int concurrency: Number of concurrent ASR requests
+        :param float [rate]: (Optional) Max ASR requests per second
+        :param int retries: Max number of retries on transient errors
+        :param str endpoint: Yandex SpeechKit recognition endpoint URL
+        :param str [cache_path]: (Optional) Path to SQLite ASR results cache
+        :param int transcode_workers: Number of concurrent transcodings of incompatible chunks
+        :param int qmax: Max Value of Levenshtein distance
+        :param bool index: Search in candidate windows found by k-mer index instead of whole text
+        :param bool save_index: Save index next to source text and reuse it
+        :param int kmer_size: Index shingle length
+        :param bool monotonic: Search every sentence right after the previous one first
+        :param int queue_size: Max chunks waiting between two stages
+        :param str [manifest_db]: (Optional) SQLite manifest path, chunks are updated in it by batches
+            as they pass stages
+
+        :return: None
+        :rtype: None
+    """
+    options = {
+        "samplerate": None, "prefix": "file", "method": "rms", "frame_length": 1000, "frame_shift": 50,
+        "q_factor": 0.7, "limit": None, "export_batch": EXPORT_BATCH_SIZE,
+    }
+    options.update(split_options or {})
+
+    os.makedirs(output_dir, exist_ok=True)
+    store = ManifestStore(manifest_db) if manifest_db else None
+    # the first written chunks replace chunks of previous split of the same output
+    writer = ManifestWriter(store, reset=True) if store else None
+    engine, recognizer = make_recognizer(language, iam_token, folder_id, endpoint)
+
+    json_data = {}  # type: Dict[str, Dict]
+    # order of chunks in recording, for monotonic evaluation
+    order = {}  # type: Dict[str, int]
+    chunks_q = queue.Queue(maxsize=queue_size)  # type: queue.Queue
+    results_q = queue.Queue(maxsize=queue_size)  # type: queue.Queue
+    stop = threading.Event()
+    errors = []  # type: List[Exception]
+    stats = collections.Counter()  # type: collections.Counter
+
+    def split_stage():
+        _split_stage(input_file, output_dir, options, writer, json_data, order, chunks_q, stop)
+
+    def asr_stage():
+        _asr_stage(
+            chunks_q, results_q, stop, recognizer, engine, language, concurrency, rate, retries, cache_path,
+            transcode_workers,
+        )
+
+    started = time.monotonic()
+    logger.info("Starting pipeline")
+    stages = [_stage(split_stage, chunks_q, stop, errors), _stage(asr_stage, results_q, stop, errors)]
+
+    try:
+        # text is loaded while first chunks are being split
+        text, offsets, text_index = load_text(text_input, index, save_index, kmer_size)
+
+        sentences = _record_asr(_drain(results_q, stop), json_data, writer, stats)
+        if monotonic:
+            # transcribed chunks come in order of completion, monotonic search takes them in recording order
+            sentences = _in_order(sentences, order)
+        _evaluate(sentences, text, offsets, text_index, qmax, monotonic, json_data, writer, stats)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for stage in stages:
+            stage.join()
+        recognizer.close()
+        if writer:
+            writer.flush()
+
+    if errors:
+        raise errors[0]
+
+    logger.info(
+        f"Pipeline finished in {time.monotonic() - started:.1f}s: {len(order)} chunks split, "
+        f"{stats['transcribed']} transcribed, {stats['matched']} found in text"
+    )
+
+    json_path = os.path.join(output_dir, RESULT_FILE)
+    if store:
+        store.export_json(json_path)
+        store.close()
+        return
+
+    with open(json_path + ".tmp", "w") as json_file:
+        json.dump(json_data, json_file, ensure_ascii=False)
+    os.replace(json_path + ".tmp", json_path)
+    logger.info(f"JSON file written. Resulting json file is {os.path.abspath(json_path)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+            Split audio, process ASR and find chunks in text in one run.
+
+            Stages run at the same time joined by queues of QUEUE_SIZE chunks: every chunk is sent
+            to ASR as soon as it is written and searched in text as soon as it is transcribed.
+            A stage waits while its queue is full, so memory usage is bounded and
+            total time approaches time of the slowest stage instead of the sum of all three.
+
+            Chunks are exported by batches of EXPORT_BATCH chunks, small batches pass chunks to ASR sooner.
+            Other parameters are the same as of split.py, asr.py and text_eval.py.
+            Results are written to <output dir>/result.json.
+
+            With `--metrics` timers and counters of all stages are written to json file,
+            see split.py, asr.py and text_eval.py. `--profile-sampling` profiler sees all stage threads.
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("-i", "--input-file", type=str, help="Input file path")
+    parser.add_argument("-o", "--output-dir", type=str, default="output", help="Ogg files dir")
+    parser.add_argument("-t", "--text-input", type=str, help="Input TXT with source")
+    parser.add_argument("-ll", "--language", type=str, help="Language")
+    parser.add_argument("--iam", type=str, help="YC IAM Token")
+    parser.add_argument("--folder-id", type=str, help="YC Folder ID")
+    parser.add_argument("-m", "--method", default="rms", type=str, choices=sorted(SEGMENTATION_METHODS),
+                        help="Segmentation method: `ina` for INA Speech Segmenter or `rms` for RMS-Based")
+    parser.add_argument("-p", "--prefix", type=str, default="file", help="Output file name prefix")
+    parser.add_argument("-fl", "--frame-length", type=int, default=1000, help="Librosa frame length")
+    parser.add_argument("-fs", "--frame-shift", type=int, default=50, help="Librosa frame shift")
+    parser.add_argument("-l", "--limit", type=int, default=None, help="Source audio length from start")
+    parser.add_argument("-sr", "--samplerate", type=int, default=None, help="Source audio samplerate")
+    parser.add_argument("-q", "--q-factor", type=float, default=0.7, help="Qualify Factor")
+    parser.add_argument(
+        "-st", "--stream", action="store_true", help="Read input by blocks with constant memory (RMS method only)"
+    )
+    parser.add_argument(
+        "-bl", "--block-length", type=int, default=STREAM_BLOCK_LENGTH, help="Streaming block length in seconds"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes for chunks encoding")
+    parser.add_argument(
+        "-eb", "--export-backend", default="ffmpeg", choices=("ffmpeg", "pydub"), help="Chunks export backend"
+    )
+    parser.add_argument(
+        "-bs", "--export-batch", type=int, default=EXPORT_BATCH_SIZE, help="Chunks exported by one ffmpeg process"
+    )
+    parser.add_argument("-cd", "--cache-dir", type=str, default=None, help="Decoded audio cache dir")
+    parser.add_argument(
+        "-cs", "--cache-size", type=int, default=audio_cache.CACHE_SIZE, help="Decoded audio cache size in MB"
+    )
+    parser.add_argument(
+        "-pt", "--pack-target", type=float, default=None,
+        help="Merge adjacent segments up to this duration in seconds, no packing by default"
+    )
+    parser.add_argument(
+        "-pg", "--pack-max-gap", type=float, default=PACK_MAX_GAP, help="Max gap between merged segments in seconds"
+    )
+    parser.add_argument(
+        "-pm", "--pack-max-duration", type=float, default=PACK_MAX_DURATION,
+        help="Max duration of merged segments in seconds"
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Number of concurrent ASR requests")
+    parser.add_argument("-r", "--rate", type=float, default=None, help="Max ASR requests per second")
+    parser.add_argument("--retries", type=int, default=3, help="Max retries on transient errors")
+    parser.add_argument("--endpoint", type=str, default=YANDEX_STT_URL, help="Yandex SpeechKit recognition URL")
+    parser.add_argument("--cache", type=str, default=None, help="Path to SQLite ASR results cache")
+    parser.add_argument(
+        "-tw", "--transcode-workers", type=int, default=TRANSCODE_WORKERS,
+        help="Number of concurrent transcodings of chunks which are not mono Ogg/Opus",
+    )
+    parser.add_argument("-qmax", "--q-factor-max", type=int, default=70, help="Max Possible Levenshtein distance")
+    parser.add_argument("--no-index", action="store_true", help="Search every sentence in the whole text")
+    parser.add_argument("--save-index", action="store_true", help="Save text index next to source text")
+    parser.add_argument("-k", "--kmer-size", type=int, default=KMER_SIZE, help="Text index shingle length")
+    parser.add_argument(
+        "-mn", "--monotonic", action="store_true", help="Search every sentence after the previous match first"
+    )
+    parser.add_argument("-qs", "--queue-size", type=int, default=QUEUE_SIZE, help="Max chunks waiting between stages")
+    parser.add_argument("-db", "--manifest-db", type=str, default=None, help="SQLite manifest path")
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    language = args.language
+    if not language:
+        logger.error("Please specify language code of input audio file.")
+        exit(1)
+
+    if language == "ru-RU" and not all((args.iam, args.folder_id)):
+        logger.error(
+            "Please provide both Yandex Cloud IAM Token and Folder ID."
+            "See https://cloud.yandex.ru/docs/iam/operations/iam-token/create"
+        )
+        exit(1)
+
+    elif language == "en-US" and not os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+        logger.error(
+            "Please export GOOGLE_APPLICATION_CREDENTIALS to environment."
+            "See https://cloud.google.com/speech-to-text/docs/libraries#linux-or-macos"
+        )
+        exit(1)
+
+    kwargs = {
+        "input_file": args.input_file,
+        "output_dir": args.output_dir,
+        "text_input": args.text_input,
+        "language": language,
+        "iam_token": args.iam,
+        "folder_id": args.folder_id,
+        "split_options": {
+            "method": args.method,
+            "samplerate": args.samplerate,
+            "prefix": args.prefix,
+            "frame_length": args.frame_length,
+            "frame_shift": args.frame_shift,
+            "q_factor": args.q_factor,
+            "limit": args.limit,
+            "stream": args.stream,
+            "block_length": args.block_length,
+            "workers": args.workers,
+            "export_backend": args.export_backend,
+            "export_batch": args.export_batch,
+            "cache_dir": args.cache_dir,
+            "cache_size": args.cache_size,
+            "pack_target": args.pack_target,
+            "pack_max_gap": args.pack_max_gap,
+            "pack_max_duration": args.pack_max_duration,
+        },
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "retries": args.retries,
+        "endpoint": args.endpoint,
+        "cache_path": args.cache,
+        "transcode_workers": args.transcode_workers,
+        "qmax": args.q_factor_max,
+        "index": not args.no_index,
+        "save_index": args.save_index,
+        "kmer_size": args.kmer_size,
+        "monotonic": args.monotonic,
+        "queue_size": args.queue_size,
+        "manifest_db": args.manifest_db,
+    }
+
+    logger.info("settings loaded:")
+    for k, v in kwargs.items():
+        if k in ("iam_token", "folder_id") and v:
+            logger.info(f"{k}: [hidden]")
+        else:
+            logger.info(f"{k}: {v}")
+
+    with metrics.session(args.metrics, args.profile, args.profile_sampling):
+        process(**kwargs)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,81 @@
 import io
+from typing import Optional, Union
 
 from google.cloud import speech_v1
 from google.cloud.speech_v1.gapic import enums
 
+from speech.ogg import opus_samplerate
 
-def transcribe_google(audio_data: io.BytesIO, language: str, sample_rate: int) -> str:
+
+class GoogleRecognizer:
+    """
+        .. py:class:: GoogleRecognizer(language, sample_rate)
+
+        Google Speech API adapter for the whole run.
+        Holds a single thread-safe gRPC client, so channel setup and credentials loading are done once.
+        Ogg/Opus fragments are declared as OGG_OPUS with sample rate from their header, others as LINEAR16.
+
+        :param str language: Language Code
+        :param int sample_rate: Sample Rate of LINEAR16 fragments
+    """
+
+    def __init__(self, language: str, sample_rate: int):
+        self.client = speech_v1.SpeechClient()
+        self.language = language
+        self.sample_rate = sample_rate
+
+    def config(self, audio_data: bytes) -> dict:
+        """
+            .. py:method:: config(audio_data)
+
+            Recognition config matching encoding of given audio fragment
+
+            :param bytes audio_data: Audio fragment
+
+            :return: Recognition config
+            :rtype: dict
+        """
+        opus_rate = opus_samplerate(audio_data)
+        if opus_rate:
+            encoding, sample_rate = enums.RecognitionConfig.AudioEncoding.OGG_OPUS, opus_rate
+        else:
+            encoding, sample_rate = enums.RecognitionConfig.AudioEncoding.LINEAR16, self.sample_rate
+        return {"language_code": self.language, "sample_rate_hertz": sample_rate, "encoding": encoding}
+
+    def recognize(self, audio_data: bytes) -> Optional[str]:
+        """
+            .. py:method:: recognize(audio_data)
+
+            Transcribe given audio fragment
+
+            :param bytes audio_data: Audio fragment
+
+            :return: Transcript joined from first alternative of each result
+            :rtype: str
+        """
+        response = self.client.recognize(self.config(audio_data), {"content": audio_data})
+        transcripts = [result.alternatives[0].transcript for result in response.results if result.alternatives]
+        return " ".join(transcripts) if transcripts else None
+
+    def close(self) -> None:
+        self.client.transport.channel.close()
+
+
+def transcribe_google(audio_data: Union[io.BytesIO, bytes], language: str, sample_rate: int) -> Optional[str]:
     """
         .. py:function:: transcribe_google(audio_data, language, sample_rate)
 
-        Transcribe given audio fragment in Google Speech API
+        Transcribe given audio fragment in Google Speech API.
+        Creates new client for each call, use `GoogleRecognizer` for many fragments.
 
         :param io.BytesIO audio_data: Audio fragment
         :param str language: Language Code
-        :param int sample_rate: File Sample Rate
+        :param int sample_rate: Sample Rate of LINEAR16 fragment
 
-        :return: String of first recognized result
+        :return: Transcript joined from first alternative of each result
         :rtype: str
     """
-    client = speech_v1.SpeechClient()
-
-    sample_rate_hertz = sample_rate
-    encoding = enums.RecognitionConfig.AudioEncoding.LINEAR16
-    config = {
-        "language": language,
-        "sample_rate_hertz": sample_rate_hertz,
-        "encoding": encoding,
-    }
-    with audio_data as f:
-        content = f.read()
-    audio = {"content": content}
-
-    response = client.recognize(config, audio)
-    for result in response.results:
-        alternative = result.alternatives[0]
-
-    return alternative
+    if isinstance(audio_data, io.BytesIO):
+        with audio_data as f:
+            audio_data = f.read()
+    return GoogleRecognizer(language, sample_rate).recognize(audio_data)
@@ -0,0 +1,49 @@
+import struct
+from typing import Optional, Tuple
+
+OPUS_SAMPLERATE = 48000
+OPUS_SAMPLERATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_PROBE_SIZE = 64
+
+
+def opus_head(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+        .. py:function:: opus_head(data)
+
+        Parse identification header of Ogg/Opus stream.
+        It is the only packet of the first Ogg page, so the beginning of the file is enough.
+
+        :param bytes data: Beginning of the file, at least 47 bytes
+
+        :return: Number of channels and input sample rate, None if data is not Ogg/Opus
+        :rtype: tuple
+    """
+    if data[:4] != b"OggS" or len(data) < 27:
+        return None
+
+    # page header is 27 bytes followed by segment table
+    head = 27 + data[26]
+    if data[head:head + 8] != b"OpusHead" or len(data) < head + 16:
+        return None
+
+    channels = data[head + 9]
+    (samplerate,) = struct.unpack("<I", data[head + 12:head + 16])
+    return channels, samplerate or OPUS_SAMPLERATE
+
+
+def opus_samplerate(data: bytes) -> Optional[int]:
+    """
+        .. py:function:: opus_samplerate(data)
+
+        Sample rate to declare for Ogg/Opus stream. Opus is always decoded at 48 kHz,
+        so input sample rates not allowed by ASR engines fall back to it.
+
+        :param bytes data: Beginning of the file
+
+        :return: Sample rate, None if data is not Ogg/Opus
+        :rtype: int
+    """
+    head = opus_head(data)
+    if head is None:
+        return None
+    return head[1] if head[1] in OPUS_SAMPLERATES else OPUS_SAMPLERATE
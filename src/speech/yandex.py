@@ -1,33 +1,120 @@
+import http.client
 import io
 import json
-import urllib.request
-from typing import Union
+import threading
+import urllib.error
+import urllib.parse
+from typing import List, Union
 
+YANDEX_STT_URL = "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize"
+YANDEX_TIMEOUT = 60
 
-def transcribe_yandex(audio_data: io.BytesIO, iam_token: str, folder_id: str, language: str) -> Union[str, None]:
+
+class YandexRecognizer:
+    """
+        .. py:class:: YandexRecognizer(iam_token, folder_id, language, url, timeout)
+
+        Yandex SpeechKit adapter for the whole run.
+        Every thread keeps its own keep-alive HTTP connection, so chunks don't pay TCP and TLS handshakes.
+
+        :param str iam_token: IAM Token for Yandex Cloud
+        :param str folder_id: Folder id for Yandex Cloud
+        :param str language: Language Code
+        :param str url: Recognition endpoint URL
+        :param int timeout: Request timeout in seconds
+    """
+
+    def __init__(
+        self, iam_token: str, folder_id: str, language: str, url: str = YANDEX_STT_URL, timeout: int = YANDEX_TIMEOUT
+    ):
+        self.url = url
+        parsed = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.host = parsed.netloc
+        params = urllib.parse.urlencode({"topic": "general", "folderId": folder_id, "lang": language})
+        self.path = f"{parsed.path}?{params}"
+        self.headers = {"Authorization": "Bearer %s" % iam_token.strip()}
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self.connection_class(self.host, timeout=self.timeout)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _request(self, connection: http.client.HTTPConnection, audio_data: bytes):
+        try:
+            connection.request("POST", self.path, body=audio_data, headers=self.headers)
+            response = connection.getresponse()
+            return response, response.read()
+        except (http.client.HTTPException, OSError) as e:
+            connection.close()
+            if isinstance(e, http.client.HTTPException) and not isinstance(e, ConnectionError):
+                raise ConnectionError(f"Broken response: {e!r}") from e
+            raise
+
+    def recognize(self, audio_data: bytes) -> Union[str, None]:
+        """
+            .. py:method:: recognize(audio_data)
+
+            Transcribe given audio fragment
+
+            :param bytes audio_data: Audio fragment
+
+            :return: String of first recognized result
+            :rtype: str
+        """
+        connection = self._connection()
+        reused = connection.sock is not None
+        try:
+            response, body = self._request(connection, audio_data)
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError, http.client.RemoteDisconnected):
+            if not reused:
+                raise
+            # keep-alive connection was closed by server while idle, retry once on a fresh one
+            response, body = self._request(connection, audio_data)
+
+        if response.status != 200:
+            raise urllib.error.HTTPError(self.url, response.status, response.reason, response.headers, io.BytesIO(body))
+
+        decoded_data = json.loads(body.decode("UTF-8"))
+        if decoded_data.get("error_code") is None:
+            return decoded_data.get("result")
+        return None
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+
+def transcribe_yandex(
+    audio_data: bytes, iam_token: str, folder_id: str, language: str, url: str = YANDEX_STT_URL
+) -> Union[str, None]:
     """
-        .. py:function:: transcribe_google(audio_data, language, sample_rate)
+        .. py:function:: transcribe_yandex(audio_data, iam_token, folder_id, language, url)
 
-        Transcribe given audio fragment in Google Speech API
+        Transcribe given audio fragment in Yandex SpeechKit API.
+        Opens new connection for each call, use `YandexRecognizer` for many fragments.
 
-        :param io.BytesIO audio_data: Audio fragment
+        :param bytes audio_data: Audio fragment
         :param str iam_token: IAM Token for Yandex Cloud
         :param str folder_id: Folder id for Yandex Cloud
         :param str language: Language Code
+        :param str url: Recognition endpoint URL
 
         :return: String of first recognized result
         :rtype: str
     """
-    params = f"topic=general&folderId={folder_id}&lang={language}"
-    url = urllib.request.Request(
-        f"https://stt.api.cloud.yandex.net/speech/v1/stt:recognize?{params}",
-        data=audio_data,  # type: ignore
-    )
-    url.add_header("Authorization", "Bearer %s" % iam_token.strip())
-
-    response_data = urllib.request.urlopen(url).read().decode("UTF-8")
-    decoded_data = json.loads(response_data)
-
-    if decoded_data.get("error_code") is None:
-        return decoded_data.get("result")
-    return None
+    recognizer = YandexRecognizer(iam_token, folder_id, language, url)
+    try:
+        return recognizer.recognize(audio_data)
+    finally:
+        recognizer.close()
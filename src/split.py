@@ -4,15 +4,22 @@ import io
 import json
 import logging
 import os
+import subprocess
 import sys
-from typing import List, Optional, Tuple
-from inaSpeechSegmenter import Segmenter, seg2csv
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import librosa
 import numpy as np
+import soundfile as sf
 from pydub import AudioSegment
 
+import audio_cache
+import metrics
 from log import LOGGING_FMT
+from manifest import BATCH_SIZE as MANIFEST_BATCH_SIZE, ManifestStore
 
 logger = logging.getLogger("splitter")
 logger.setLevel(logging.INFO)
@@ -24,7 +31,19 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
-silence_segment = AudioSegment.silent(duration=300)
+SILENCE_DURATION = 300
+silence_segment = AudioSegment.silent(duration=SILENCE_DURATION)
+
+STREAM_BLOCK_LENGTH = 30
+PACK_MAX_GAP = 1.0
+# Yandex SpeechKit synchronous recognition accepts up to 30 seconds, chunks are padded with silence on both sides
+PACK_MAX_DURATION = 30 - 2 * SILENCE_DURATION / 1000
+EXPORT_BATCH_SIZE = 500
+# inputs segmented by INA service in one call in batch mode
+INA_GROUP_SIZE = 8
+
+SUPPORTED_EXT = [".wav", ".flac", ".aiff", ".ogg", ".mp3", ".m4a", ".wma"]
+RESULT_FILE = "result.json"
 
 
 def get_bounds(frame_idxs: List[float], frame_shift: int, frame_rate: int) -> Tuple[float, float]:
@@ -39,71 +58,802 @@ def get_bounds(frame_idxs: List[float], frame_shift: int, frame_rate: int) -> Tu
         :return: Start and end bounds for each frame
         :rtype: tuple
     """
-    start_idxs = [frame_idxs[0]]
-    end_idxs = []
+    frame_idxs = np.asarray(frame_idxs)
+    if not len(frame_idxs):
+        return np.zeros(0), np.zeros(0)
 
-    shapeofidxs = np.shape(frame_idxs)
-    for i in range(shapeofidxs[0] - 1):
-        if (frame_idxs[i + 1] - frame_idxs[i]) != 1:
-            end_idxs.append(frame_idxs[i])
-            start_idxs.append(frame_idxs[i + 1])
+    breaks = np.flatnonzero(np.diff(frame_idxs) != 1)
+    start_idxs = frame_idxs[np.concatenate(([0], breaks + 1))]
+    end_idxs = frame_idxs[np.concatenate((breaks, [len(frame_idxs) - 1]))]
 
-    end_idxs.append(frame_idxs[-1])
     if end_idxs[-1] == start_idxs[-1]:
-        end_idxs.pop()
-        start_idxs.pop()
-    if len(start_idxs) == len(end_idxs):
-        logging.error("Error! Number of start indexes not matching number of end indexes")
-        exit
-    start_idxs = np.array(start_idxs)
-    end_idxs = np.array(end_idxs)
-    start_t = start_idxs * frame_shift / frame_rate  # type: ignore
-    end_t = end_idxs * frame_shift / frame_rate  # type: ignore
+        start_idxs = start_idxs[:-1]
+        end_idxs = end_idxs[:-1]
+
+    start_t = start_idxs * frame_shift / frame_rate
+    end_t = end_idxs * frame_shift / frame_rate
     return start_t, end_t
 
 
-def _iina_segmentation(input_file):
-    seg = Segmenter()
-    segmentation = seg(input_file)
-    result = []
-    for segment in segmentation:
-        if segment[0] not in ('energy', 'noEnergy', 'noise', 'music'):
-            result.append((segment[1], segment[2]))
+def _frame_features(
+    audio_src: np.ndarray, frame_len: int, frame_shift: int, center: bool = True
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+        .. py:function:: _frame_features(audio_src, frame_len, frame_shift, center)
 
-    return result
+        Count RMS and Zero-Crossing rate of each frame in one pass.
+        Both features are taken from the same frames of prefix sums of squares and sign changes,
+        so the cost is linear in signal length and does not depend on frame length.
 
-def _rms_segmentation(audio_src, samplerate, frame_rate, frame_length, frame_shift, q_factor):
+        :param np.array audio_src: Mono audio
+        :param int frame_len: Frame length in samples
+        :param int frame_shift: Frame shift in samples
+        :param bool center: Pad signal by half of frame on both sides (reflect)
+
+        :return: RMS and Zero-Crossing rate for each frame
+        :rtype: tuple
+    """
+    if center:
+        audio_src = np.pad(audio_src, frame_len // 2, mode="reflect")
+    if len(audio_src) < frame_len:
+        return np.zeros(0), np.zeros(0)
+
+    n_frames = 1 + (len(audio_src) - frame_len) // frame_shift
+    first = np.arange(n_frames) * frame_shift
+
+    power = np.zeros(len(audio_src) + 1)
+    np.cumsum(np.square(audio_src, dtype=np.float64), out=power[1:])
+    rms = np.sqrt(np.maximum(power[first + frame_len] - power[first], 0) / frame_len)
+
+    sign = np.signbit(audio_src)
+    crossings = np.zeros(len(audio_src), dtype=np.int64)
+    np.cumsum(sign[1:] != sign[:-1], out=crossings[1:])
+    zero_x = (crossings[first + frame_len - 1] - crossings[first]) / frame_len
+
+    return rms, zero_x
+
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+
+def _rms_features(audio_src, frame_rate, frame_length, frame_shift):
     frame_len = int(frame_length * frame_rate / 1000)
     frame_shift = int(frame_shift * frame_rate / 1000)
 
-    rms = librosa.feature.rms(audio_src, frame_length=frame_len, hop_length=frame_shift)
-    rms = rms[0]
-    rms = librosa.util.normalize(rms, axis=0)
+    with metrics.timer("split.features"):
+        rms, zero_x = _frame_features(audio_src, frame_len, frame_shift)
+        rms = librosa.util.normalize(rms, axis=0)
+        zero_x = librosa.util.normalize(zero_x, axis=0)
+    return rms, zero_x, frame_shift
+
+
+def _rms_bounds(rms, zero_x, frame_shift, frame_rate, q_factor):
+    with metrics.timer("split.bounds"):
+        frame_idxs = np.flatnonzero(
+            (rms > np.std(rms) * q_factor) | (zero_x > np.average(zero_x) * q_factor)
+        )
+        return get_bounds(frame_idxs, frame_shift, frame_rate)
+
+
+def _rms_segmentation(audio_src, samplerate, frame_rate, frame_length, frame_shift, q_factor):
+    rms, zero_x, frame_shift = _rms_features(audio_src, frame_rate, frame_length, frame_shift)
 
     logger.info("Using RMS for peak detection")
     logger.info(f"Mean RMS is: {np.mean(rms)}")
     logger.info(f"RMS standard deviation is {np.std(rms)}")
 
-    logger.info("Calculating Zero-Crossing rate")
-    zero_x = librosa.feature.zero_crossing_rate(
-        audio_src, frame_length=frame_len, hop_length=frame_shift, threshold=0
-    )
-    zero_x = zero_x[0]
-    zero_x = librosa.util.normalize(zero_x, axis=0)
-
     logger.info(f"Mean Zero-Crossing rate is: {np.mean(zero_x)}")
     logger.info(f"Zero-Crossing rate standard deviation is {np.std(zero_x)}")
 
-    frame_idxs = np.where(
-        (rms > np.std(rms) * q_factor) | (zero_x > np.average(zero_x) * q_factor)
-    )[0]
-
     logger.info("Calculating bounds for splitting.")
 
-    start_t, end_t = get_bounds(frame_idxs, frame_shift, frame_rate)
+    start_t, end_t = _rms_bounds(rms, zero_x, frame_shift, frame_rate, q_factor)
 
     return start_t, end_t
 
+
+SEGMENTATION_METHODS: Dict[str, Callable[..., Iterable[Tuple[float, float]]]] = {}
+
+
+def segmentation_method(name: str):
+    """
+        .. py:function:: segmentation_method(name)
+
+        Register segmentation backend under given method name.
+        Backend is called with input file path, loaded audio, frame rate and keyword options of `process`,
+        and returns start and end bounds of segments. Heavy dependencies should be imported inside backend,
+        so they are loaded only when the method is chosen.
+
+        :param str name: Method name
+
+        :return: Decorator registering backend
+        :rtype: callable
+    """
+    def register(backend):
+        SEGMENTATION_METHODS[name] = backend
+        return backend
+    return register
+
+
+@segmentation_method("rms")
+def _rms_method(input_file, audio_src, frame_rate, frame_length, frame_shift, q_factor, **_):
+    logger.info("Use RMS Segmentation method")
+    start, end = _rms_segmentation(audio_src, None, frame_rate, frame_length, frame_shift, q_factor)
+    return zip(start, end)
+
+
+@segmentation_method("ina")
+def _ina_method(input_file, audio_src, frame_rate, ina_options=None, **_):
+    import ina
+
+    logger.info("Use INA Speech Segmentation method. Could be slow on CPU-Only Hosts")
+    return ina.get_service(**(ina_options or {})).speech([input_file])[0]
+
+
+def _stream_info(input_file: str, samplerate: Optional[int]) -> Optional[int]:
+    """
+        .. py:function:: _stream_info(input_file, samplerate)
+
+        Check if input file could be read block by block.
+        Streaming requires soundfile-readable input and no resampling.
+
+        :param str input_file: Input file path
+        :param int [samplerate]: (Optional) Requested samplerate
+
+        :return: Native samplerate or None if file cannot be streamed
+        :rtype: int
+    """
+    try:
+        info = sf.info(input_file)
+    except RuntimeError:
+        return None
+    if samplerate and samplerate != info.samplerate:
+        return None
+    return info.samplerate
+
+
+def _read_blocks(input_file: str, block_size: int, frames: int = -1) -> Iterator[np.ndarray]:
+    """
+        .. py:function:: _read_blocks(input_file, block_size, frames)
+
+        Read mono audio from file by fixed-size blocks
+
+        :param str input_file: Input file path
+        :param int block_size: Block size in samples
+        :param int frames: Total samples to read, -1 for whole file
+
+        :return: Iterator over mono audio blocks
+        :rtype: Iterator[np.ndarray]
+    """
+    blocks = sf.blocks(input_file, blocksize=block_size, frames=frames, dtype="float32", always_2d=True)
+    while True:
+        with metrics.timer("split.decode"):
+            block = next(blocks, None)
+            if block is None:
+                return
+            block = librosa.to_mono(block.T)
+        yield block
+
+
+def _stream_features(
+    blocks: Iterable[np.ndarray], frame_len: int, frame_shift: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+        .. py:function:: _stream_features(blocks, frame_len, frame_shift)
+
+        Count RMS and Zero-Crossing rate block by block.
+        Frames are centered and padded the same way as for the whole signal,
+        samples not covered by a full frame are carried to the next block.
+
+        :param Iterable blocks: Mono audio blocks
+        :param int frame_len: Frame length in samples
+        :param int frame_shift: Frame shift in samples
+
+        :return: Iterator over RMS and Zero-Crossing rate arrays
+        :rtype: Iterator[tuple]
+    """
+    pad = frame_len // 2
+    buf = tail = None
+
+    for block in blocks:
+        if not len(block):
+            continue
+        if buf is None:
+            buf = np.pad(block, (pad, 0), mode="reflect")
+            tail = block[-(pad + 1):]
+        else:
+            buf = np.concatenate((buf, block))
+            tail = np.concatenate((tail, block))[-(pad + 1):]
+
+        with metrics.timer("split.features"):
+            rms, zero_x = _frame_features(buf, frame_len, frame_shift, center=False)
+        buf = buf[len(rms) * frame_shift:]
+        if len(rms):
+            yield rms, zero_x
+
+    if buf is None:
+        return
+
+    buf = np.concatenate((buf, np.pad(tail, (0, pad), mode="reflect")[len(tail):]))
+    rms, zero_x = _frame_features(buf, frame_len, frame_shift, center=False)
+    if len(rms):
+        yield rms, zero_x
+
+
+def _merge_stats(stats: Tuple[int, float, float, float], values: np.ndarray) -> Tuple[int, float, float, float]:
+    count, mean, m2, peak = stats
+    values = values.astype(np.float64)
+    block_count = len(values)
+    block_mean = values.mean()
+    total = count + block_count
+    delta = block_mean - mean
+    mean += delta * block_count / total
+    m2 += ((values - block_mean) ** 2).sum() + delta ** 2 * count * block_count / total
+    return total, mean, m2, max(peak, float(values.max()))
+
+
+def _stream_segmentation(
+    input_file: str,
+    frame_rate: int,
+    frame_length: int,
+    frame_shift: int,
+    q_factor: float,
+    limit: Optional[int],
+    block_length: int,
+) -> Iterator[Tuple[float, float]]:
+    """
+        .. py:function:: _stream_segmentation(
+            input_file, frame_rate, frame_length, frame_shift, q_factor, limit, block_length)
+
+        RMS Segmentation with constant memory usage.
+        First pass collects running statistics for thresholds, second pass emits
+        bounds of every segment as soon as it is closed.
+
+        :param str input_file: Input file path
+        :param int frame_rate: Native samplerate of input file
+        :param int frame_length: Frame length
+        :param int frame_shift: Frame shift
+        :param float q_factor: Quality Factor
+        :param int [limit]: Input audio track length limit
+        :param int block_length: Block length in seconds
+
+        :return: Iterator over start and end bounds
+        :rtype: Iterator[tuple]
+    """
+    frame_len = int(frame_length * frame_rate / 1000)
+    frame_shift = int(frame_shift * frame_rate / 1000)
+    block_size = max(int(block_length * frame_rate), 2 * frame_len)
+    frames = int(limit * frame_rate) if limit else -1
+
+    def features():
+        return _stream_features(_read_blocks(input_file, block_size, frames), frame_len, frame_shift)
+
+    rms_stats = zero_x_stats = (0, 0.0, 0.0, 0.0)
+    for rms, zero_x in features():
+        rms_stats = _merge_stats(rms_stats, rms)
+        zero_x_stats = _merge_stats(zero_x_stats, zero_x)
+
+    if not rms_stats[0]:
+        return
+
+    tiny = np.finfo(np.float32).tiny
+    rms_scale = rms_stats[3] if rms_stats[3] >= tiny else 1.0
+    zero_x_scale = zero_x_stats[3] if zero_x_stats[3] >= tiny else 1.0
+    rms_std = np.sqrt(rms_stats[2] / rms_stats[0]) / rms_scale
+    zero_x_mean = zero_x_stats[1] / zero_x_scale
+    zero_x_std = np.sqrt(zero_x_stats[2] / zero_x_stats[0]) / zero_x_scale
+
+    logger.info("Using RMS for peak detection")
+    logger.info(f"Mean RMS is: {rms_stats[1] / rms_scale}")
+    logger.info(f"RMS standard deviation is {rms_std}")
+    logger.info(f"Mean Zero-Crossing rate is: {zero_x_mean}")
+    logger.info(f"Zero-Crossing rate standard deviation is {zero_x_std}")
+
+    logger.info("Calculating bounds for splitting.")
+
+    offset = 0
+    run_start = None
+    for rms, zero_x in features():
+        with metrics.timer("split.bounds"):
+            mask = (rms / rms_scale > rms_std * q_factor) | (zero_x / zero_x_scale > zero_x_mean * q_factor)
+            starts, ends = _runs(mask)
+        starts += offset
+        ends += offset
+
+        if run_start is not None:
+            if len(starts) and starts[0] == offset:
+                starts[0] = run_start
+            else:
+                yield run_start * frame_shift / frame_rate, (offset - 1) * frame_shift / frame_rate
+            run_start = None
+
+        offset += len(mask)
+        if len(ends) and ends[-1] == offset - 1:
+            run_start = starts[-1]
+            starts, ends = starts[:-1], ends[:-1]
+
+        for start, end in zip(starts, ends):
+            yield start * frame_shift / frame_rate, end * frame_shift / frame_rate
+
+    if run_start is not None:
+        yield run_start * frame_shift / frame_rate, (offset - 1) * frame_shift / frame_rate
+
+
+def pack_segments(
+    segmentation: Iterable[Tuple[float, float]],
+    target: float,
+    max_gap: float = PACK_MAX_GAP,
+    max_duration: float = PACK_MAX_DURATION,
+) -> Iterator[Tuple[float, float]]:
+    """
+        .. py:function:: pack_segments(segmentation, target, max_gap, max_duration)
+
+        Merge adjacent segments separated by short gaps until they reach target duration.
+        Merged segment includes the gaps and never grows over max duration,
+        segments longer than max duration by themselves are kept as is.
+        Segmentation is consumed lazily, so it could be a stream.
+
+        :param Iterable segmentation: Ordered start and end bounds
+        :param float target: Target segment duration in seconds
+        :param float max_gap: Max gap between merged segments in seconds
+        :param float max_duration: Max merged segment duration in seconds
+
+        :return: Iterator over start and end bounds of packed segments
+        :rtype: Iterator[tuple]
+    """
+    current = None
+    for start, end in segmentation:
+        if current is None:
+            current = start, end
+            continue
+
+        cur_start, cur_end = current
+        if cur_end - cur_start < target and start - cur_end <= max_gap and end - cur_start <= max_duration:
+            current = cur_start, end
+        else:
+            yield current
+            current = start, end
+
+    if current is not None:
+        yield current
+
+
+def _to_samples(t: float, frame_rate: int) -> int:
+    return librosa.core.time_to_samples(round(float(t), 2), frame_rate)
+
+
+def _slice_chunks(
+    audio_src: np.ndarray, frame_rate: int, segmentation: Iterable[Tuple[float, float]]
+) -> Iterator[Tuple[float, float, np.ndarray]]:
+    for start, end in segmentation:
+        yield start, end, audio_src[_to_samples(start, frame_rate):_to_samples(end, frame_rate)]
+
+
+def _stream_chunks(
+    input_file: str,
+    frame_rate: int,
+    segmentation: Iterable[Tuple[float, float]],
+    limit: Optional[int],
+    block_length: int,
+) -> Iterator[Tuple[float, float, np.ndarray]]:
+    """
+        .. py:function:: _stream_chunks(input_file, frame_rate, segmentation, limit, block_length)
+
+        Read audio of each segment from file.
+        Only samples of current segment and one block are kept in memory.
+
+        :param str input_file: Input file path
+        :param int frame_rate: Native samplerate of input file
+        :param Iterable segmentation: Ordered start and end bounds
+        :param int [limit]: Input audio track length limit
+        :param int block_length: Block length in seconds
+
+        :return: Iterator over start, end and audio of segment
+        :rtype: Iterator[tuple]
+    """
+    frames = int(limit * frame_rate) if limit else -1
+    blocks = _read_blocks(input_file, int(block_length * frame_rate), frames)
+    buf = np.zeros(0, dtype=np.float32)
+    buf_start = 0
+
+    for start, end in segmentation:
+        start_s = _to_samples(start, frame_rate)
+        end_s = _to_samples(end, frame_rate)
+        while True:
+            skip = min(max(start_s - buf_start, 0), len(buf))
+            buf = buf[skip:]
+            buf_start += skip
+            if buf_start + len(buf) >= end_s:
+                break
+            block = next(blocks, None)
+            if block is None:
+                break
+            buf = np.concatenate((buf, block))
+
+        yield start, end, buf[max(start_s - buf_start, 0):max(end_s - buf_start, 0)]
+
+
+def _export_format(input_file: str) -> Dict[str, str]:
+    """
+        .. py:function:: _export_format(input_file)
+
+        Choose format and codec of chunks by input file extension.
+        Ogg chunks are encoded with libopus: native ffmpeg opus encoder is experimental and accepts 48 kHz only.
+
+        :param str input_file: Input audio file
+
+        :return: Format and codec for export
+        :rtype: dict
+    """
+    _, ext = os.path.splitext(input_file)
+    ext = ext.replace(".", "")
+    pydub_kwargs = {"format": ext}
+    if ext == "mp3":
+        pydub_kwargs["codec"] = ext
+    elif ext == "ogg":
+        pydub_kwargs["codec"] = "libopus"
+    return pydub_kwargs
+
+
+def _export_chunk(audio: np.ndarray, frame_rate: int, path: str, pydub_kwargs: Dict) -> None:
+    """
+        .. py:function:: _export_chunk(audio, frame_rate, path, pydub_kwargs)
+
+        Normalize audio chunk, pad it with silence and export to file
+
+        :param np.array audio: Audio chunk
+        :param int frame_rate: Frame rate
+        :param str path: Output file path
+        :param dict pydub_kwargs: Format and codec for pydub export
+
+        :return:
+        :rtype: None
+    """
+    audio = librosa.util.normalize(audio)
+
+    buf = io.BytesIO()
+    librosa.output.write_wav(buf, audio, frame_rate)
+
+    sg = AudioSegment.from_wav(buf)
+    sg = silence_segment + sg + silence_segment
+    sg.export(path, **pydub_kwargs)
+
+
+def _ffmpeg_export(batch: List[Tuple[str, np.ndarray]], frame_rate: int, pydub_kwargs: Dict) -> None:
+    """
+        .. py:function:: _ffmpeg_export(batch, frame_rate, pydub_kwargs)
+
+        Export all chunks of batch with a single ffmpeg process.
+        Normalized chunks are written one after another to ffmpeg stdin as raw PCM,
+        filter graph cuts them back and pads with silence, each chunk is mapped to its own output file.
+
+        :param list batch: Output file path and audio of each chunk
+        :param int frame_rate: Frame rate
+        :param dict pydub_kwargs: Format and codec for export
+
+        :return:
+        :rtype: None
+    """
+    graph = ["[0:a]asplit={}{}".format(len(batch), "".join(f"[s{i}]" for i in range(len(batch))))]
+    outputs = []  # type: List[str]
+    offset = 0
+    for i, (path, audio) in enumerate(batch):
+        graph.append(
+            f"[s{i}]atrim=start_sample={offset}:end_sample={offset + len(audio)},asetpts=PTS-STARTPTS,"
+            f"adelay=delays={SILENCE_DURATION}:all=1,apad=pad_dur={SILENCE_DURATION / 1000}[o{i}]"
+        )
+        outputs += ["-map", f"[o{i}]"]
+        if pydub_kwargs.get("codec"):
+            outputs += ["-acodec", pydub_kwargs["codec"]]
+        outputs += ["-f", pydub_kwargs["format"], path]
+        offset += len(audio)
+
+    command = [
+        AudioSegment.converter, "-y", "-nostdin", "-loglevel", "error",
+        "-f", "f32le", "-ar", str(frame_rate), "-ac", "1", "-i", "pipe:0",
+        "-filter_complex", ";".join(graph),
+    ] + outputs
+
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=stderr)
+        try:
+            for _, audio in batch:
+                proc.stdin.write(librosa.util.normalize(audio).astype("<f4").tobytes())
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        if proc.wait():
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, command[0], stderr=stderr.read())
+
+
+def _export_batch(
+    batch: List[Tuple[str, np.ndarray]], frame_rate: int, pydub_kwargs: Dict, backend: str
+) -> List[Optional[Exception]]:
+    """
+        .. py:function:: _export_batch(batch, frame_rate, pydub_kwargs, backend)
+
+        Export batch of chunks with chosen backend.
+        If ffmpeg export fails, chunks are exported one by one with pydub.
+
+        :param list batch: Output file path and audio of each chunk
+        :param int frame_rate: Frame rate
+        :param dict pydub_kwargs: Format and codec for export
+        :param str backend: `ffmpeg` or `pydub`
+
+        :return: Export error of each chunk if any
+        :rtype: list
+    """
+    with metrics.timer("split.encode"):
+        if backend == "ffmpeg":
+            try:
+                _ffmpeg_export(batch, frame_rate, pydub_kwargs)
+                return [None] * len(batch)
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.warning(f"ffmpeg export failed, falling back to pydub: {e}")
+
+        errors = []  # type: List[Optional[Exception]]
+        for path, audio in batch:
+            try:
+                _export_chunk(audio, frame_rate, path, pydub_kwargs)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+
+def _batches(tasks: Iterable, size: int) -> Iterator[List]:
+    batch = []  # type: List
+    for task in tasks:
+        batch.append(task)
+        if size and len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _outputs(batch: List[Tuple[str, float, float, np.ndarray]], output_dir: str) -> List[Tuple[str, np.ndarray]]:
+    return [(os.path.join(output_dir, filename), audio) for filename, _, _, audio in batch]
+
+
+def _export_serial(
+    batches: Iterable[List], output_dir: str, frame_rate: int, pydub_kwargs: Dict, backend: str
+) -> Iterator[Tuple[str, float, float, Optional[Exception]]]:
+    for batch in batches:
+        errors = _export_batch(_outputs(batch, output_dir), frame_rate, pydub_kwargs, backend)
+        for (filename, start, end, _), error in zip(batch, errors):
+            yield filename, start, end, error
+
+
+def _export_pool(
+    batches: Iterable[List], output_dir: str, frame_rate: int, pydub_kwargs: Dict, backend: str, workers: int
+) -> Iterator[Tuple[str, float, float, Optional[Exception]]]:
+    def results(meta, future):
+        errors, data = future.result()
+        metrics.merge(data)
+        for (filename, start, end), error in zip(meta, errors):
+            yield filename, start, end, error
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: Deque = deque()
+        for batch in batches:
+            future = executor.submit(
+                metrics.collect, _export_batch, _outputs(batch, output_dir), frame_rate, pydub_kwargs, backend
+            )
+            pending.append(([task[:3] for task in batch], future))
+            while pending and (len(pending) >= workers * 2 or pending[0][1].done()):
+                yield from results(*pending.popleft())
+
+        while pending:
+            yield from results(*pending.popleft())
+
+
+def _export_chunks(
+    tasks: Iterable[Tuple[str, float, float, np.ndarray]],
+    output_dir: str,
+    frame_rate: int,
+    pydub_kwargs: Dict,
+    workers: int,
+    backend: str = "ffmpeg",
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[Tuple[str, float, float, Optional[Exception]]]:
+    """
+        .. py:function:: _export_chunks(tasks, output_dir, frame_rate, pydub_kwargs, workers, backend, batch_size)
+
+        Export audio chunks serially or in a process pool.
+        Results are returned in order of tasks, no more than two batches per worker are in flight.
+
+        :param Iterable tasks: File name, start, end and audio of each chunk
+        :param str output_dir: Output chunks directory
+        :param int frame_rate: Frame rate
+        :param dict pydub_kwargs: Format and codec for export
+        :param int workers: Number of worker processes, 1 for serial export
+        :param str backend: `ffmpeg` for one ffmpeg process per batch or `pydub` for one per chunk
+        :param int batch_size: Chunks per ffmpeg process, 0 for all chunks at once
+
+        :return: Iterator over file name, start, end and export error if any
+        :rtype: Iterator[tuple]
+    """
+    def logged(tasks):
+        for task in tasks:
+            logger.info(f"Writing chunks: {task[0]}")
+            yield task
+
+    batches = _batches(logged(tasks), batch_size if backend == "ffmpeg" else 1)
+    if workers <= 1:
+        return _export_serial(batches, output_dir, frame_rate, pydub_kwargs, backend)
+    return _export_pool(batches, output_dir, frame_rate, pydub_kwargs, backend, workers)
+
+
+def _load(
+    input_file: str, samplerate: Optional[int], limit: Optional[int], cache_dir: Optional[str], cache_size: int
+) -> Tuple[np.ndarray, int]:
+    with metrics.timer("split.decode"):
+        if cache_dir:
+            return audio_cache.load(input_file, samplerate, limit, cache_dir, cache_size)
+        return librosa.load(input_file, sr=samplerate, duration=limit)
+
+
+def sweep(
+    audio_src: np.ndarray,
+    frame_rate: int,
+    frame_lengths: List[int],
+    frame_shifts: List[int],
+    q_factors: List[float],
+) -> List[Dict]:
+    """
+        .. py:function:: sweep(audio_src, frame_rate, frame_lengths, frame_shifts, q_factors)
+
+        Evaluate RMS Segmentation over grid of parameters without writing chunks.
+        Features are counted once for each frame length and frame shift pair,
+        every Q-Factor is tested against the same feature arrays.
+
+        :param np.array audio_src: Mono audio
+        :param int frame_rate: Frame rate
+        :param list[int] frame_lengths: Frame lengths
+        :param list[int] frame_shifts: Frame shifts
+        :param list[float] q_factors: Quality Factors
+
+        :return: Segments count, duration distribution and percent of kept audio for each setting
+        :rtype: list[dict]
+    """
+    total = len(audio_src) / frame_rate
+    rows = []
+    for frame_length in frame_lengths:
+        for frame_shift in frame_shifts:
+            rms, zero_x, hop = _rms_features(audio_src, frame_rate, frame_length, frame_shift)
+            for q_factor in q_factors:
+                start_t, end_t = _rms_bounds(rms, zero_x, hop, frame_rate, q_factor)
+                durations = np.array([
+                    min(_to_samples(end, frame_rate), len(audio_src)) - _to_samples(start, frame_rate)
+                    for start, end in zip(start_t, end_t)
+                ], dtype=np.int64) / frame_rate
+                durations = durations[durations > 0]
+                row = {
+                    "frame_length": frame_length,
+                    "frame_shift": frame_shift,
+                    "q_factor": q_factor,
+                    "segments": len(durations),
+                    "min": 0.0,
+                    "median": 0.0,
+                    "p95": 0.0,
+                    "max": 0.0,
+                    "kept": 100 * durations.sum() / total if total else 0.0,
+                }
+                if len(durations):
+                    row["min"], row["median"], row["p95"], row["max"] = np.percentile(durations, (0, 50, 95, 100))
+                rows.append(row)
+    return rows
+
+
+def print_sweep(rows: List[Dict]) -> None:
+    """
+        .. py:function:: print_sweep(rows)
+
+        Print parameter sweep results as table
+
+        :param list[dict] rows: Sweep results
+
+        :return:
+        :rtype: None
+    """
+    print("{:>6} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>7}".format(
+        "fl", "fs", "q", "segments", "min,s", "median,s", "p95,s", "max,s", "kept,%"
+    ))
+    for row in rows:
+        print("{frame_length:>6} {frame_shift:>6} {q_factor:>6.2f} {segments:>8} {min:>8.2f} {median:>8.2f} "
+              "{p95:>8.2f} {max:>8.2f} {kept:>7.1f}".format(**row))
+
+
+def split_chunks(
+    input_file: str,
+    output_dir: str,
+    samplerate: Optional[int],
+    prefix: str,
+    method: str,
+    frame_length: int,
+    frame_shift: int,
+    q_factor: float,
+    limit: Optional[int],
+    stream: bool = False,
+    block_length: int = STREAM_BLOCK_LENGTH,
+    workers: int = 1,
+    export_backend: str = "ffmpeg",
+    export_batch: int = EXPORT_BATCH_SIZE,
+    cache_dir: Optional[str] = None,
+    cache_size: int = audio_cache.CACHE_SIZE,
+    ina_options: Optional[Dict] = None,
+    pack_target: Optional[float] = None,
+    pack_max_gap: float = PACK_MAX_GAP,
+    pack_max_duration: float = PACK_MAX_DURATION,
+) -> Iterator[Tuple[str, float, float]]:
+    """
+        .. py:function:: split_chunks(
+            input_file, output_dir, samplerate, prefix, method, frame_length, frame_shift, q_factor,  limit,
+            stream, block_length, workers, export_backend, export_batch, cache_dir, cache_size, ina_options,
+            pack_target, pack_max_gap, pack_max_duration)
+
+        Split audio from file into chunks written to output dir.
+        Parameters are the same as of `process`.
+
+        :return: Iterator over file name, start and end of each chunk as soon as it is written
+        :rtype: Iterator[tuple]
+    """
+    if method not in SEGMENTATION_METHODS:
+        raise ValueError(f"Unknown segmentation method `{method}`")
+
+    logger.info("Loading audio")
+    os.makedirs(output_dir, exist_ok=True)
+
+    pydub_kwargs = _export_format(input_file)
+
+    frame_rate = _stream_info(input_file, samplerate) if stream and method == "rms" else None
+    if stream and not frame_rate:
+        logger.warning(
+            "Streaming is available for RMS method and soundfile-readable input at native samplerate only. "
+            "Falling back to in-memory processing"
+        )
+
+    if frame_rate:
+        logger.info("Use RMS Segmentation method. Streaming input by blocks")
+        segmentation = _stream_segmentation(
+            input_file, frame_rate, frame_length, frame_shift, q_factor, limit, block_length
+        )
+        if pack_target:
+            segmentation = pack_segments(segmentation, pack_target, pack_max_gap, pack_max_duration)
+        chunks = _stream_chunks(input_file, frame_rate, segmentation, limit, block_length)
+    else:
+        audio_src, frame_rate = _load(input_file, samplerate, limit, cache_dir, cache_size)
+
+        segmentation = SEGMENTATION_METHODS[method](
+            input_file, audio_src, frame_rate,
+            frame_length=frame_length, frame_shift=frame_shift, q_factor=q_factor, ina_options=ina_options,
+        )
+        if pack_target:
+            segmentation = pack_segments(segmentation, pack_target, pack_max_gap, pack_max_duration)
+        chunks = _slice_chunks(audio_src, frame_rate, segmentation)
+
+    logger.info("Start splitting.")
+    tasks = (
+        (prefix + "_{:05d}.{}".format(idx, pydub_kwargs["format"]), start, end, audio)
+        for idx, (start, end, audio) in enumerate(chunks)
+        if len(audio)
+    )
+    for filename, start, end, error in _export_chunks(
+        tasks, output_dir, frame_rate, pydub_kwargs, workers, export_backend, export_batch
+    ):
+        if error:
+            logger.error(error)
+            metrics.count("split.errors")
+            continue
+        metrics.count("split.chunks")
+        metrics.count("split.audio_seconds", end - start)
+        yield filename, round(start, 1), round(end, 1)
+
+
 def process(
     input_file: str,
     output_dir: str,
@@ -113,11 +863,25 @@ def process(
     frame_length: int,
     frame_shift: int,
     q_factor: float,
-    limit: Optional[int]
+    limit: Optional[int],
+    stream: bool = False,
+    block_length: int = STREAM_BLOCK_LENGTH,
+    workers: int = 1,
+    export_backend: str = "ffmpeg",
+    export_batch: int = EXPORT_BATCH_SIZE,
+    cache_dir: Optional[str] = None,
+    cache_size: int = audio_cache.CACHE_SIZE,
+    ina_options: Optional[Dict] = None,
+    pack_target: Optional[float] = None,
+    pack_max_gap: float = PACK_MAX_GAP,
+    pack_max_duration: float = PACK_MAX_DURATION,
+    manifest_db: Optional[str] = None,
 ):
     """
         .. py:function:: process(
-            input_file, output_dir, samplerate, prefix, method, frame_length, frame_shift, q_factor,  limit)
+            input_file, output_dir, samplerate, prefix, method, frame_length, frame_shift, q_factor,  limit,
+            stream, block_length, workers, export_backend, export_batch, cache_dir, cache_size, ina_options,
+            pack_target, pack_max_gap, pack_max_duration, manifest_db)
 
         Process audio from file and split it into chunks.
         Dumps metadata to json.
@@ -131,71 +895,200 @@ def process(
         :param int frame_shift: Frame shift
         :param float q_factor: Quality Factor
         :param int [limit]: Input audio track length limit
+        :param bool stream: Read input by blocks with constant memory usage (RMS method only)
+        :param int block_length: Streaming block length in seconds
+        :param int workers: Number of processes for chunks encoding
+        :param str export_backend: `ffmpeg` for one ffmpeg process per batch of chunks, `pydub` for one per chunk
+        :param int export_batch: Chunks per ffmpeg process, 0 for all chunks at once
+        :param str [cache_dir]: (Optional) Directory for decoded audio cache
+        :param int cache_size: Max size of decoded audio cache in megabytes
+        :param dict [ina_options]: (Optional) Arguments of INA segmenter service
+        :param float [pack_target]: (Optional) Target duration of packed segments in seconds, no packing if not set
+        :param float pack_max_gap: Max gap between packed segments in seconds
+        :param float pack_max_duration: Max duration of packed segments in seconds
+        :param str [manifest_db]: (Optional) SQLite manifest path, chunks are added as they are written
 
         :return: 
         :rtype: None
     """
-    logger.info("Loading audio")
+    os.makedirs(output_dir, exist_ok=True)
+    json_data = {}
+    store = ManifestStore(manifest_db) if manifest_db else None
+    written = []
+    # the first batch replaces chunks of previous split of the same output
+    reset = True
 
-    _, ext = os.path.splitext(input_file)
-    ext = ext.replace(".", "")
-    pydub_kwargs = {"format": ext}
-    if ext == "mp3":
-        pydub_kwargs["codec"] = ext
-    elif ext == "ogg":
-        pydub_kwargs["codec"] = "opus"
+    for filename, start, end in split_chunks(
+        input_file, output_dir, samplerate, prefix, method, frame_length, frame_shift, q_factor, limit,
+        stream, block_length, workers, export_backend, export_batch, cache_dir, cache_size, ina_options,
+        pack_target, pack_max_gap, pack_max_duration,
+    ):
+        json_data[filename] = {
+            "start": start,
+            "end": end,
+            "asr": None,
+            "found": None,
+            "shift": 0,
+            "diff": 0,
+        }
+        if store:
+            written.append((filename, start, end))
+            if len(written) >= MANIFEST_BATCH_SIZE:
+                store.add_chunks(written, reset)
+                written = []
+                reset = False
 
-    audio_src, frame_rate = librosa.load(input_file, sr=samplerate, duration=limit)
-    audio_src = librosa.util.normalize(audio_src)
+    if store:
+        store.add_chunks(written, reset)
+        store.close()
 
-    if method == 'rms':
-        logger.info("Use RMS Segmentation method")
-        start, end = _rms_segmentation(audio_src, samplerate, frame_rate, frame_length, frame_shift, q_factor)
-        segmentation = zip(start, end)
-    else:
-        logger.info("Use INA Speech Segmentation method. Could be slow on CPU-Only Hosts")
-        segmentation = _iina_segmentation(input_file)
+    logger.info("Split finished. Saving json file data")
 
-    json_data = {}
+    json_path = os.path.join(output_dir, RESULT_FILE)
+    with open(json_path + ".tmp", "w") as json_file:
+        json.dump(json_data, json_file)
+    os.replace(json_path + ".tmp", json_path)
 
-    logger.info("Start splitting.")
-    for idx, (start, end) in enumerate(segmentation):  # type: ignore
-        start_s = librosa.core.time_to_samples(round(float(start), 2), frame_rate)
-        end_s = librosa.core.time_to_samples(round(float(end), 2), frame_rate)
-        audio = audio_src[start_s:end_s]
 
-        if len(audio) == 0:
-            continue
+def list_inputs(input_dir: Optional[str] = None, manifest: Optional[str] = None) -> List[str]:
+    """
+        .. py:function:: list_inputs(input_dir, manifest)
 
-        audio = librosa.util.normalize(audio)
-        filename = prefix + "_{:05d}.{}".format(idx, ext)
+        List input audio files from directory or manifest file with one path per line
 
-        logger.info(f"Writing chunks: {filename}")
+        :param str [input_dir]: (Optional) Directory with input audio files
+        :param str [manifest]: (Optional) Manifest file path
 
-        buf = io.BytesIO()
-        librosa.output.write_wav(buf, audio, frame_rate)
+        :return: Sorted list of input file paths
+        :rtype: list[str]
+    """
+    inputs = []
+    if input_dir:
+        inputs += [
+            os.path.join(input_dir, filename) for filename in os.listdir(input_dir)
+            if os.path.splitext(filename)[1].lower() in SUPPORTED_EXT
+        ]
+    if manifest:
+        with open(manifest, "r") as manifest_f:
+            inputs += [line.strip() for line in manifest_f if line.strip() and not line.startswith("#")]
+    return sorted(inputs)
+
+
+def _process_input(kwargs: Dict) -> str:
+    process(**kwargs)
+    return kwargs["input_file"]
 
-        try:
-            sg = AudioSegment.from_wav(buf)
-            sg = silence_segment + sg + silence_segment
-            sg.export(os.path.join("output", filename), **pydub_kwargs)
-            json_data[filename] = {
-                "start": round(start, 1),
-                "end": round(end, 1),
-                "asr": None,
-                "found": None,
-                "shift": 0,
-                "diff": 0,
-            }
 
+def _process_group(tasks: List[Dict]) -> List[Tuple[str, Optional[str]]]:
+    """
+        .. py:function:: _process_group(tasks)
+
+        Split group of inputs one after another.
+        For INA method all files of group are segmented by one service call first.
+
+        :param list tasks: Arguments of `process` for each input
+
+        :return: Input file path and error message if any for each input
+        :rtype: list
+    """
+    if tasks[0].get("method") == "ina":
+        import ina
+
+        ina.get_service(**(tasks[0].get("ina_options") or {})).prefetch([task["input_file"] for task in tasks])
+
+    results = []  # type: List[Tuple[str, Optional[str]]]
+    for task in tasks:
+        try:
+            results.append((_process_input(task), None))
         except Exception as e:
-            logger.error(e)
+            results.append((task["input_file"], str(e)))
+    return results
+
+
+def _batch_tasks(inputs: List[str], output_dir: str, resume: bool, kwargs: Dict) -> List[Dict]:
+    tasks = []
+    namespaces = {}  # type: Dict[str, str]
+    for input_file in inputs:
+        name = os.path.splitext(os.path.basename(input_file))[0]
+        if name in namespaces:
+            raise ValueError(f"Inputs {namespaces[name]} and {input_file} have the same output dir `{name}`")
+        namespaces[name] = input_file
+
+        input_output_dir = os.path.join(output_dir, name)
+        if resume and os.path.exists(os.path.join(input_output_dir, RESULT_FILE)):
+            logger.info(f"Skipping finished input {input_file}")
             continue
+        task = dict(kwargs, input_file=input_file, output_dir=input_output_dir)
+        if kwargs.get("manifest_db"):
+            task["manifest_db"] = os.path.join(input_output_dir, os.path.basename(kwargs["manifest_db"]))
+        tasks.append(task)
+    return tasks
 
-    logging.info("Split finished. Saving json file data")
 
-    with open("output/result.json", "w") as json_file:
-        json.dump(json_data, json_file)
+def _log_group(results: List[Tuple[str, Optional[str]]], done: int, total: int) -> int:
+    for input_file, error in results:
+        if error:
+            logger.error(f"Error while splitting {input_file}: {error}")
+        else:
+            done += 1
+            logger.info(f"Finished input {done} of {total}: {input_file}")
+    return done
+
+
+def _run_batch_pool(groups: List[List[Dict]], jobs: int, method: Optional[str], ina_options: Optional[Dict]) -> None:
+    pool_kwargs = {}  # type: Dict
+    if method == "ina":
+        import ina
+
+        pool_kwargs = {"initializer": ina.preload, "initargs": (ina_options or {},)}
+
+    total = sum(len(group) for group in groups)
+    done = 0
+    with ProcessPoolExecutor(max_workers=jobs, **pool_kwargs) as executor:
+        futures = {executor.submit(metrics.collect, _process_group, group): group for group in groups}
+        for future in as_completed(futures):
+            try:
+                results, data = future.result()
+                metrics.merge(data)
+                done = _log_group(results, done, total)
+            except Exception as e:
+                logger.error(f"Error while splitting {', '.join(task['input_file'] for task in futures[future])}: {e}")
+
+
+def process_batch(inputs: List[str], output_dir: str, jobs: int, resume: bool, **kwargs) -> None:
+    """
+        .. py:function:: process_batch(inputs, output_dir, jobs, resume, **kwargs)
+
+        Split many input files in a process pool.
+        Each input gets its own directory named after input file with chunks and json file.
+        Input is finished when its json file exists, finished inputs are skipped on resume.
+        For INA method models are loaded once in each process and inputs are segmented in groups
+        of up to `INA_GROUP_SIZE` files, so the network gets windows of several inputs per batch.
+
+        :param list[str] inputs: Input file paths
+        :param str output_dir: Root directory for outputs
+        :param int jobs: Number of processes splitting input files
+        :param bool resume: Skip inputs with existing json file
+        :param kwargs: Arguments of `process` shared by all inputs
+
+        :return:
+        :rtype: None
+    """
+    tasks = _batch_tasks(inputs, output_dir, resume, kwargs)
+    logger.info(f"Splitting {len(tasks)} of {len(inputs)} inputs")
+
+    group_size = 1
+    if kwargs.get("method") == "ina" and tasks:
+        group_size = min(INA_GROUP_SIZE, -(-len(tasks) // max(jobs, 1)))
+    groups = list(_batches(tasks, group_size))
+
+    if jobs <= 1:
+        done = 0
+        for group in groups:
+            done = _log_group(_process_group(group), done, len(tasks))
+        return
+
+    _run_batch_pool(groups, jobs, kwargs.get("method"), kwargs.get("ina_options"))
 
 
 def main():
@@ -217,12 +1110,53 @@ def main():
 
             Limit is a length of audio that should be splitter from start.
 
+            Stream mode reads input by blocks of BLOCK_LENGTH seconds, so memory usage
+            does not depend on input length. Available for RMS method and inputs readable
+            by soundfile (wav, flac, ogg) at native samplerate.
+
+            Workers is a number of processes used for encoding chunks.
+
+            Export backend `ffmpeg` writes a batch of chunks with one ffmpeg process,
+            `pydub` starts ffmpeg for every chunk. `ffmpeg` falls back to `pydub` on errors.
+
+            Cache dir keeps decoded audio between runs with the same input, samplerate and limit.
+            Least recently used entries are removed when cache grows over cache size.
+
+            Packing merges adjacent segments separated by no more than PACK_MAX_GAP seconds
+            until they reach PACK_TARGET seconds, never exceeding PACK_MAX_DURATION
+            (default fits 30 seconds ASR request limit with silence padding).
+            Fewer and longer chunks mean fewer ASR requests.
+
+            Sweep mode prints segments count, duration distribution and percent of kept audio
+            for every combination of sweep frame lengths, frame shifts and Q-Factors.
+            RMS and Zero-Crossing are counted once per frame length and shift, no chunks are written.
+
+            INA models and TensorFlow are loaded only when `ina` method is chosen, once per process.
+            TensorFlow intra-op and inter-op threads could be limited to share CPU host between several jobs.
+
+            Manifest DB is SQLite manifest of chunks updated in place by every stage.
+            Json file is written as well.
+
+            Batch mode splits every audio file from input dir or manifest (one path per line)
+            with JOBS processes. Chunks and json file of each input are written to
+            <output dir>/<input file name>. With `--resume` inputs having json file are skipped.
+            With `ina` method inputs are segmented in groups, windows of several inputs share network batches.
+
+            With `--metrics` timers of decoding, feature extraction, boundary detection and encoding
+            and counters of chunks and audio seconds are written to json file with p50/p95 latencies
+            and rates per wall second. `--profile` writes cProfile stats, or stacks of all threads
+            sampled every few milliseconds with `--profile-sampling`.
+
         """,
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
     parser.add_argument("-i", "--input-file", type=str, help="Input file path")
-    parser.add_argument("-o", "--output-dir", type=str, help="Ogg files dir")
-    parser.add_argument("-m", "--method", default='rms', type=str,
+    parser.add_argument("-o", "--output-dir", type=str, default="output", help="Ogg files dir")
+    parser.add_argument("-id", "--input-dir", type=str, help="Input files dir for batch splitting")
+    parser.add_argument("-mf", "--manifest", type=str, help="File with input file paths for batch splitting")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes for batch splitting")
+    parser.add_argument("--resume", action="store_true", help="Skip inputs already split in batch mode")
+    parser.add_argument("-m", "--method", default='rms', type=str, choices=sorted(SEGMENTATION_METHODS),
                         help="Segmentation method: `ina` for INA Speech Segmenter or `rms` for RMS-Based, Default is RMS ")
     parser.add_argument(
         "-p", "--prefix", type=str, default="file", help="Output file name prefix"
@@ -240,13 +1174,83 @@ def main():
         "-sr", "--samplerate", type=int, default=None, help="Source audio samplerate"
     )
     parser.add_argument(
-        "-q", "--q-factor", type=int, default=0.7, help="Qualify Factor"
+        "-q", "--q-factor", type=float, default=0.7, help="Qualify Factor"
+    )
+    parser.add_argument(
+        "-st", "--stream", action="store_true", help="Read input by blocks with constant memory (RMS method only)"
+    )
+    parser.add_argument(
+        "-bl", "--block-length", type=int, default=STREAM_BLOCK_LENGTH, help="Streaming block length in seconds"
     )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="Number of processes for chunks encoding"
+    )
+    parser.add_argument(
+        "-eb", "--export-backend", default="ffmpeg", choices=("ffmpeg", "pydub"), help="Chunks export backend"
+    )
+    parser.add_argument(
+        "-bs", "--export-batch", type=int, default=EXPORT_BATCH_SIZE,
+        help="Chunks exported by one ffmpeg process, 0 for all chunks at once"
+    )
+    parser.add_argument(
+        "-cd", "--cache-dir", type=str, default=None, help="Decoded audio cache dir"
+    )
+    parser.add_argument(
+        "-cs", "--cache-size", type=int, default=audio_cache.CACHE_SIZE, help="Decoded audio cache size in MB"
+    )
+    parser.add_argument(
+        "--ina-batch-size", type=int, default=None, help="INA Speech Segmenter network batch size"
+    )
+    parser.add_argument(
+        "--ina-intra-threads", type=int, default=None, help="TensorFlow intra-op threads for INA"
+    )
+    parser.add_argument(
+        "--ina-inter-threads", type=int, default=None, help="TensorFlow inter-op threads for INA"
+    )
+    parser.add_argument(
+        "-pt", "--pack-target", type=float, default=None,
+        help="Merge adjacent segments up to this duration in seconds, no packing by default"
+    )
+    parser.add_argument(
+        "-pg", "--pack-max-gap", type=float, default=PACK_MAX_GAP, help="Max gap between merged segments in seconds"
+    )
+    parser.add_argument(
+        "-pm", "--pack-max-duration", type=float, default=PACK_MAX_DURATION,
+        help="Max duration of merged segments in seconds"
+    )
+    parser.add_argument(
+        "-db", "--manifest-db", type=str, default=None,
+        help="SQLite manifest path, in batch mode file name of manifest in output dir of each input"
+    )
+    parser.add_argument(
+        "--sweep", action="store_true", help="Print RMS Segmentation stats over grid of parameters, no chunks written"
+    )
+    parser.add_argument(
+        "--sweep-frame-lengths", type=int, nargs="+", help="Frame lengths for sweep, default is --frame-length"
+    )
+    parser.add_argument(
+        "--sweep-frame-shifts", type=int, nargs="+", help="Frame shifts for sweep, default is --frame-shift"
+    )
+    parser.add_argument(
+        "--sweep-q-factors", type=float, nargs="+", help="Q-Factors for sweep, default is --q-factor"
+    )
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
+
+    if args.sweep:
+        audio_src, frame_rate = _load(args.input_file, args.samplerate, args.limit, args.cache_dir, args.cache_size)
+        rows = sweep(
+            audio_src,
+            frame_rate,
+            args.sweep_frame_lengths or [args.frame_length],
+            args.sweep_frame_shifts or [args.frame_shift],
+            args.sweep_q_factors or [args.q_factor],
+        )
+        print_sweep(rows)
+        return
+
     kwargs = {
-        "input_file": args.input_file,
-        "output_dir": args.output_dir,
         "method": args.method,
         "samplerate": args.samplerate,
         "prefix": args.prefix,
@@ -254,13 +1258,38 @@ def main():
         "frame_shift": args.frame_shift,
         "q_factor": args.q_factor,
         "limit": args.limit,
+        "stream": args.stream,
+        "block_length": args.block_length,
+        "workers": args.workers,
+        "export_backend": args.export_backend,
+        "export_batch": args.export_batch,
+        "cache_dir": args.cache_dir,
+        "cache_size": args.cache_size,
+        "ina_options": {
+            k: v for k, v in (
+                ("batch_size", args.ina_batch_size),
+                ("intra_op_threads", args.ina_intra_threads),
+                ("inter_op_threads", args.ina_inter_threads),
+            ) if v is not None
+        },
+        "pack_target": args.pack_target,
+        "pack_max_gap": args.pack_max_gap,
+        "pack_max_duration": args.pack_max_duration,
+        "manifest_db": args.manifest_db,
     }
 
     logger.info("settings loaded:")
+    logger.info(f"input: {args.input_dir or args.manifest or args.input_file}")
+    logger.info(f"output_dir: {args.output_dir}")
     for k, v in kwargs.items():
         logger.info(f"{k}: {v}")
 
-    process(**kwargs)
+    with metrics.session(args.metrics, args.profile, args.profile_sampling):
+        if args.input_dir or args.manifest:
+            inputs = list_inputs(args.input_dir, args.manifest)
+            process_batch(inputs, args.output_dir, args.jobs, args.resume, **kwargs)
+        else:
+            process(input_file=args.input_file, output_dir=args.output_dir, **kwargs)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,21 @@
 import argparse
+import functools
 import json
+from array import array
 import logging
+import multiprocessing
 import os
 import re
 import string
 import sys
-from typing import Dict, List, Optional
-
-import Levenshtein
-from fuzzysearch import find_near_matches
-from fuzzysearch.common import Match
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+import metrics
 from log import LOGGING_FMT
+from manifest import BATCH_SIZE as MANIFEST_BATCH_SIZE, open_store
+from matcher import Match, find_best_match
+from text_index import KMER_SIZE, TextIndex
 
 logger = logging.getLogger("text eval")
 logger.setLevel(logging.INFO)
@@ -23,74 +27,211 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
-def normalize_text(text: str) -> str:
+# first monotonic search window is ALIGN_WIDTH sentence lengths long, every next one ALIGN_WIDTH times longer
+ALIGN_WIDTH = 4
+ALIGN_WIDENINGS = 3
+ALIGN_ERROR_RATE = 0.3
+
+SHARDS_PER_WORKER = 4
+
+# normalized text and its index for `_evaluate`, inherited by worker processes
+_shared: Dict[str, Any] = {}
+
+
+def normalize_text(text: str) -> Tuple[str, array]:
     """
         .. py:function:: normalize_text(text)
 
-        Returns text lower cased and without any punctuation
+        Returns text lower cased and without any punctuation,
+        with position in original text of every normalized text character
 
         :param str text: Input text
 
-        :return: Processed text
-        :rtype: str
+        :return: Processed text and offsets map
+        :rtype: tuple
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        origin: Sequence[int] = range(len(text))
+    else:
+        # some characters are lower cased to several ones
+        origin = [pos for pos, char in enumerate(text) for _ in char.lower()]
+
+    removed = set()
+    for match in re.finditer(r"\\d+", lowered):
+        removed.update(range(match.start(), match.end()))
+    punctuation = set(string.punctuation)
+
+    chars = []
+    offsets = array("I")
+    space = None
+    for pos, char in enumerate(lowered):
+        if char in punctuation or pos in removed:
+            continue
+        if char.isspace():
+            # whitespace runs are collapsed to a single space mapped to the first of them
+            if space is None:
+                space = origin[pos]
+            continue
+        if space is not None and chars:
+            chars.append(" ")
+            offsets.append(space)
+        space = None
+        chars.append(char)
+        offsets.append(origin[pos])
+    return "".join(chars), offsets
+
+
+def get_best_match(
+    sentence: str, text: str, qmax: int, windows: Optional[List[Tuple[int, int]]] = None
+) -> Optional[Match]:
     """
-    normalized_text = text.lower()
+        .. py:function:: get_best_match(sentence, text, qmax, windows)
 
-    normalized_text = re.sub(r"\\d+", "", normalized_text)
-    normalized_text = normalized_text.translate(
-        str.maketrans("", "", string.punctuation)
-    )
-    normalized_text = normalized_text.strip()
-    normalized_text = " ".join(normalized_text.split())
-    return normalized_text
+        Finds substring of text with minimal Levenshtein distance to sentence
+
+        :param str sentence: Input sentence to find
+        :param str text: Input text
+        :param int qmax: Max Value of Levenshtein distance
+        :param list [windows]: (Optional) Start and end of text regions to search in, whole text if not set
+
+        :return: Best match or None if its distance is over Max Q-Factor
+        :rtype: Match
+    """
+    match = find_best_match(sentence.lower(), text, qmax, windows)
+    if match is None:
+        logger.warning(
+            "Cannot find sentence. Max Q-Factor reached."
+            f"The sentence is `{sentence}`"
+        )
+    return match
 
 
-def get_fuzzymatches(sentence: str, text: str, q_factor: int, qmax: int, qstep: int) -> List[Match]:
+def get_monotonic_match(
+    sentence: str, text: str, cursor: int, qmax: int, text_index: Optional[TextIndex] = None
+) -> Optional[Match]:
     """
-        .. py:function:: get_fuzzymatches(sentence, text, q_factor, qmax, qstep)
+        .. py:function:: get_monotonic_match(sentence, text, cursor, qmax, text_index)
 
-        Finds fuzzy matches of sentence in text
+        Finds sentence right after the previous sentence match.
+        Window after cursor is widened while nothing is found. Distance is limited by
+        ALIGN_ERROR_RATE of sentence length, so a skipped passage is not matched to nearby text.
+        If sentence is not found near cursor, it is searched in index candidates or whole text.
 
         :param str sentence: Input sentence to find
         :param str text: Input text
-        :param int q_factor: Value of initial Max Levenshtein distance
-        :param str qmax: Max Value of Levenshtein distance
-        :param str qstep: Levenshter distance increasing step
+        :param int cursor: End of previous sentence match
+        :param int qmax: Max Value of Levenshtein distance
+        :param TextIndex [text_index]: (Optional) Index of input text for fallback search
 
-        :return: List of fuzzy matches
-        :rtype: list[Match]
+        :return: Best match or None
+        :rtype: Match
     """
-    fuzzymatches = []
-    while q_factor <= qmax:
-        fuzzymatches = find_near_matches(sentence.lower(), text, max_l_dist=q_factor)
-        if fuzzymatches:
+    local_qmax = min(qmax, int(len(sentence) * ALIGN_ERROR_RATE))
+    start = max(cursor - qmax, 0)
+    width = ALIGN_WIDTH * len(sentence) + qmax
+
+    # windows overhang by sentence length, so matches starting inside window are never cut off
+    overhang = len(sentence) + qmax
+    for _ in range(ALIGN_WIDENINGS):
+        end = start + width
+        match = find_best_match(sentence.lower(), text, local_qmax, [(start, min(end + overhang, len(text)))])
+        if match and match.start < end:
+            return match
+        if end >= len(text):
             break
-        q_factor += qstep
-        if q_factor >= qmax:
-            logger.warning(
-                "Cannot continue fuzzing. Max Q-Factor reached."
-                f"The sentence is `{sentence}`"
-            )
-            break
-    return fuzzymatches
+        width *= ALIGN_WIDTH
+
+    logger.info(f"Sentence is not found after previous match, searching whole text. The sentence is `{sentence}`")
+    windows = text_index.candidates(sentence.lower(), qmax) if text_index else None
+    return get_best_match(sentence, text, qmax, windows)
+
+
+def match_sentence(
+    sentence: str, text: str, qmax: int, text_index: Optional[TextIndex] = None, cursor: Optional[int] = None
+) -> Optional[Match]:
+    """
+        .. py:function:: match_sentence(sentence, text, qmax, text_index, cursor)
+
+        Find sentence in text, monotonic search is used if cursor is set
+
+        :param str sentence: Input sentence to find
+        :param str text: Normalized text
+        :param int qmax: Max Value of Levenshtein distance
+        :param TextIndex [text_index]: (Optional) Index of input text
+        :param int [cursor]: (Optional) End of previous sentence match
+
+        :return: Best match or None
+        :rtype: Match
+    """
+    if cursor is not None:
+        return get_monotonic_match(sentence, text, cursor, qmax, text_index)
+    # whole text is searched if sentence shares no k-mer with it
+    windows = text_index.candidates(sentence.lower(), qmax) if text_index else None
+    return get_best_match(sentence, text, qmax, windows)
 
 
-def get_distances(fuzzymatches: List[Match], sentence: str) -> List[Match]:
+def _evaluate(sentences: List[Tuple[int, str, str]]) -> List[Tuple[str, Optional[Match]]]:
     """
-        .. py:function:: get_distances(fuzzymatches, sentence)
+        .. py:function:: _evaluate(sentences)
 
-        Finds sentence in fuzzy matches list with minimal Levenshtein distance
+        Find sentences in text shared by `process`. Runs in a worker process too.
 
-        :param list[Match] fuzzymatches: List of fuzzy matched strings
-        :param str sentence: Sentence to find
+        :param list sentences: Index, file name and ASR sentence of each chunk in order
 
-        :return: List of fuzzy matches sorted by minimal distance
-        :rtype: list[Match, int]
+        :return: File name and best match of each sentence
+        :rtype: list[tuple]
     """
-    distances = []
-    for match in fuzzymatches:
-        distances.append((match, Levenshtein.distance(match.matched, sentence)))
-    return sorted(distances, key=lambda x: x[1])
+    text, text_index, qmax = _shared["text"], _shared["text_index"], _shared["qmax"]
+    cursor = 0
+    matches = []
+    for idx, fname, sentence in sentences:
+        logger.info(f"Evaluating sentence {idx} of {_shared['total']}")
+
+        with metrics.timer("eval.match"):
+            best = match_sentence(sentence, text, qmax, text_index, cursor if _shared["monotonic"] else None)
+        metrics.count("eval.sentences")
+        if best:
+            metrics.count("eval.found")
+            cursor = best.end
+        matches.append((fname, best))
+    return matches
+
+
+def _shards(items: List, count: int) -> List[List]:
+    size = -(-len(items) // count) or 1
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def load_text(
+    text_input: str, index: bool = True, save_index: bool = False, kmer_size: int = KMER_SIZE
+) -> Tuple[str, array, Optional[TextIndex]]:
+    """
+        .. py:function:: load_text(text_input, index, save_index, kmer_size)
+
+        Read and normalize source text, load or build its index
+
+        :param str text_input: Path to source text
+        :param bool index: Build k-mer index of text
+        :param bool save_index: Save index next to source text and reuse it
+        :param int kmer_size: Index shingle length
+
+        :return: Normalized text, offsets map and index or None
+        :rtype: tuple
+    """
+    with open(text_input, "r", encoding="utf-8") as text_f:
+        text = text_f.read()
+
+    with metrics.timer("eval.normalize"):
+        normalized_text, offsets = normalize_text(text)
+
+    text_index = None
+    if index:
+        with metrics.timer("eval.index"):
+            text_index = TextIndex.load_or_build(
+                normalized_text, text_input + ".index.npz" if save_index else None, kmer_size
+            )
+    return normalized_text, offsets, text_index
 
 
 def dump_json(jsonfile: str, result_data: Dict) -> bool:
@@ -106,68 +247,105 @@ def dump_json(jsonfile: str, result_data: Dict) -> bool:
         :rtype: bool
     """
     logger.info("Evaluating finished. Writing to JSON File")
-    with open(jsonfile, "r+") as file:
+    with open(jsonfile, "r") as file:
         data = json.load(file)
-        for (fname, values) in result_data.items():
-            data[fname]["found"] = values["eval_string"]
-            data[fname]["shift"] = values["shift"]
-            data[fname]["diff"] = values["lev_dist"]
-        file.seek(0)
+    for (fname, values) in result_data.items():
+        data[fname]["found"] = values["eval_string"]
+        data[fname]["shift"] = values["shift"]
+        data[fname]["diff"] = values["lev_dist"]
+
+    with open(jsonfile + ".tmp", "w") as file:
         json.dump(data, file, ensure_ascii=False)
+    os.replace(jsonfile + ".tmp", jsonfile)
 
     logger.info(f"JSON file written. Resulting json file is {os.path.abspath(jsonfile)}")
     return True
 
 
-def process(text_input: str, jsonfile: str, q_factor: int, qmax: int, qstep: int):
+def process(
+    text_input: str,
+    jsonfile: str,
+    q_factor: Optional[int] = None,
+    qmax: int = 70,
+    qstep: Optional[int] = None,
+    *,
+    index: bool = True,
+    save_index: bool = False,
+    kmer_size: int = KMER_SIZE,
+    monotonic: bool = False,
+    workers: int = 1,
+    manifest_db: Optional[str] = None,
+):
     """
-        .. py:function:: process(text_input, jsonfile, q_factor, qmax, qstep)
+        .. py:function:: process(
+            text_input, jsonfile, q_factor, qmax, qstep, *, index, save_index, kmer_size, monotonic, workers,
+            manifest_db)
 
         Process text and find ASR sentences in original text. Process result to JSON File
 
         :param str text_input: Path to source text
         :param str jsonfile: JSON File path
-        :param int q_factor: Value of initial Max Levenshtein distance
-        :param str qmax: Max Value of Levenshtein distance
-        :param str qstep: Levenshter distance increasing step
+        :param int [q_factor]: (Deprecated) Ignored, sentences are matched in a single pass
+        :param int qmax: Max Value of Levenshtein distance
+        :param int [qstep]: (Deprecated) Ignored, sentences are matched in a single pass
+        :param bool index: Search in candidate windows found by k-mer index instead of whole text
+        :param bool save_index: Save index next to source text and reuse it
+        :param int kmer_size: Index shingle length
+        :param bool monotonic: Search every sentence right after the previous one first
+        :param int workers: Number of processes for sentences evaluation
+        :param str [manifest_db]: (Optional) SQLite manifest path, json file is exported from it if set
 
     """
     result_data = {}
 
-    with open(jsonfile, "r") as json_f:
-        json_data = json.loads(json_f.read(), encoding="utf-8")
+    store = open_store(manifest_db, jsonfile) if manifest_db else None
+    if store:
+        # manifest keeps status of every chunk, so only transcribed chunks not evaluated yet are loaded
+        json_data = {fname: {"start": start, "asr": asr} for fname, start, asr in store.needing_eval()}
+    else:
+        with open(jsonfile, "r") as json_f:
+            json_data = json.load(json_f)
 
-    with open(text_input, "r", encoding="utf-8") as text_f:
-        text = text_f.read()
-
-    normalized_text = normalize_text(text)
+    normalized_text, offsets, text_index = load_text(text_input, index, save_index, kmer_size)
 
     logger.info("Start evaluating distance")
 
-    total = len(json_data.items())
-    for idx, (fname, item) in enumerate(json_data.items()):
-        logger.info(f"Evaluating sentence {idx} of {total}")
-
-        sentence = item.get("asr")
-        if not sentence:
-            continue
-
-        fuzzymatches = get_fuzzymatches(
-            sentence, normalized_text, q_factor, qmax, qstep
-        )
-        if not fuzzymatches:
+    items = list(json_data.items())
+    if monotonic:
+        # chunks come from a linear recording, their text goes in the same order
+        items.sort(key=lambda kv: kv[1].get("start") or 0)
+    sentences = [(idx, fname, item["asr"]) for idx, (fname, item) in enumerate(items) if item.get("asr")]
+
+    _shared.update(text=normalized_text, text_index=text_index, qmax=qmax, monotonic=monotonic, total=len(items))
+    if workers <= 1:
+        matches = _evaluate(sentences)
+    else:
+        # monotonic search restarts from the beginning of text in every shard, so shards are as long as possible
+        shards = _shards(sentences, workers if monotonic else workers * SHARDS_PER_WORKER)
+        matches = []
+        # workers inherit text and index from parent process by fork, nothing is copied into tasks
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            for shard, data in executor.map(functools.partial(metrics.collect, _evaluate), shards):
+                matches += shard
+                metrics.merge(data)
+
+    for fname, best in matches:
+        if not best:
             continue
 
-        distances = get_distances(fuzzymatches, sentence)
-        best = distances[0][0]
+        result_data[fname] = {"lev_dist": best.dist, "shift": offsets[best.start], "eval_string": best.matched}
 
-        ld = best.dist
-        eval_str = best.matched
-        shift = text.lower().find(eval_str)
-        if shift == -1:
-            shift = None  # type: ignore
-
-        result_data[fname] = {"lev_dist": ld, "shift": shift, "eval_string": eval_str}
+    if store:
+        logger.info("Evaluating finished. Writing to manifest")
+        results = [
+            (fname, values["eval_string"], values["shift"], values["lev_dist"]) for fname, values in result_data.items()
+        ]
+        for start in range(0, len(results), MANIFEST_BATCH_SIZE):
+            store.set_eval(results[start:start + MANIFEST_BATCH_SIZE])
+        if jsonfile:
+            store.export_json(jsonfile)
+        store.close()
+        return True
 
     return dump_json(jsonfile, result_data)
 
@@ -178,11 +356,30 @@ def main():
         Find similar text.
 
         Q-Factor is Levenshtein Distance value.
-        Default Q-Factor used for retrieve text chunks from source text file.
-        If chunks cannot be retrieved, Q-Factor increases step by step by value of Q-Factor Step
-        Until reach Maximal Q-Factor.
+        Every sentence is matched to substring of source text with minimal Levenshtein distance
+        in a single pass. Sentences with distance over Maximal Q-Factor are not matched.
+
+        Q-Factor and Q-Factor Step of step-by-step search are accepted for compatibility and ignored.
+
+        Sentences are searched only in a few candidate windows of text sharing most
+        k-mers (KMER_SIZE characters long shingles) with them. Use `--no-index` to search
+        the whole text. With `--save-index` index is saved next to source text and reused.
+
+        Monotonic mode relies on chunks order: every sentence is searched right after
+        the previous match first, the window is widened while nothing is found.
+        If the sentence is still not found, e.g. a passage was skipped, whole text is searched.
+
+        Workers is a number of processes evaluating sentences. Sentences are split into contiguous
+        shards, text and index are shared with workers without copying. In monotonic mode
+        there is one shard per worker, each starts with whole text search.
 
-        Using default values of Q-Factor higher than 7 may slowdown the script.
+        With `--manifest-db` only transcribed chunks not evaluated yet are loaded from
+        SQLite manifest and results are written back to it. JSON file is exported at the end.
+
+        With `--metrics` text normalization, indexing and sentence match timers and counters
+        of sentences are written to json file with p50/p95 latencies and rates per wall second.
+        `--profile` writes cProfile stats, or stacks of all threads sampled every few milliseconds
+        with `--profile-sampling`.
 
     """,
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -192,34 +389,47 @@ def main():
         "-j", "--jsonfile", type=str, help="Input JSON File with ASR results"
     )
     parser.add_argument(
-        "-q", "--q-factor", type=int, default=5, help="Default Levenshtein distance"
+        "-q", "--q-factor", type=int, default=None, help="Deprecated, ignored"
     )
     parser.add_argument(
         "-qmax",
         "--q-factor-max",
         type=int,
         default=70,
-        help="Step of Levenshtein distance increse",
+        help="Max Possible Levenshtein distance",
     )
     parser.add_argument(
-        "-qstep",
-        "--q-factor-step",
-        type=int,
-        default=5,
-        help="Max Possible Levenshtein distance",
+        "-qstep", "--q-factor-step", type=int, default=None, help="Deprecated, ignored"
     )
+    parser.add_argument("--no-index", action="store_true", help="Search every sentence in the whole text")
+    parser.add_argument("--save-index", action="store_true", help="Save text index next to source text")
+    parser.add_argument("-k", "--kmer-size", type=int, default=KMER_SIZE, help="Text index shingle length")
+    parser.add_argument(
+        "-mn", "--monotonic", action="store_true", help="Search every sentence after the previous match first"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of processes for sentences evaluation")
+    parser.add_argument("-db", "--manifest-db", type=str, default=None, help="SQLite manifest path")
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
 
+    if args.q_factor is not None or args.q_factor_step is not None:
+        logger.warning("--q-factor and --q-factor-step are deprecated and ignored, sentences are matched in one pass")
+
     kwargs = {
         "text_input": args.text_input,
         "jsonfile": args.jsonfile,
-        "q_factor": args.q_factor,
         "qmax": args.q_factor_max,
-        "qstep": args.q_factor_step,
+        "index": not args.no_index,
+        "save_index": args.save_index,
+        "kmer_size": args.kmer_size,
+        "monotonic": args.monotonic,
+        "workers": args.workers,
+        "manifest_db": args.manifest_db,
     }
 
-    process(**kwargs)
+    with metrics.session(args.metrics, args.profile, args.profile_sampling):
+        process(**kwargs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import os
+import sys
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from log import LOGGING_FMT
+
+logger = logging.getLogger("text index")
+logger.setLevel(logging.INFO)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter(LOGGING_FMT)
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+KMER_SIZE = 5
+# k-mers occurring more often than this are too common to point at a region
+MAX_OCCURRENCES = 1000
+CANDIDATES = 3
+HASH_BASE = np.uint64(1000003)
+
+
+def kmer_hashes(text: str, k: int) -> np.ndarray:
+    """
+        .. py:function:: kmer_hashes(text, k)
+
+        Polynomial hash of every k characters long shingle of text
+
+        :param str text: Input text
+        :param int k: Shingle length
+
+        :return: Hash of shingle starting at each position
+        :rtype: np.array
+    """
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.uint64)
+
+    n = len(codes) - k + 1
+    hashes = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        hashes = hashes * HASH_BASE + codes[j:j + n]
+    return hashes
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TextIndex:
+    """
+        .. py:class:: TextIndex(hashes, positions, k, length, digest)
+
+        Index of k-mer shingles of normalized text mapped to their positions.
+        Hashes are sorted, so positions of a shingle are a contiguous slice found by binary search.
+
+        :param np.array hashes: Sorted shingle hashes
+        :param np.array positions: Position of each shingle in text
+        :param int k: Shingle length
+        :param int length: Text length
+        :param str digest: Text digest, used to check saved index against text
+    """
+
+    def __init__(self, hashes: np.ndarray, positions: np.ndarray, k: int, length: int, digest: str):
+        self.hashes = hashes
+        self.positions = positions
+        self.k = k
+        self.length = length
+        self.digest = digest
+
+    @classmethod
+    def build(cls, text: str, k: int = KMER_SIZE) -> "TextIndex":
+        """
+            .. py:method:: build(text, k)
+
+            Build index of text
+
+            :param str text: Normalized text
+            :param int k: Shingle length
+
+            :return: Text index
+            :rtype: TextIndex
+        """
+        hashes = kmer_hashes(text, k)
+        order = np.argsort(hashes, kind="stable")
+        return cls(hashes[order], order.astype(np.uint32), k, len(text), text_digest(text))
+
+    def save(self, path: str) -> None:
+        with open(path + ".tmp", "wb") as index_f:
+            np.savez(
+                index_f,
+                hashes=self.hashes,
+                positions=self.positions,
+                meta=np.array([self.k, self.length]),
+                digest=np.array(self.digest),
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "TextIndex":
+        with np.load(path) as data:
+            k, length = data["meta"]
+            return cls(data["hashes"], data["positions"], int(k), int(length), str(data["digest"]))
+
+    @classmethod
+    def load_or_build(cls, text: str, path: Optional[str] = None, k: int = KMER_SIZE) -> "TextIndex":
+        """
+            .. py:method:: load_or_build(text, path, k)
+
+            Load index saved next to text file. Index is built and saved if it is missing,
+            was built for another text or shingle length.
+
+            :param str text: Normalized text
+            :param str [path]: (Optional) Index file path, index is not saved if not set
+            :param int k: Shingle length
+
+            :return: Text index
+            :rtype: TextIndex
+        """
+        if path and os.path.exists(path):
+            index = cls.load(path)
+            if index.k == k and index.digest == text_digest(text):
+                logger.info(f"Text index loaded from {path}")
+                return index
+            logger.info("Saved text index does not match text. Rebuilding")
+
+        logger.info("Building text index")
+        index = cls.build(text, k)
+        if path:
+            index.save(path)
+            logger.info(f"Text index saved to {path}")
+        return index
+
+    def candidates(self, sentence: str, slack: int, limit: int = CANDIDATES) -> List[Tuple[int, int]]:
+        """
+            .. py:method:: candidates(sentence, slack, limit)
+
+            Find text regions where sentence could be.
+            Every shared shingle votes for alignment diagonal, i.e. text position minus sentence position.
+            Close diagonals are grouped and groups with most votes become search windows.
+
+            :param str sentence: Sentence to find
+            :param int slack: Max shift of diagonal inside group and margin added to windows, in characters
+            :param int limit: Max number of windows
+
+            :return: Ordered start and end of non overlapping windows, empty if no shingle is shared
+            :rtype: list[tuple]
+        """
+        query = kmer_hashes(sentence, self.k)
+        left = np.searchsorted(self.hashes, query, side="left")
+        right = np.searchsorted(self.hashes, query, side="right")
+
+        diags = [
+            self.positions[lo:hi].astype(np.int64) - offset
+            for offset, (lo, hi) in enumerate(zip(left, right))
+            if 0 < hi - lo <= MAX_OCCURRENCES
+        ]
+        if not diags:
+            return []
+
+        diags = np.sort(np.concatenate(diags))
+        groups = np.split(diags, np.flatnonzero(np.diff(diags) > slack) + 1)
+        groups.sort(key=len, reverse=True)
+
+        windows = sorted(
+            (max(int(group[0]) - slack, 0), min(int(group[-1]) + len(sentence) + slack, self.length))
+            for group in groups[:limit]
+        )
+        merged = [windows[0]]
+        for start, end in windows[1:]:
+            if start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
@@ -0,0 +1,97 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import asr
+from asr_cache import ASRCache
+from fake_stt import FakeSTTServer
+
+pytestmark = pytest.mark.skipif("OPUS" not in sf.available_subtypes("OGG"), reason="libsndfile without Opus")
+
+
+@pytest.fixture
+def chunks_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    json_data = {}
+    for idx in range(24):
+        filename = "file_{:05d}.ogg".format(idx)
+        audio = rng.normal(0, 0.1, 4800).astype(np.float32)
+        sf.write(str(tmp_path / filename), audio, 48000, format="OGG", subtype="OPUS")
+        json_data[filename] = {"start": idx, "end": idx + 1, "asr": None, "found": None, "shift": 0, "diff": 0}
+    with open(tmp_path / "result.json", "w") as json_f:
+        json.dump(json_data, json_f)
+    return tmp_path
+
+
+def _audio(chunks_dir, filename):
+    with open(os.path.join(chunks_dir, filename), "rb") as f:
+        return f.read()
+
+
+def test_transcribe_keyed_by_filename(chunks_dir):
+    filenames = sorted(f for f in os.listdir(chunks_dir) if f.endswith(".ogg"))
+    with FakeSTTServer([], latency=0.02) as server:
+        server.fail(_audio(chunks_dir, filenames[3]), (429, {"Retry-After": "0.05"}))
+        server.fail(_audio(chunks_dir, filenames[5]), 403)
+        engine, recognizer = asr.make_recognizer("ru-RU", "token", "folder", server.url)
+        try:
+            results = list(asr.transcribe(
+                (os.path.join(chunks_dir, f) for f in filenames), recognizer, engine, "ru-RU",
+                concurrency=6, retries=2, transcode_workers=1,
+            ))
+        finally:
+            recognizer.close()
+
+    assert sorted(filename for filename, _, _ in results) == filenames
+    assert server.peak_in_flight > 1
+    for filename, result, error in results:
+        if filename == filenames[5]:
+            assert error.code == 403
+        else:
+            assert error is None and result == server.result(_audio(chunks_dir, filename))
+
+
+def test_process_writes_results_by_filename(chunks_dir):
+    jsonfile = str(chunks_dir / "result.json")
+    with FakeSTTServer([], latency=0.01) as server:
+        asr.process(
+            str(chunks_dir), "token", "folder", jsonfile, "ru-RU",
+            concurrency=4, endpoint=server.url, transcode_workers=1,
+        )
+
+    with open(jsonfile) as json_f:
+        data = json.load(json_f)
+    for filename, item in data.items():
+        assert item["asr"] == server.result(_audio(chunks_dir, filename))
+
+
+def test_cache_hits_returned_as_they_arrive(chunks_dir):
+    paths = sorted(str(chunks_dir / f) for f in os.listdir(chunks_dir) if f.endswith(".ogg"))[:4]
+    cache = ASRCache(str(chunks_dir / "cache.db"))
+
+    def slowly(paths):
+        for path in paths:
+            time.sleep(0.2)
+            yield path
+
+    with FakeSTTServer([], latency=0.01) as server:
+        engine, recognizer = asr.make_recognizer("ru-RU", "token", "folder", server.url)
+        try:
+            list(asr.transcribe(paths, recognizer, engine, "ru-RU", cache=cache, transcode_workers=1))
+            started = time.monotonic()
+            delays = [
+                time.monotonic() - started
+                for _ in asr.transcribe(slowly(paths), recognizer, engine, "ru-RU", cache=cache, transcode_workers=1)
+            ]
+        finally:
+            recognizer.close()
+            cache.close()
+
+    assert server.requests == len(paths)
+    # every hit comes out as soon as its path is produced, not when the input is exhausted
+    assert delays[0] < 0.35
+    assert delays == sorted(delays) and delays[-1] - delays[0] > 0.4
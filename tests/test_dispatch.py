@@ -0,0 +1,102 @@
+import time
+import urllib.error
+
+import pytest
+
+from dispatch import TokenBucket, call_with_retries, dispatch
+from fake_stt import FakeSTTServer
+from speech.yandex import YandexRecognizer
+
+
+@pytest.fixture
+def server():
+    with FakeSTTServer([]) as server:
+        yield server
+
+
+@pytest.fixture
+def recognizer(server):
+    recognizer = YandexRecognizer("token", "folder", "ru-RU", server.url)
+    yield recognizer
+    recognizer.close()
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(20, capacity=5)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.05
+
+    for _ in range(10):
+        bucket.acquire()
+    assert 0.45 <= time.monotonic() - started < 0.9
+
+
+def test_token_bucket_limits_dispatch(server, recognizer):
+    tasks = ((f"file_{idx:05d}.ogg", (b"chunk %d" % idx,)) for idx in range(12))
+    started = time.monotonic()
+    results = list(dispatch(tasks, recognizer.recognize, concurrency=8, bucket=TokenBucket(10, capacity=2)))
+    assert len(results) == 12
+    # burst of 2, then 10 tokens at 10 per second
+    assert time.monotonic() - started >= 0.95
+
+
+def test_retry_after_on_throttling(server, recognizer):
+    server.fail(b"chunk", (429, {"Retry-After": "0.3"}))
+    started = time.monotonic()
+    result = call_with_retries(recognizer.recognize, (b"chunk",), retries=3, backoff=10)
+    assert result == server.result(b"chunk")
+    assert len(server.request_times(b"chunk")) == 2
+    first, second = server.request_times(b"chunk")
+    # Retry-After is respected instead of much longer backoff
+    assert 0.3 <= second - first < 2
+    assert time.monotonic() - started < 2
+
+
+@pytest.mark.parametrize("status", [500, 502, 503, 504])
+def test_retry_on_server_error(server, recognizer, status):
+    server.fail(b"chunk", status, status)
+    assert call_with_retries(recognizer.recognize, (b"chunk",), retries=3, backoff=0.01) == server.result(b"chunk")
+    assert len(server.request_times(b"chunk")) == 3
+
+
+def test_give_up_after_retries(server, recognizer):
+    server.fail(b"chunk", 500, 500, 500, 500)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        call_with_retries(recognizer.recognize, (b"chunk",), retries=2, backoff=0.01)
+    assert error.value.code == 500
+    assert len(server.request_times(b"chunk")) == 3
+
+
+@pytest.mark.parametrize("status", [400, 401, 403, 413])
+def test_no_retry_on_client_error(server, recognizer, status):
+    server.fail(b"chunk", status)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        call_with_retries(recognizer.recognize, (b"chunk",), retries=3, backoff=0.01)
+    assert error.value.code == status
+    assert len(server.request_times(b"chunk")) == 1
+
+
+def test_results_keyed_by_filename():
+    with FakeSTTServer([], latency=0.02) as server:
+        recognizer = YandexRecognizer("token", "folder", "ru-RU", server.url)
+        chunks = {f"file_{idx:05d}.ogg": b"chunk %d" % idx for idx in range(60)}
+        server.fail(chunks["file_00007.ogg"], 400)
+        server.fail(chunks["file_00011.ogg"], 503)
+
+        try:
+            results = list(dispatch(
+                ((filename, (audio_data,)) for filename, audio_data in chunks.items()),
+                recognizer.recognize, concurrency=8, retries=2, backoff=0.01,
+            ))
+        finally:
+            recognizer.close()
+
+    assert sorted(filename for filename, _, _ in results) == sorted(chunks)
+    assert server.peak_in_flight > 1
+    for filename, result, error in results:
+        if filename == "file_00007.ogg":
+            assert result is None and error.code == 400
+        else:
+            assert error is None and result == server.result(chunks[filename])
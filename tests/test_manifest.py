@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from manifest import ManifestStore, ManifestWriter
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ManifestStore(str(tmp_path / "manifest.sqlite"))
+    yield store
+    store.close()
+
+
+def _rows(store):
+    return store.connection.execute("SELECT filename, asr, found, status FROM chunks ORDER BY filename").fetchall()
+
+
+def test_writer_batches_updates(store, monkeypatch):
+    calls = []
+    for name in ("add_chunks", "set_asr", "set_eval"):
+        method = getattr(store, name)
+        monkeypatch.setattr(store, name, lambda *args, method=method, name=name: calls.append(name) or method(*args))
+
+    writer = ManifestWriter(store, size=10, interval=60)
+    for idx in range(4):
+        writer.add_chunk(f"file_{idx}.ogg", idx, idx + 1)
+        writer.set_asr(f"file_{idx}.ogg", f"text {idx}")
+        writer.set_eval(f"file_{idx}.ogg", f"text {idx}", idx, 0)
+    # the 10th row is chunk of the last file, its results are still buffered
+    assert calls == ["add_chunks", "set_asr", "set_eval"]
+    assert _rows(store)[-1] == ("file_3.ogg", None, None, "split")
+
+    writer.flush()
+    assert calls == ["add_chunks", "set_asr", "set_eval", "set_asr", "set_eval"]
+    assert _rows(store) == [(f"file_{idx}.ogg", f"text {idx}", f"text {idx}", "eval") for idx in range(4)]
+
+
+def test_writer_flushes_old_rows(store):
+    writer = ManifestWriter(store, interval=0.05)
+    writer.add_chunk("file_0.ogg", 0, 1)
+    assert _rows(store) == []
+    time.sleep(0.06)
+    writer.add_chunk("file_1.ogg", 1, 2)
+    assert len(_rows(store)) == 2
+
+
+def test_writer_reset_replaces_previous_split(store):
+    store.add_chunks([(f"file_{idx}.ogg", idx, idx + 1) for idx in range(5)])
+    writer = ManifestWriter(store, reset=True, size=2)
+    for idx in range(3):
+        writer.add_chunk(f"file_{idx}.ogg", idx, idx + 1)
+    writer.flush()
+    assert [row[0] for row in _rows(store)] == ["file_0.ogg", "file_1.ogg", "file_2.ogg"]
+
+    ManifestWriter(store, reset=True).flush()
+    assert _rows(store) == []
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from matcher import edit_distances, find_best_match
+
+
+def _dp_distances(pattern, text, anchored):
+    # textbook dynamic programming: column j holds distances of pattern prefixes to best substring ending at j
+    column = list(range(len(pattern) + 1))
+    distances = []
+    for j, char in enumerate(text, 1):
+        diagonal, column[0] = column[0], j if anchored else 0
+        for i in range(1, len(pattern) + 1):
+            diagonal, column[i] = column[i], min(
+                column[i] + 1, column[i - 1] + 1, diagonal + (pattern[i - 1] != char)
+            )
+        distances.append(column[-1])
+    return distances
+
+
+def _levenshtein(a, b):
+    return _dp_distances(a, b, anchored=True)[-1] if b else len(a)
+
+
+def _random_pairs(count, max_pattern, max_text, seed):
+    rng = random.Random(seed)
+    for _ in range(count):
+        pattern = "".join(rng.choice("abc ") for _ in range(rng.randint(1, max_pattern)))
+        text = "".join(rng.choice("abc ") for _ in range(rng.randint(0, max_text)))
+        if text and rng.random() < 0.5:
+            # plant a mutated copy of pattern so close matches are common
+            copy = list(pattern)
+            for _ in range(rng.randint(0, 3)):
+                copy[rng.randrange(len(copy))] = rng.choice("abc ")
+            pos = rng.randrange(len(text))
+            text = text[:pos] + "".join(copy) + text[pos:]
+        yield pattern, text
+
+
+@pytest.mark.parametrize("anchored", [False, True])
+def test_edit_distances_match_dynamic_programming(anchored):
+    # patterns longer than 64 characters cross machine word boundary of other implementations
+    for pattern, text in _random_pairs(200, 150, 80, seed=int(anchored)):
+        assert list(edit_distances(pattern, text, anchored)) == _dp_distances(pattern, text, anchored)
+
+
+def test_find_best_match_against_brute_force():
+    for pattern, text in _random_pairs(400, 20, 60, seed=2):
+        distances = _dp_distances(pattern, text, anchored=False)
+        best = min(distances, default=len(pattern))
+        if 0 < len(text) <= 20:
+            # brute force over every substring
+            assert best == min(
+                _levenshtein(pattern, text[start:end]) for end in range(1, len(text) + 1) for start in range(end + 1)
+            )
+        match = find_best_match(pattern, text)
+
+        if best >= len(pattern):
+            assert match is None
+            continue
+        assert match.dist == best
+        assert match.end == distances.index(best) + 1
+        assert match.matched == text[match.start:match.end]
+        assert _levenshtein(pattern, match.matched) == best
+
+
+def test_find_best_match_max_dist_and_windows():
+    text = "the quick brown fox jumps over the lazy dog"
+    assert find_best_match("lazy cat", text).matched == "lazy "
+    assert find_best_match("lazy cat", text, max_dist=1) is None
+    assert find_best_match("the", text, windows=[(20, len(text))]).start == text.index("the", 20)
+    assert find_best_match("", text) is None
@@ -0,0 +1,83 @@
+import shutil
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import split
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which(split.AudioSegment.converter) is None, reason="ffmpeg not found")
+
+
+def _batch(tmp_path, ext, frame_rate):
+    rng = np.random.default_rng(0)
+    return [
+        (str(tmp_path / "chunk_{}.{}".format(idx, ext)), rng.normal(0, 0.1, frame_rate * (idx + 1) // 2))
+        for idx in range(3)
+    ]
+
+
+def _padded(audio, frame_rate):
+    return len(audio) / frame_rate + 2 * split.SILENCE_DURATION / 1000
+
+
+@needs_ffmpeg
+def test_ffmpeg_export_wav(tmp_path):
+    batch = _batch(tmp_path, "wav", 16000)
+    split._ffmpeg_export(batch, 16000, split._export_format("input.wav"))
+
+    for path, audio in batch:
+        data, samplerate = sf.read(path)
+        assert samplerate == 16000
+        assert len(data) / samplerate == pytest.approx(_padded(audio, 16000), abs=0.01)
+        assert np.abs(data).max() == pytest.approx(1, abs=0.01)
+
+
+@needs_ffmpeg
+@pytest.mark.skipif("OPUS" not in sf.available_subtypes("OGG"), reason="libsndfile without Opus")
+@pytest.mark.parametrize("frame_rate", [16000, 44100])
+def test_ffmpeg_export_ogg(tmp_path, frame_rate):
+    batch = _batch(tmp_path, "ogg", frame_rate)
+    split._ffmpeg_export(batch, frame_rate, split._export_format("input.ogg"))
+
+    for path, audio in batch:
+        info = sf.info(path)
+        assert (info.format, info.subtype, info.channels) == ("OGG", "OPUS", 1)
+        assert info.duration == pytest.approx(_padded(audio, frame_rate), abs=0.05)
+
+
+def _speech_like(frame_rate, seconds=20):
+    # noise bursts of random length separated by quiet pauses
+    rng = np.random.default_rng(1)
+    audio = rng.normal(0, 0.001, frame_rate * seconds)
+    start = 0
+    while start < len(audio) - frame_rate:
+        length = min(int(rng.uniform(0.3, 2.5) * frame_rate), len(audio) - start)
+        audio[start:start + length] += rng.normal(0, 0.2, length)
+        start += length + int(rng.uniform(0.2, 1.0) * frame_rate)
+    return audio.astype(np.float32)
+
+
+@pytest.mark.parametrize("block_size", [401, 4096, 16000, 1 << 20])
+def test_stream_features_match_whole_signal(block_size):
+    audio = _speech_like(16000, seconds=5)
+    rms, zero_x = split._frame_features(audio, 320, 160)
+
+    blocks = (audio[idx:idx + block_size] for idx in range(0, len(audio), block_size))
+    parts = list(split._stream_features(blocks, 320, 160))
+
+    np.testing.assert_allclose(np.concatenate([part[0] for part in parts]), rms, rtol=1e-6, atol=1e-9)
+    np.testing.assert_array_equal(np.concatenate([part[1] for part in parts]), zero_x)
+
+
+@pytest.mark.parametrize("block_length", [0.37, 3, 30])
+def test_stream_segmentation_matches_in_memory(tmp_path, block_length):
+    input_file = str(tmp_path / "input.wav")
+    audio = _speech_like(16000)
+    sf.write(input_file, audio, 16000, subtype="FLOAT")
+
+    start, end = split._rms_segmentation(audio, None, 16000, 20, 10, 1.0)
+    streamed = list(split._stream_segmentation(input_file, 16000, 20, 10, 1.0, None, block_length))
+
+    assert len(start) > 5
+    assert streamed == pytest.approx(list(zip(start, end)))
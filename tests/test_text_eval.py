@@ -0,0 +1,85 @@
+import random
+import re
+import string
+
+import pytest
+
+import text_eval
+from text_index import TextIndex
+
+SPECIAL_WORDS = ["Straße", "İstanbul", "Ёлка"]
+
+
+def _source_text(words, seed):
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(words):
+        if rng.random() < 0.05:
+            parts.append(rng.choice(SPECIAL_WORDS))
+        else:
+            parts.append("".join(rng.choice("абвгдеклмнопрстуАБВ") for _ in range(rng.randint(1, 9))))
+        parts.append(rng.choice([" ", " ", " ", ", ", ".\n", " - ", "  ", "\t", " 42 ", "! «", "» "]))
+    return "".join(parts)
+
+
+def _old_normalize(text):
+    # normalization before offsets were kept, verbatim
+    text = re.sub(r"\\d+", "", text.lower())
+    text = text.translate(str.maketrans("", "", string.punctuation))
+    return " ".join(text.strip().split())
+
+
+def _sentences(text, count, seed):
+    rng = random.Random(seed)
+    # sentences don't overlap, like ASR results of consecutive chunks
+    for start in sorted(rng.sample(range(0, len(text) - 80, 80), count)):
+        sentence = list(text[start:start + rng.randint(20, 70)])
+        for _ in range(rng.randint(0, 4)):
+            sentence[rng.randrange(len(sentence))] = rng.choice("абвгд ")
+        yield "".join(sentence).strip()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_normalize_text_offsets_map_to_source(seed):
+    text = _source_text(300, seed)
+    normalized, offsets = text_eval.normalize_text(text)
+
+    assert normalized == _old_normalize(text)
+    assert len(offsets) == len(normalized)
+    assert list(offsets) == sorted(offsets)
+    for char, pos in zip(normalized, offsets):
+        if char == " ":
+            assert text[pos].isspace()
+        else:
+            assert char in text[pos].lower()
+
+
+def test_matches_same_as_fuzzysearch():
+    Levenshtein = pytest.importorskip("Levenshtein")
+    fuzzysearch = pytest.importorskip("fuzzysearch")
+
+    text = _source_text(3000, seed=7)
+    normalized, offsets = text_eval.normalize_text(text)
+    text_index = TextIndex.build(normalized)
+
+    cursor = 0
+    for sentence in _sentences(normalized, 100, seed=8):
+        # search used before the single-pass matcher: fuzzy matches at growing distance, closest one wins
+        q_factor = 5
+        fuzzymatches = fuzzysearch.find_near_matches(sentence, normalized, max_l_dist=q_factor)
+        while not fuzzymatches:
+            q_factor += 2
+            fuzzymatches = fuzzysearch.find_near_matches(sentence, normalized, max_l_dist=q_factor)
+        old = min(fuzzymatches, key=lambda match: Levenshtein.distance(match.matched, sentence))
+
+        best = text_eval.get_best_match(sentence, normalized, 15)
+        assert best.dist == old.dist
+        # among equally close substrings the earliest end is taken, so bounds may move by a few characters
+        assert abs(best.start - old.start) <= best.dist and abs(best.end - old.end) <= best.dist
+        if not best.dist:
+            assert (best.start, best.end) == (old.start, old.end)
+        assert text_eval.match_sentence(sentence, normalized, 15, text_index) == best
+        # sentences are in text order, so monotonic search finds the same spans
+        assert text_eval.match_sentence(sentence, normalized, 15, text_index, cursor) == best
+        cursor = best.end
+        assert text[offsets[best.start]].lower().startswith(best.matched[0])